@@ -1,2 +1,71 @@
+import abc
+import queue
+import threading
+from typing import List, Tuple
+
+from src.utils.logger import log
+
+
 def send(*args):
     print("SENDING EMAIL:", *args)
+
+
+class AbstractEmailSender(abc.ABC):
+    @abc.abstractmethod
+    def send(self, to: str, subject: str, body: str = ""):
+        raise NotImplementedError
+
+
+class ConsoleEmailSender(AbstractEmailSender):
+    def send(self, to, subject, body=""):
+        send(to, subject, body)
+
+
+class BackgroundEmailSender(AbstractEmailSender):
+    """
+    Hands messages over to a worker thread, so that callers (i.e. request
+    handling) never block on mail delivery. When the queue is full,
+    messages are dropped and logged rather than applying backpressure.
+
+    """
+
+    def __init__(self, sender: AbstractEmailSender, max_queued: int = 1000):
+        self.sender = sender
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def send(self, to, subject, body=""):
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait((to, subject, body))
+        except queue.Full:
+            log.error("email queue full, dropping message %r", subject)
+
+    def join(self):
+        self._queue.join()
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            to, subject, body = self._queue.get()
+            try:
+                self.sender.send(to, subject, body)
+            except Exception:
+                log.exception("failed to send email %r", subject)
+            finally:
+                self._queue.task_done()
+
+
+# for mocks during tests
+class FakeEmailSender(AbstractEmailSender):
+    def __init__(self):
+        self.sent = []  # type: List[Tuple[str, str, str]]
+
+    def send(self, to, subject, body=""):
+        self.sent.append((to, subject, body))
@@ -0,0 +1,245 @@
+"""
+Event-sourced persistence for the Product aggregate.
+
+Instead of mapping batches and allocations onto tables, the events a
+Product raises are appended to `product_events`, one stream per sku
+numbered by `sequence`. A Product is rebuilt from its latest snapshot in
+`product_snapshots` plus the events recorded after it; a new snapshot is
+written every `snapshot_interval` events.
+
+Two writers appending to the same stream collide on the (sku, sequence)
+key, which is reported as a concurrency conflict.
+
+"""
+
+import json
+from datetime import date
+from typing import Dict, List, Optional
+
+from sqlalchemy import select
+
+from src.allocation.adapters import orm, repository, serialization
+from src.allocation.domain import events, model
+
+# events that change a Product's state; anything else it raises
+# (e.g. OutOfStock, or commands) is not recorded
+RECORDED_EVENTS = (
+    events.BatchCreated,
+    events.BatchQuantityChanged,
+    events.Allocated,
+    events.Deallocated,
+    events.AllocationStrategyChanged,
+    events.BatchArchived,
+    events.BatchExhausted,
+    events.StripesChanged,
+    events.LineQueued,
+    events.LineUnqueued,
+)
+
+
+# ---------
+# SNAPSHOTS
+# ---------
+def to_snapshot(product: model.Product) -> dict:
+    return dict(
+        allocation_strategy=product.allocation_strategy,
+        stripes=product.stripes,
+        batches=[
+            dict(
+                ref=batch.reference,
+                qty=batch._purchased_quantity,
+                eta=batch.eta and batch.eta.isoformat(),
+                exhausted_on=batch.exhausted_on and batch.exhausted_on.isoformat(),
+                allocations=[[l.orderid, l.qty] for l in batch._allocations],
+            )
+            for batch in product.batches
+        ],
+        waiting=[[l.orderid, l.qty] for l in product.waiting],
+    )
+
+
+def from_snapshot(sku: str, version_number: int, state: dict) -> model.Product:
+    batches = []
+    for b in state["batches"]:
+        batch = model.Batch(
+            b["ref"], sku, b["qty"], b["eta"] and date.fromisoformat(b["eta"])
+        )
+        batch._allocations.update(
+            model.OrderLine(orderid, sku, qty) for orderid, qty in b["allocations"]
+        )
+        if b.get("exhausted_on"):
+            batch.exhausted_on = date.fromisoformat(b["exhausted_on"])
+        batches.append(batch)
+    return model.Product(
+        sku,
+        batches,
+        version_number,
+        allocation_strategy=state["allocation_strategy"],
+        stripes=state.get("stripes", 0),
+        waiting=[
+            model.WaitingLine(orderid, sku, qty)
+            for orderid, qty in state.get("waiting", [])
+        ],
+    )
+
+
+class _Stream:
+    __slots__ = ("sequence", "snapshot_sequence")
+
+    def __init__(self, sequence: int = 0, snapshot_sequence: int = 0):
+        self.sequence = sequence
+        self.snapshot_sequence = snapshot_sequence
+
+
+class EventSourcedRepository(repository.AbstractProductRepository):
+    def __init__(self, session, snapshot_interval: int = 100):
+        super().__init__()
+        self.session = session
+        self.snapshot_interval = snapshot_interval
+        self._products = {}  # type: Dict[str, model.Product]
+        self._streams = {}  # type: Dict[str, _Stream]
+        # keyed by id(); holding the events keeps their ids from being reused
+        self._recorded = {}  # type: Dict[int, events.Event]
+
+    def _add(self, product):
+        self._products[product.sku] = product
+        self._streams[product.sku] = _Stream()
+
+    def _get(self, sku):
+        if sku in self._products:
+            return self._products[sku]
+        product = self._load(sku)
+        if product is not None:
+            self._products[sku] = product
+        return product
+
+    def _load(self, sku) -> Optional[model.Product]:
+        snapshot = self.session.execute(
+            select(orm.product_snapshots)
+            .where(orm.product_snapshots.c.sku == sku)
+            .order_by(orm.product_snapshots.c.sequence.desc())
+            .limit(1)
+        ).first()
+        after = snapshot.sequence if snapshot else 0
+        rows = self.session.execute(
+            select(
+                orm.product_events.c.sequence,
+                orm.product_events.c.version_number,
+                orm.product_events.c.payload,
+            )
+            .where(orm.product_events.c.sku == sku)
+            .where(orm.product_events.c.sequence > after)
+            .order_by(orm.product_events.c.sequence)
+        ).all()
+        if snapshot is None and not rows:
+            return None
+
+        if snapshot is not None:
+            product = from_snapshot(
+                sku, snapshot.version_number, json.loads(snapshot.state)
+            )
+        else:
+            product = model.Product(sku, [])
+        product.replay(serialization.from_dict(json.loads(row.payload)) for row in rows)
+        if rows:
+            product.version_number = rows[-1].version_number
+        self._streams[sku] = _Stream(rows[-1].sequence if rows else after, after)
+        return product
+
+    def _get_by_batchref(self, batchref):
+        sku = self.session.execute(
+            select(orm.product_events.c.sku)
+            .where(orm.product_events.c.batchref == batchref)
+            .limit(1)
+        ).scalar()
+        product = self._get(sku) if sku is not None else None
+        # the BatchCreated row outlives the batch once it is archived
+        if product is None or not any(b.reference == batchref for b in product.batches):
+            return None
+        return product
+
+    def _skus(self) -> List[str]:
+        query = select(orm.product_events.c.sku).distinct()
+        return [sku for (sku,) in self.session.execute(query)]
+
+    def list(self):
+        return [self._get(sku) for sku in self._skus()]
+
+    def skus(self, after=None, limit=100):
+        query = (
+            select(orm.product_events.c.sku)
+            .distinct()
+            .order_by(orm.product_events.c.sku)
+            .limit(limit)
+        )
+        if after is not None:
+            query = query.where(orm.product_events.c.sku > after)
+        return [sku for (sku,) in self.session.execute(query)]
+
+    def archive(self, product, batches):
+        # the BatchArchived events take them out of the stream
+        repository.insert_archive_rows(self.session, batches)
+
+    def iter_allocations(self, chunk_size=1000):
+        # no table to stream from: rebuilds one aggregate at a time, with
+        # _load() rather than _get() so that none of them are kept
+        for sku in self._skus():
+            for batch in self._rebuilt(sku).batches:
+                for line in batch._allocations:
+                    yield line.orderid, line.sku, line.qty, batch.reference
+
+    def iter_availability(self, chunk_size=1000):
+        # as above, in sku order
+        for sku in sorted(self._skus()):
+            for batch in self._rebuilt(sku).batches:
+                yield sku, batch.reference, batch.available_quantity
+
+    def _rebuilt(self, sku) -> model.Product:
+        # products already loaded may have changes not yet recorded
+        if sku in self._products:
+            return self._products[sku]
+        product = self._load(sku)
+        del self._streams[sku]  # positioned by _load(), only needed for writes
+        return product
+
+    def record_changes(self):
+        for product in self.seen:
+            new = [
+                e
+                for e in product.events
+                if isinstance(e, RECORDED_EVENTS) and id(e) not in self._recorded
+            ]
+            if not new:
+                continue
+            stream = self._streams[product.sku]
+            rows = []
+            for event in new:
+                stream.sequence += 1
+                rows.append(
+                    dict(
+                        sku=product.sku,
+                        sequence=stream.sequence,
+                        version_number=product.version_number,
+                        batchref=(
+                            event.ref
+                            if isinstance(event, events.BatchCreated)
+                            else None
+                        ),
+                        payload=json.dumps(serialization.to_dict(event)),
+                    )
+                )
+                self._recorded[id(event)] = event
+            self.session.execute(orm.product_events.insert(), rows)
+
+            due = stream.sequence - stream.snapshot_sequence >= self.snapshot_interval
+            if self.snapshot_interval > 0 and due:
+                self.session.execute(
+                    orm.product_snapshots.insert(),
+                    dict(
+                        sku=product.sku,
+                        sequence=stream.sequence,
+                        version_number=product.version_number,
+                        state=json.dumps(to_snapshot(product)),
+                    ),
+                )
+                stream.snapshot_sequence = stream.sequence
@@ -0,0 +1,203 @@
+"""
+Request/response messaging over Unix sockets, between the API (or the
+consumer) and the sku-partitioned worker processes.
+
+Each frame is a 4-byte big-endian length followed by a payload in one of
+the serialization codecs. A request is a command, as serialization.dumps
+encodes it (so it carries the caller's trace); the response holds either
+the handler's result or the error it raised.
+
+"""
+
+import os
+import socket
+import struct
+import threading
+import socketserver
+from typing import Callable, Optional, Set
+
+from src.utils import tracing
+from src.utils.logger import log
+from src.allocation.adapters import serialization
+from src.allocation.domain import commands
+
+_HEADER = struct.Struct(">I")
+
+
+class WorkerUnavailable(ConnectionError):
+    """
+    The worker could not be reached; the command was not sent, so it can
+    safely be sent elsewhere.
+    """
+
+
+class RemoteError(Exception):
+    """
+    An error raised by the worker's handler, by class name; `conflict` if
+    it was a concurrency conflict the caller may retry.
+    """
+
+    def __init__(self, kind: str, message: str, conflict: bool = False):
+        super().__init__(message)
+        self.kind = kind
+        self.conflict = conflict
+
+
+def send_frame(sock: socket.socket, payload: bytes):
+    sock.sendall(_HEADER.pack(len(payload)) + payload)
+
+
+def recv_frame(sock: socket.socket) -> Optional[bytes]:
+    """
+    The next frame's payload, or None if the peer closed the connection.
+    """
+    header = _recv_exactly(sock, _HEADER.size)
+    if header is None:
+        return None
+    (length,) = _HEADER.unpack(header)
+    payload = _recv_exactly(sock, length)
+    if payload is None:
+        raise ConnectionResetError("connection closed mid-frame")
+    return payload
+
+
+def _recv_exactly(sock: socket.socket, n: int) -> Optional[bytes]:
+    chunks, remaining = [], n
+    while remaining:
+        chunk = sock.recv(remaining)
+        if not chunk:
+            if remaining == n:
+                return None
+            raise ConnectionResetError("connection closed mid-frame")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+
+class WorkerClient:
+    """
+    Sends commands to one worker, over a connection per calling thread
+    that is reopened after errors.
+    """
+
+    def __init__(self, path: str, codec: Optional[str] = None, timeout: float = 30.0):
+        self.path = path
+        self.codec = serialization.get_codec(codec)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def call(self, command: commands.Command):
+        frame = serialization.dumps(command, self.codec.name)
+        conn = self._connection()
+        try:
+            try:
+                send_frame(conn, frame)
+            except BrokenPipeError:
+                # the worker hung up on the idle connection (nothing was
+                # sent); reconnect once, in case it was restarted
+                self.close()
+                conn = self._connection()
+                send_frame(conn, frame)
+            data = recv_frame(conn)
+            if data is None:
+                raise ConnectionResetError(f"worker {self.path} hung up")
+        except OSError:
+            self.close()
+            raise
+        response = self.codec.loads(data)
+        if "error" in response:
+            raise RemoteError(
+                response["error"], response["message"], response.get("conflict", False)
+            )
+        return response["result"]
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _connection(self) -> socket.socket:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            conn.settimeout(self.timeout)
+            try:
+                conn.connect(self.path)
+            except OSError as e:
+                conn.close()
+                raise WorkerUnavailable(f"worker {self.path} unavailable: {e}")
+            self._local.conn = conn
+        return conn
+
+
+class _ConnectionHandler(socketserver.BaseRequestHandler):
+    def setup(self):
+        with self.server.connections_lock:
+            self.server.connections.add(self.request)
+
+    def finish(self):
+        with self.server.connections_lock:
+            self.server.connections.discard(self.request)
+
+    def handle(self):
+        while True:
+            try:
+                data = recv_frame(self.request)
+            except OSError:
+                return
+            if data is None:
+                return
+            codec = serialization.sniff_codec(data)
+            payload = codec.loads(data)
+            with tracing.continue_trace(
+                payload.get(serialization.TRACE_KEY), "ipc.serve"
+            ):
+                response = self.server.respond(payload)
+            send_frame(self.request, codec.dumps(response))
+
+
+class WorkerServer(socketserver.ThreadingUnixStreamServer):
+    """
+    Serves commands on a Unix socket, one thread per connection; `handle`
+    runs a command and returns its result, `is_conflict` classifies the
+    errors it raises.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        path: str,
+        handle: Callable[[commands.Command], object],
+        is_conflict: Callable[[Exception], bool] = lambda e: False,
+    ):
+        if os.path.exists(path):
+            os.unlink(path)  # left behind by a previous run
+        self.handle_command = handle
+        self.is_conflict = is_conflict
+        self.connections = set()  # type: Set[socket.socket]
+        self.connections_lock = threading.Lock()
+        super().__init__(path, _ConnectionHandler)
+
+    def respond(self, payload: dict) -> dict:
+        try:
+            command = serialization.from_dict(payload)
+            return dict(result=self.handle_command(command))
+        except Exception as e:
+            log.debug("command %s failed: %r", payload, e)
+            return dict(
+                error=type(e).__name__, message=str(e), conflict=self.is_conflict(e)
+            )
+
+    def server_close(self):
+        super().server_close()
+        # hang up on clients too, so they reconnect (or fail over) at once
+        with self.connections_lock:
+            for conn in self.connections:
+                try:
+                    conn.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
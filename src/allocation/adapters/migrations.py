@@ -0,0 +1,67 @@
+"""
+Data migrations between the two allocation layouts in orm.py.
+
+Moving to ALLOCATION_STORAGE=batch_allocations:
+
+    1. copy_to_batch_allocations(), with writers stopped
+    2. restart the services with ALLOCATION_STORAGE=batch_allocations
+    3. once happy, prune_join_table() to drop the old rows
+
+Until step 3, switching back only loses allocations made since step 2.
+
+"""
+
+from sqlalchemy import delete, insert, select
+
+from src.allocation.adapters import orm
+
+
+def copy_to_batch_allocations(connection) -> int:
+    """
+    Copies every (order line, allocation) pair into batch_allocations,
+    skipping batches that already have rows there, so it can be re-run.
+    Returns the number of rows copied.
+    """
+    already_copied = select(orm.batch_allocations.c.batch_id)
+    rows = (
+        select(
+            orm.allocations.c.batch_id,
+            orm.order_lines.c.orderid,
+            orm.order_lines.c.sku,
+            orm.order_lines.c.qty,
+        )
+        .select_from(
+            orm.allocations.join(
+                orm.order_lines,
+                orm.order_lines.c.id == orm.allocations.c.orderline_id,
+            )
+        )
+        .where(orm.allocations.c.batch_id.not_in(already_copied))
+        .order_by(orm.allocations.c.id)
+    )
+    result = connection.execute(
+        insert(orm.batch_allocations).from_select(
+            ["batch_id", "orderid", "sku", "qty"], rows
+        )
+    )
+    return result.rowcount
+
+
+def prune_join_table(connection) -> int:
+    """
+    Deletes the migrated rows from allocations, then every order line no
+    longer referenced by an allocation (which includes lines left behind by
+    earlier deallocations). Returns the number of allocations deleted.
+    """
+    migrated = orm.allocations.c.batch_id.in_(select(orm.batch_allocations.c.batch_id))
+    count = connection.execute(delete(orm.allocations).where(migrated)).rowcount
+    connection.execute(
+        delete(orm.order_lines).where(
+            orm.order_lines.c.id.not_in(
+                select(orm.allocations.c.orderline_id).where(
+                    orm.allocations.c.orderline_id.isnot(None)
+                )
+            )
+        )
+    )
+    return count
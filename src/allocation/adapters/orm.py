@@ -1,7 +1,21 @@
-from sqlalchemy import MetaData, Table, Column, Integer, String, Date, ForeignKey, event
+from sqlalchemy import (
+    MetaData,
+    Table,
+    Column,
+    Integer,
+    String,
+    Date,
+    Text,
+    ForeignKey,
+    UniqueConstraint,
+    CheckConstraint,
+    event,
+    select,
+)
 from sqlalchemy.orm import mapper, relationship
 
-from src.allocation.domain import model
+from src.allocation import config
+from src.allocation.domain import model, strategies
 
 metadata = MetaData()
 
@@ -19,6 +33,13 @@ products = Table(
     metadata,
     Column("sku", String(255), primary_key=True),
     Column("version_number", Integer, nullable=False, server_default="0"),
+    Column(
+        "allocation_strategy",
+        String(32),
+        nullable=False,
+        server_default=strategies.DEFAULT_STRATEGY,
+    ),
+    Column("stripes", Integer, nullable=False, server_default="0"),
 )
 
 batches = Table(
@@ -29,6 +50,7 @@ batches = Table(
     Column("sku", ForeignKey("products.sku")),
     Column("_purchased_quantity", Integer, nullable=False),
     Column("eta", Date, nullable=True),
+    Column("exhausted_on", Date, nullable=True),
 )
 
 allocations = Table(
@@ -39,25 +61,171 @@ allocations = Table(
     Column("batch_id", ForeignKey("batches.id")),
 )
 
+# denormalised alternative to order_lines + allocations: one row per
+# allocation, so allocating and deallocating touch a single table
+batch_allocations = Table(
+    "batch_allocations",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("batch_id", ForeignKey("batches.id"), nullable=False, index=True),
+    Column("orderid", String(255), nullable=False),
+    Column("sku", String(255), nullable=False),
+    Column("qty", Integer, nullable=False),
+)
+
+# which of the two layouts above Batch._allocations is mapped onto;
+# set by start_mappers()
+JOIN_TABLE, BATCH_ALLOCATIONS = "join_table", "batch_allocations"
+allocation_storage = JOIN_TABLE
+
+# lines waiting for stock (see Product.allocate), in order of arrival
+waiting_lines = Table(
+    "waiting_lines",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("sku", ForeignKey("products.sku"), nullable=False, index=True),
+    Column("orderid", String(255), nullable=False),
+    Column("qty", Integer, nullable=False),
+)
+
+# remaining stock of the batches of striped products, split into
+# products.stripes rows per batch that are allocated from (and locked)
+# independently; see domain/striping.py and adapters/stripes.py
+stock_stripes = Table(
+    "stock_stripes",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("sku", String(255), nullable=False, index=True),
+    Column("batchref", String(255), nullable=False),
+    Column("stripe", Integer, nullable=False),
+    Column("available", Integer, nullable=False),
+    Column("version", Integer, nullable=False, server_default="0"),
+    UniqueConstraint("batchref", "stripe", name="uq_stock_stripes_stripe"),
+    CheckConstraint("available >= 0", name="ck_stock_stripes_available"),
+)
+
+# batches retired from their Product (see Batch.is_retirable), with the
+# lines that were allocated to them
+archived_batches = Table(
+    "archived_batches",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("reference", String(255), nullable=False, index=True),
+    Column("sku", String(255), nullable=False, index=True),
+    Column("purchased_quantity", Integer, nullable=False),
+    Column("eta", Date, nullable=True),
+    Column("archived_on", Date, nullable=False),
+)
+
+archived_allocations = Table(
+    "archived_allocations",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("batchref", String(255), nullable=False, index=True),
+    Column("orderid", String(255), nullable=False),
+    Column("sku", String(255), nullable=False),
+    Column("qty", Integer, nullable=False),
+)
+
+# append-only event store, used instead of the tables above when
+# PERSISTENCE_MODE is "events" (see adapters/event_store.py)
+product_events = Table(
+    "product_events",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("sku", String(255), nullable=False),
+    Column("sequence", Integer, nullable=False),
+    Column("version_number", Integer, nullable=False),
+    Column("batchref", String(255), index=True),
+    Column("payload", Text, nullable=False),
+    UniqueConstraint("sku", "sequence", name="uq_product_events_stream"),
+)
+
+product_snapshots = Table(
+    "product_snapshots",
+    metadata,
+    Column("sku", String(255), primary_key=True),
+    Column("sequence", Integer, primary_key=True),
+    Column("version_number", Integer, nullable=False),
+    Column("state", Text, nullable=False),
+)
+
+
+def start_mappers(storage: str = None):
+    global allocation_storage
+    allocation_storage = storage or config.get_allocation_storage()
+    if allocation_storage == BATCH_ALLOCATIONS:
+        lines_mapper = mapper(model.OrderLine, batch_allocations)
+        # removing a line from a batch deletes its row
+        allocations_relationship = relationship(
+            lines_mapper, collection_class=set, cascade="all, delete-orphan"
+        )
+    elif allocation_storage == JOIN_TABLE:
+        lines_mapper = mapper(model.OrderLine, order_lines)
+        allocations_relationship = relationship(
+            lines_mapper, secondary=allocations, collection_class=set
+        )
+    else:
+        raise ValueError(f"Unknown allocation storage {allocation_storage!r}")
 
-def start_mappers():
-    lines_mapper = mapper(model.OrderLine, order_lines)
     batches_mapper = mapper(
         model.Batch,
         batches,
-        properties={
-            "_allocations": relationship(
-                lines_mapper,
-                secondary=allocations,
-                collection_class=set,
-            )
-        },
+        properties={"_allocations": allocations_relationship},
     )
+    waiting_mapper = mapper(model.WaitingLine, waiting_lines)
     mapper(
-        model.Product, products, properties={"batches": relationship(batches_mapper)}
+        model.Product,
+        products,
+        # updates check the version they were loaded at, so that a product
+        # kept in a session across transactions (see
+        # SqlAlchemyUnitOfWork.shared_session) can't overwrite a newer one;
+        # the domain bumps it itself
+        version_id_col=products.c.version_number,
+        version_id_generator=False,
+        properties={
+            # in order of creation, which strategies break ties by (and
+            # adapters/sql_allocation.py too)
+            "batches": relationship(batches_mapper, order_by=batches.c.id),
+            # lines leaving the queue delete their row
+            "waiting": relationship(
+                waiting_mapper,
+                order_by=waiting_lines.c.id,
+                cascade="all, delete-orphan",
+            ),
+        },
     )
 
 
+def allocation_rows():
+    """
+    A selectable of (id, batch_id, orderid, sku, qty) per allocation, over
+    whichever layout is mapped, for queries that bypass the aggregate.
+    """
+    if allocation_storage == BATCH_ALLOCATIONS:
+        query = select(
+            batch_allocations.c.id,
+            batch_allocations.c.batch_id,
+            batch_allocations.c.orderid,
+            batch_allocations.c.sku,
+            batch_allocations.c.qty,
+        )
+    else:
+        query = select(
+            allocations.c.id,
+            allocations.c.batch_id,
+            order_lines.c.orderid,
+            order_lines.c.sku,
+            order_lines.c.qty,
+        ).select_from(
+            allocations.join(
+                order_lines, order_lines.c.id == allocations.c.orderline_id
+            )
+        )
+    return query.subquery("allocation_rows")
+
+
 @event.listens_for(model.Product, "load")
 def receive_load(product, _):
     product.events = []
+    product._index = None
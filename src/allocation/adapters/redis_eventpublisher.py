@@ -1,15 +1,21 @@
-import json
-from dataclasses import asdict
 import redis
 
 from src.allocation import config
 from src.allocation.domain import events
+from src.allocation.adapters import serialization
+from src.utils import metrics, tracing
 from src.utils.logger import log
 
-
 r = redis.Redis(**config.get_redis_host_and_port())
 
+PUBLISH_LATENCY = metrics.histogram(
+    "allocation_redis_publish_duration_seconds", "Time spent publishing to redis."
+)
+
 
 def publish(channel, event: events.Event):
     log.debug("publishing: channel=%s, event=%s", channel, event)
-    r.publish(channel, json.dumps(asdict(event)))
+    with tracing.span("redis.publish", channel=channel):
+        data = serialization.dumps(event)
+        with PUBLISH_LATENCY.time(channel=channel):
+            r.publish(channel, data)
@@ -0,0 +1,140 @@
+"""
+Read replicas of the database, for queries that can be answered from a
+slightly stale copy (see unit_of_work.ReadOnlyUnitOfWork), so that they
+don't compete with allocations for the primary.
+
+"""
+
+import time
+import threading
+from typing import List, Optional, Sequence
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker
+
+from src.allocation import config
+from src.utils import metrics
+from src.utils.logger import log
+
+READS = metrics.counter(
+    "allocation_replica_reads_total", "Read-only units of work, by where they ran."
+)
+
+# seconds a Postgres standby is behind its primary; 0 when it has replayed
+# everything it received, so that an idle primary doesn't count as lag
+POSTGRES_LAG = """
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(
+            EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0
+        )
+    END
+"""
+
+
+class Replica:
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self.session_factory = sessionmaker(bind=engine)
+        self.name = repr(engine.url)
+        self.checked_at = None  # type: Optional[float]
+        self.down_since = None  # type: Optional[float]
+
+
+class ReplicaSet:
+    """
+    Hands out session factories for healthy replicas, in turn, or for the
+    primary when none is healthy.
+
+    A replica is checked when first picked and every `check_interval`
+    seconds after; one that fails a check, or breaks while in use (see
+    mark_down), is left out for `retry_after` seconds. Postgres standbys
+    more than `max_lag` seconds behind fail their checks.
+
+    """
+
+    def __init__(
+        self,
+        primary: sessionmaker,
+        replicas: Sequence[Engine] = (),
+        check_interval: float = 5.0,
+        retry_after: float = 30.0,
+        max_lag: float = 5.0,
+    ):
+        self.primary = primary
+        self.replicas = [Replica(engine) for engine in replicas]
+        self.check_interval = check_interval
+        self.retry_after = retry_after
+        self.max_lag = max_lag
+        self._turn = 0
+        self._lock = threading.Lock()
+
+    def pick(self) -> Optional[Replica]:
+        """
+        The next healthy replica, or None to use the primary.
+        """
+        for _ in range(len(self.replicas)):
+            with self._lock:
+                replica = self.replicas[self._turn % len(self.replicas)]
+                self._turn += 1
+                now = time.monotonic()
+                if replica.down_since is not None:
+                    if now - replica.down_since < self.retry_after:
+                        continue
+                    replica.down_since = None
+                due = (
+                    replica.checked_at is None
+                    or now - replica.checked_at >= self.check_interval
+                )
+                if due:
+                    # other threads carry on using it meanwhile
+                    replica.checked_at = now
+            if not due or self.check(replica):
+                READS.inc(target="replica")
+                return replica
+        READS.inc(target="primary")
+        return None
+
+    def check(self, replica: Replica) -> bool:
+        try:
+            with replica.engine.connect() as connection:
+                if replica.engine.dialect.name == "postgresql":
+                    lag = connection.execute(text(POSTGRES_LAG)).scalar()
+                    if lag > self.max_lag:
+                        self.mark_down(replica, f"{lag:.1f}s behind")
+                        return False
+                else:
+                    connection.execute(text("SELECT 1"))
+        except Exception as e:
+            self.mark_down(replica, e)
+            return False
+        return True
+
+    def mark_down(self, replica: Replica, reason):
+        with self._lock:
+            if replica.down_since is None:
+                log.warning(
+                    "replica %s is unhealthy (%s); reading from the others",
+                    replica.name,
+                    reason,
+                )
+                replica.down_since = time.monotonic()
+
+    def session_factory(self, replica: Optional[Replica]) -> sessionmaker:
+        return replica.session_factory if replica is not None else self.primary
+
+
+def from_config(primary: sessionmaker) -> ReplicaSet:
+    # pre-ping, so that connections a replica dropped aren't handed out
+    engines = [
+        create_engine(uri, isolation_level="REPEATABLE READ", pool_pre_ping=True)
+        for uri in config.get_replica_uris()
+    ]  # type: List[Engine]
+    return ReplicaSet(
+        primary,
+        engines,
+        check_interval=config.get_replica_check_interval(),
+        retry_after=config.get_replica_retry_after(),
+        max_lag=config.get_replica_max_lag(),
+    )
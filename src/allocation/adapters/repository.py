@@ -1,6 +1,11 @@
 import abc
-from typing import Set
+from datetime import date
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 
+from sqlalchemy import func, inspect, lambda_stmt, select
+from sqlalchemy.sql.lambdas import StatementLambdaElement
+
+from src.utils import tracing
 from src.allocation.domain import model
 from src.allocation.adapters import orm
 
@@ -14,17 +19,25 @@ class AbstractProductRepository(abc.ABC):
         self.seen.add(product)  # note this is Set.add()
 
     def get(self, sku) -> model.Product:
-        product = self._get(sku)
+        with tracing.span("repository.get", sku=sku):
+            product = self._get(sku)
         if product:
             self.seen.add(product)
         return product
 
     def get_by_batchref(self, batchref) -> model.Product:
-        product = self._get_by_batchref(batchref)
+        with tracing.span("repository.get_by_batchref", batchref=batchref):
+            product = self._get_by_batchref(batchref)
         if product:
             self.seen.add(product)
         return product
 
+    def record_changes(self):
+        """
+        Called by the unit of work just before it commits, for repositories
+        that persist changes themselves rather than through the session.
+        """
+
     @abc.abstractmethod
     def _add(self, product: model.Product):
         raise NotImplementedError
@@ -41,6 +54,67 @@ class AbstractProductRepository(abc.ABC):
     def list(self):
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def skus(self, after: Optional[str] = None, limit: int = 100) -> List[str]:
+        """
+        Up to `limit` skus, in order, starting after `after`; for jobs that
+        walk every product in bounded chunks.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def archive(self, product: model.Product, batches: List[model.Batch]):
+        """
+        Moves batches retired from `product` (and their allocations) into
+        the archive tables.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def iter_allocations(
+        self, chunk_size: int = 1000
+    ) -> Iterator[Tuple[str, str, int, str]]:
+        """
+        Yields (orderid, sku, qty, batchref) for every allocation, without
+        loading the aggregates; implementations fetch `chunk_size` rows
+        at a time.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def iter_availability(
+        self, chunk_size: int = 1000
+    ) -> Iterator[Tuple[str, str, int]]:
+        """
+        Yields (sku, batchref, available) for every batch, ordered by sku,
+        without loading the aggregates; implementations fetch `chunk_size`
+        rows at a time.
+        """
+        raise NotImplementedError
+
+
+# lambda statements are built once per call site (and mapping, as tests
+# remap the classes), and after that only have their arguments bound into
+# them, which is much cheaper than constructing (and generating a cache
+# key for) the statement every time
+
+
+def _product_by_sku(sku: str) -> StatementLambdaElement:
+    return lambda_stmt(
+        lambda: select(model.Product).where(orm.products.c.sku == sku),
+        track_on=[inspect(model.Product)],
+    )
+
+
+def _product_by_batchref(batchref: str) -> StatementLambdaElement:
+    return lambda_stmt(
+        lambda: select(model.Product)
+        .join(model.Batch)
+        .where(orm.batches.c.reference == batchref)
+        .limit(1),
+        track_on=[inspect(model.Product)],
+    )
+
 
 class SqlAlchemyRepository(AbstractProductRepository):
     def __init__(self, session):
@@ -51,24 +125,144 @@ class SqlAlchemyRepository(AbstractProductRepository):
         self.session.add(product)
 
     def _get(self, sku: str):
-        return self.session.query(model.Product).filter_by(sku=sku).first()
+        # answered from the identity map when the session already has it
+        product = self.session.identity_map.get(
+            self.session.identity_key(model.Product, sku)
+        )
+        if product is not None and not inspect(product).expired:
+            return product
+        return self.session.execute(_product_by_sku(sku)).scalars().first()
 
     def _get_by_batchref(self, batchref):
-        return (
-            self.session.query(model.Product)
-            .join(model.Batch)
-            .filter(orm.batches.c.reference == batchref)
-        ).first()
+        return self.session.execute(_product_by_batchref(batchref)).scalars().first()
 
     def list(self):
         return self.session.query(model.Product).all()
 
+    def skus(self, after=None, limit=100):
+        query = select(orm.products.c.sku).order_by(orm.products.c.sku).limit(limit)
+        if after is not None:
+            query = query.where(orm.products.c.sku > after)
+        return [sku for (sku,) in self.session.execute(query)]
+
+    def archive(self, product, batches):
+        insert_archive_rows(self.session, batches)
+        for batch in batches:
+            for line in batch._allocations:
+                self.session.delete(line)
+            self.session.delete(batch)
+
+    def iter_allocations(self, chunk_size=1000):
+        # stream_results gives us a server-side cursor where the driver
+        # supports one, so memory stays flat regardless of table size
+        rows = orm.allocation_rows()
+        query = (
+            select(rows.c.orderid, rows.c.sku, rows.c.qty, orm.batches.c.reference)
+            .select_from(rows.join(orm.batches, orm.batches.c.id == rows.c.batch_id))
+            .order_by(rows.c.id)
+        )
+        result = self.session.execute(query, execution_options={"stream_results": True})
+        for partition in result.partitions(chunk_size):
+            for row in partition:
+                yield tuple(row)
+
+    def iter_availability(self, chunk_size=1000):
+        b, al = orm.batches, orm.allocation_rows()
+        query = (
+            select(
+                b.c.sku,
+                b.c.reference,
+                b.c._purchased_quantity - func.coalesce(func.sum(al.c.qty), 0),
+            )
+            .select_from(b.outerjoin(al, al.c.batch_id == b.c.id))
+            .group_by(b.c.id, b.c.sku, b.c.reference, b.c._purchased_quantity)
+            .order_by(b.c.sku, b.c.id)
+        )
+        result = self.session.execute(query, execution_options={"stream_results": True})
+        for partition in result.partitions(chunk_size):
+            for row in partition:
+                yield tuple(row)
+
+
+class ResidentRepository(SqlAlchemyRepository):
+    """
+    Keeps the products it loads (or is given) for the lifetime of its
+    session, answering later gets without a query; only safe for the
+    single owner of those products (see service_layer/actors.py).
+    """
+
+    def __init__(self, session):
+        super().__init__(session)
+        self._resident = {}  # type: Dict[str, model.Product]
+
+    def _add(self, product):
+        super()._add(product)
+        self._resident[product.sku] = product
+
+    def _get(self, sku):
+        product = self._resident.get(sku)
+        if product is None:
+            product = super()._get(sku)
+            if product is not None:
+                self._resident[sku] = product
+        return product
+
+    def _get_by_batchref(self, batchref):
+        # the session's identity map hands back the resident instance
+        product = super()._get_by_batchref(batchref)
+        if product is not None:
+            self._resident.setdefault(product.sku, product)
+        return product
+
+
+def insert_allocation_row(session, batch_id: int, line: model.OrderLine):
+    """
+    Allocates the line to the batch with `batch_id` straight in the
+    database, for allocations that bypass the aggregate.
+    """
+    if orm.allocation_storage == orm.BATCH_ALLOCATIONS:
+        session.execute(
+            orm.batch_allocations.insert(),
+            dict(batch_id=batch_id, orderid=line.orderid, sku=line.sku, qty=line.qty),
+        )
+        return
+    result = session.execute(
+        orm.order_lines.insert(),
+        dict(orderid=line.orderid, sku=line.sku, qty=line.qty),
+    )
+    session.execute(
+        orm.allocations.insert(),
+        dict(orderline_id=result.inserted_primary_key[0], batch_id=batch_id),
+    )
+
+
+def insert_archive_rows(session, batches: List[model.Batch]):
+    today = date.today()
+    for batch in batches:
+        session.execute(
+            orm.archived_batches.insert(),
+            dict(
+                reference=batch.reference,
+                sku=batch.sku,
+                purchased_quantity=batch._purchased_quantity,
+                eta=batch.eta,
+                archived_on=today,
+            ),
+        )
+        lines = [
+            dict(batchref=batch.reference, orderid=l.orderid, sku=l.sku, qty=l.qty)
+            for l in batch._allocations
+        ]
+        if lines:
+            session.execute(orm.archived_allocations.insert(), lines)
+
 
 # for mocks during tests
 class FakeRepository(AbstractProductRepository):
     def __init__(self, products):
         super().__init__()
         self._products = set(products)
+        self.archived = []  # type: List[model.Batch]
 
     def _add(self, product):
         self._products.add(product)
@@ -85,6 +279,24 @@ class FakeRepository(AbstractProductRepository):
     def list(self):
         return list(self._products)
 
+    def skus(self, after=None, limit=100):
+        skus = sorted(p.sku for p in self._products)
+        return [sku for sku in skus if after is None or sku > after][:limit]
+
+    def archive(self, product, batches):
+        self.archived.extend(batches)
+
+    def iter_allocations(self, chunk_size=1000):
+        for product in self._products:
+            for batch in product.batches:
+                for line in batch._allocations:
+                    yield line.orderid, line.sku, line.qty, batch.reference
+
+    def iter_availability(self, chunk_size=1000):
+        for product in sorted(self._products, key=lambda p: p.sku):
+            for batch in product.batches:
+                yield product.sku, batch.reference, batch.available_quantity
+
     # fixtures for keeping all of our tests' domain-model dependencies,
     # so we can keep those dependencies decoupled from our test definitions
     @staticmethod
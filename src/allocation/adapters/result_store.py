@@ -0,0 +1,130 @@
+"""
+Stores for the results of already-processed commands, keyed by
+idempotency key, so that retried commands can be answered without
+touching the aggregate again. Results can be put in a group (e.g. all
+those for one order line, whatever their key) to be discarded together.
+
+"""
+
+import abc
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Set
+
+import redis
+
+from src.allocation import config
+
+
+class AbstractResultStore(abc.ABC):
+    @abc.abstractmethod
+    def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def put(self, key: str, result: str, group: Optional[str] = None):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def discard(self, key: str):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def discard_group(self, group: str):
+        raise NotImplementedError
+
+
+class InMemoryResultStore(AbstractResultStore):
+    """
+    Bounded, thread-safe LRU store local to this process.
+
+    """
+
+    def __init__(self, max_size: int = 10_000):
+        self.max_size = max_size
+        # key -> (result, group)
+        self._results = OrderedDict()  # type: OrderedDict[str, tuple]
+        self._groups = {}  # type: Dict[str, Set[str]]
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._results.get(key)
+            if entry is None:
+                return None
+            self._results.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, result, group=None):
+        with self._lock:
+            self._pop(key)
+            self._results[key] = (result, group)
+            if group is not None:
+                self._groups.setdefault(group, set()).add(key)
+            while len(self._results) > self.max_size:
+                self._pop(next(iter(self._results)))
+
+    def discard(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def discard_group(self, group):
+        with self._lock:
+            for key in self._groups.pop(group, ()):
+                self._results.pop(key, None)
+
+    def _pop(self, key):
+        entry = self._results.pop(key, None)
+        if entry is not None and entry[1] is not None:
+            members = self._groups[entry[1]]
+            members.discard(key)
+            if not members:
+                del self._groups[entry[1]]
+
+    def __len__(self):
+        return len(self._results)
+
+
+class RedisResultStore(AbstractResultStore):
+    """
+    Shares results between processes; entries expire after `ttl` seconds,
+    which is what bounds the store.
+
+    """
+
+    def __init__(self, client: redis.Redis, ttl: int = 3600, prefix="results:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        result = self.client.get(self.prefix + key)
+        return result.decode() if result is not None else None
+
+    def put(self, key, result, group=None):
+        pipe = self.client.pipeline()
+        pipe.set(self.prefix + key, result, ex=self.ttl)
+        if group is not None:
+            # expires along with the group's newest member
+            pipe.sadd(self._group_key(group), key)
+            pipe.expire(self._group_key(group), self.ttl)
+        pipe.execute()
+
+    def discard(self, key):
+        self.client.delete(self.prefix + key)
+
+    def discard_group(self, group):
+        keys = self.client.smembers(self._group_key(group))
+        self.client.delete(
+            self._group_key(group), *(self.prefix + k.decode() for k in keys)
+        )
+
+    def _group_key(self, group):
+        return f"{self.prefix}group:{group}"
+
+
+def from_config() -> AbstractResultStore:
+    if config.get_result_store_backend() == "redis":
+        client = redis.Redis(**config.get_redis_host_and_port())
+        return RedisResultStore(client, ttl=config.get_result_store_ttl())
+    return InMemoryResultStore(max_size=config.get_result_store_size())
@@ -0,0 +1,236 @@
+"""
+Codecs for serializing domain messages (events and commands) onto the wire.
+
+Every registered dataclass gets an encoder and a decoder built once at
+import time from its fields, so encoding avoids the recursive deep-copy
+done by dataclasses.asdict(). Fields missing from a payload decode to
+their declared defaults. Payloads stay flat (consumers can keep reading
+e.g. data["orderid"]) and carry two reserved keys:
+
+    _type : name of the message class
+    _v    : schema version of the payload
+    _trace: traceparent of the span that produced it, when one is active
+
+"""
+
+import abc
+import json
+import dataclasses
+from datetime import date
+from typing import Callable, Dict, Optional, Type
+
+from src.allocation import config
+from src.allocation.domain import commands, events
+from src.utils import tracing
+
+try:
+    import msgpack
+except ImportError:  # msgpack is an optional dependency
+    msgpack = None
+
+
+SCHEMA_VERSION = 1
+TYPE_KEY = "_type"
+VERSION_KEY = "_v"
+TRACE_KEY = "_trace"
+
+
+class SerializationError(Exception):
+    pass
+
+
+class IncompatibleSchema(SerializationError):
+    pass
+
+
+# ------
+# CODECS
+# ------
+class AbstractCodec(abc.ABC):
+    name = None  # type: str
+
+    @abc.abstractmethod
+    def dumps(self, payload: dict) -> bytes:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def loads(self, data: bytes) -> dict:
+        raise NotImplementedError
+
+
+class JsonCodec(AbstractCodec):
+    name = "json"
+
+    def __init__(self):
+        self._encoder = json.JSONEncoder(separators=(",", ":"))
+        self._decoder = json.JSONDecoder()
+
+    def dumps(self, payload: dict) -> bytes:
+        return self._encoder.encode(payload).encode()
+
+    def loads(self, data: bytes) -> dict:
+        if isinstance(data, (bytes, bytearray)):
+            data = data.decode()
+        return self._decoder.decode(data)
+
+
+class MsgpackCodec(AbstractCodec):
+    name = "msgpack"
+
+    def __init__(self):
+        if msgpack is None:
+            raise SerializationError("msgpack codec requested but not installed")
+        self._packer = msgpack.Packer(use_bin_type=True)
+
+    def dumps(self, payload: dict) -> bytes:
+        return self._packer.pack(payload)
+
+    def loads(self, data: bytes) -> dict:
+        return msgpack.unpackb(data, raw=False)
+
+
+CODECS = {"json": JsonCodec()}  # type: Dict[str, AbstractCodec]
+if msgpack is not None:
+    CODECS["msgpack"] = MsgpackCodec()
+
+
+def get_codec(name: Optional[str] = None) -> AbstractCodec:
+    name = name or config.get_message_codec()
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise SerializationError(f"Unknown or unavailable codec {name!r}")
+
+
+def sniff_codec(data: bytes) -> AbstractCodec:
+    """
+    Picks the codec for an incoming message from its first byte;
+    JSON objects start with '{', msgpack maps with 0x80-0x8f or 0xde/0xdf.
+
+    """
+    first = data[:1]
+    if first in (b"{", "{"):
+        return CODECS["json"]
+    return get_codec("msgpack")
+
+
+# ------------------------------
+# PER-DATACLASS ENCODERS/DECODERS
+# ------------------------------
+ENCODERS = {}  # type: Dict[Type, Callable[[object], dict]]
+DECODERS = {}  # type: Dict[str, Callable[[dict], object]]
+
+
+def _is_date_field(field: dataclasses.Field) -> bool:
+    return field.type is date or field.type == Optional[date]
+
+
+def _has_default(field: dataclasses.Field) -> bool:
+    return (
+        field.default is not dataclasses.MISSING
+        or field.default_factory is not dataclasses.MISSING
+    )
+
+
+def _make_encoder(cls: Type) -> Callable[[object], dict]:
+    names = [(f.name, _is_date_field(f)) for f in dataclasses.fields(cls)]
+    type_name = cls.__name__
+
+    def encode(obj) -> dict:
+        payload = {}
+        for name, is_date in names:
+            value = getattr(obj, name)
+            if is_date and value is not None:
+                value = value.isoformat()
+            payload[name] = value
+        payload[TYPE_KEY] = type_name
+        payload[VERSION_KEY] = SCHEMA_VERSION
+        return payload
+
+    return encode
+
+
+def _make_decoder(cls: Type) -> Callable[[dict], object]:
+    names = [
+        (f.name, _is_date_field(f), _has_default(f)) for f in dataclasses.fields(cls)
+    ]
+
+    def decode(payload: dict):
+        kwargs = {}
+        for name, is_date, has_default in names:
+            if name not in payload:
+                # missing optional fields fall back to the dataclass's default
+                if has_default:
+                    continue
+                raise SerializationError(f"{cls.__name__} payload is missing {name!r}")
+            value = payload[name]
+            if is_date and value is not None:
+                value = date.fromisoformat(value)
+            kwargs[name] = value
+        return cls(**kwargs)
+
+    return decode
+
+
+def register(cls: Type) -> Type:
+    ENCODERS[cls] = _make_encoder(cls)
+    DECODERS[cls.__name__] = _make_decoder(cls)
+    return cls
+
+
+for _module in (events, commands):
+    for _cls in vars(_module).values():
+        if dataclasses.is_dataclass(_cls):
+            register(_cls)
+
+
+# -----------
+# ENTRYPOINTS
+# -----------
+def to_dict(message) -> dict:
+    try:
+        return ENCODERS[type(message)](message)
+    except KeyError:
+        raise SerializationError(f"No encoder registered for {type(message)}")
+
+
+def from_dict(payload: dict, message_type: Optional[Type] = None):
+    check_version(payload)
+    name = message_type.__name__ if message_type else payload.get(TYPE_KEY)
+    try:
+        decoder = DECODERS[name]
+    except KeyError:
+        raise SerializationError(f"No decoder registered for {name!r}")
+    return decoder(payload)
+
+
+def check_version(payload: dict):
+    # payloads without a version predate versioning and are treated as v1
+    version = payload.get(VERSION_KEY, 1)
+    if version > SCHEMA_VERSION:
+        raise IncompatibleSchema(
+            f"Message schema v{version} is newer than supported v{SCHEMA_VERSION}"
+        )
+
+
+def dumps(message, codec: Optional[str] = None) -> bytes:
+    payload = to_dict(message)
+    traceparent = tracing.traceparent()
+    if traceparent is not None:
+        payload[TRACE_KEY] = traceparent
+    return get_codec(codec).dumps(payload)
+
+
+def loads(data: bytes) -> dict:
+    """
+    Decodes raw bytes into a version-checked payload dict; use this for
+    messages from external systems that don't map onto one of our classes.
+
+    """
+    payload = sniff_codec(data).loads(data)
+    check_version(payload)
+    return payload
+
+
+def decode(data: bytes, message_type: Optional[Type] = None):
+    return from_dict(sniff_codec(data).loads(data), message_type)
@@ -0,0 +1,170 @@
+"""
+Allocation in SQL, without loading the Product (see handlers.allocate).
+
+On Postgres, picking the batch, locking it, inserting the allocation and
+bumping the product's version is one statement: a chain of data-modifying
+CTEs. SQLite can't modify tables from a CTE, so there the same steps run
+as separate statements, in the unit of work's transaction.
+
+Either way the batch is the one Product.allocate would pick under the
+default strategy (earliest_eta): in-stock batches first, then by ETA,
+ties going to the batch created first. Products with another strategy,
+striped ones, and ones the session has already loaded (which would go
+stale) are left to the aggregate. As on the aggregate's path, it is the
+version bump that serializes concurrent allocations of a sku.
+
+"""
+
+from typing import List
+
+from sqlalchemy import exists, func, insert, literal, select, true, update
+
+from src.allocation.domain import events, model, strategies
+from src.allocation.adapters import orm, repository
+
+# returned by SqlAllocator.allocate when it has left the line alone
+NOT_HANDLED = object()
+
+
+def _batch_for(line: model.OrderLine):
+    b, p, al = orm.batches, orm.products, orm.allocation_rows()
+    allocated = (
+        select(func.coalesce(func.sum(al.c.qty), 0))
+        .where(al.c.batch_id == b.c.id)
+        .scalar_subquery()
+    )
+    eligible = exists().where(
+        p.c.sku == line.sku,
+        p.c.allocation_strategy == strategies.DEFAULT_STRATEGY,
+        p.c.stripes == 0,
+    )
+    return (
+        select(b.c.id, b.c.reference)
+        .where(b.c.sku == line.sku, eligible)
+        .where(b.c._purchased_quantity - allocated >= line.qty)
+        .order_by(b.c.eta.isnot(None), b.c.eta, b.c.id)
+        .limit(1)
+    )
+
+
+def _insert_from(chosen, line: model.OrderLine):
+    """
+    A CTE inserting the line's allocation to the `chosen` batch, if any,
+    returning its batch id.
+    """
+    values = (literal(line.orderid), literal(line.sku), literal(line.qty))
+    if orm.allocation_storage == orm.BATCH_ALLOCATIONS:
+        a = orm.batch_allocations
+        return (
+            insert(a)
+            .from_select(
+                [a.c.batch_id, a.c.orderid, a.c.sku, a.c.qty],
+                select(chosen.c.id, *values),
+            )
+            .returning(a.c.batch_id)
+            .cte("inserted")
+        )
+    ol, a = orm.order_lines, orm.allocations
+    new_line = (
+        insert(ol)
+        .from_select(
+            [ol.c.orderid, ol.c.sku, ol.c.qty], select(*values).select_from(chosen)
+        )
+        .returning(ol.c.id)
+        .cte("new_line")
+    )
+    return (
+        insert(a)
+        .from_select(
+            [a.c.orderline_id, a.c.batch_id], select(new_line.c.id, chosen.c.id)
+        )
+        .returning(a.c.batch_id)
+        .cte("inserted")
+    )
+
+
+def allocate_statement(line: model.OrderLine):
+    """
+    The Postgres statement: returns the product's strategy and stripes
+    and the batchref the line was allocated to, if it was; no row if there
+    is no such product.
+    """
+    p = orm.products
+    chosen = _batch_for(line).with_for_update(of=orm.batches).cte("chosen")
+    inserted = _insert_from(chosen, line)
+    bumped = (
+        update(p)
+        .where(p.c.sku == line.sku, exists(select(inserted.c.batch_id)))
+        .values(version_number=p.c.version_number + 1)
+        .returning(p.c.version_number)
+        .cte("bumped")
+    )
+    return (
+        select(p.c.allocation_strategy, p.c.stripes, chosen.c.reference)
+        .select_from(p.outerjoin(chosen, true()).outerjoin(bumped, true()))
+        .where(p.c.sku == line.sku)
+    )
+
+
+class SqlAllocator:
+    def __init__(self, session):
+        self.session = session
+        self.events = []  # type: List[events.Event]
+
+    def allocate(self, line: model.OrderLine):
+        """
+        Allocates the line and returns the batchref, or None if no batch
+        can take it; or returns NOT_HANDLED, having changed nothing, if the
+        product has to be allocated from through its aggregate (including
+        when there is no such product).
+        """
+        key = self.session.identity_key(model.Product, line.sku)
+        if key in self.session.identity_map:
+            return NOT_HANDLED
+        if self.session.get_bind().dialect.name == "postgresql":
+            row = self.session.execute(allocate_statement(line)).first()
+            if not _handled(row):
+                return NOT_HANDLED
+            batchref = row.reference
+        else:
+            batchref = self._allocate_in_steps(line)
+            if batchref is NOT_HANDLED:
+                return NOT_HANDLED
+
+        if batchref is None:
+            self.events.append(events.OutOfStock(line.sku))
+        else:
+            self.events.append(
+                events.Allocated(line.orderid, line.sku, line.qty, batchref)
+            )
+        return batchref
+
+    def _allocate_in_steps(self, line: model.OrderLine):
+        p = orm.products
+        chosen = _batch_for(line).subquery("chosen")
+        row = self.session.execute(
+            select(
+                p.c.allocation_strategy, p.c.stripes, chosen.c.id, chosen.c.reference
+            )
+            .select_from(p.outerjoin(chosen, true()))
+            .where(p.c.sku == line.sku)
+        ).first()
+        if not _handled(row):
+            return NOT_HANDLED
+        if row.id is None:
+            return None
+        repository.insert_allocation_row(self.session, row.id, line)
+        self.session.execute(
+            update(p)
+            .where(p.c.sku == line.sku)
+            .values(version_number=p.c.version_number + 1)
+        )
+        return row.reference
+
+
+def _handled(row) -> bool:
+    return (
+        row is not None
+        and row.allocation_strategy == strategies.DEFAULT_STRATEGY
+        and not row.stripes
+    )
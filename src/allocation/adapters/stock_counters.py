@@ -0,0 +1,174 @@
+"""
+Counters of available stock, per sku and per batch, kept up to date from
+domain events so that availability checks don't touch the database (see
+service_layer/availability.py).
+
+"""
+
+import abc
+import threading
+from typing import Dict, Iterable, Optional
+
+import redis
+
+from src.allocation import config
+
+# {sku: {"available": total, "batches": {batchref: available}}}
+Availability = Dict[str, dict]
+
+
+class AbstractStockCounters(abc.ABC):
+    @abc.abstractmethod
+    def adjust(self, sku: str, batchref: str, delta: int):
+        """
+        Adds `delta` to the batch's counter and to its sku's, atomically.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def drop_batch(self, sku: str, batchref: str):
+        """
+        Removes the batch's counter, taking what was left of it off its
+        sku's.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def replace(self, skus: Dict[str, Dict[str, int]]):
+        """
+        Overwrites the counters of each sku with the available quantity of
+        each of its batches.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_many(self, skus: Iterable[str]) -> Availability:
+        """
+        The counters of each sku; skus without any read as empty.
+        """
+        raise NotImplementedError
+
+
+class InMemoryStockCounters(AbstractStockCounters):
+    """
+    Local to this process; for tests, and single-process deployments.
+
+    """
+
+    def __init__(self):
+        self._batches = {}  # type: Dict[str, Dict[str, int]]
+        self._lock = threading.Lock()
+
+    def adjust(self, sku, batchref, delta):
+        with self._lock:
+            batches = self._batches.setdefault(sku, {})
+            batches[batchref] = batches.get(batchref, 0) + delta
+
+    def drop_batch(self, sku, batchref):
+        with self._lock:
+            self._batches.get(sku, {}).pop(batchref, None)
+
+    def replace(self, skus):
+        with self._lock:
+            for sku, batches in skus.items():
+                self._batches[sku] = dict(batches)
+
+    def get_many(self, skus):
+        with self._lock:
+            return {
+                sku: dict(
+                    available=sum(self._batches.get(sku, {}).values()),
+                    batches=dict(self._batches.get(sku, {})),
+                )
+                for sku in skus
+            }
+
+
+# KEYS: the sku's total, the sku's hash of batch counters
+# ARGV: batchref, delta
+ADJUST = """
+redis.call('HINCRBY', KEYS[2], ARGV[1], ARGV[2])
+redis.call('INCRBY', KEYS[1], ARGV[2])
+"""
+
+# KEYS: as above; ARGV: batchref
+DROP_BATCH = """
+local left = redis.call('HGET', KEYS[2], ARGV[1])
+if left then
+    redis.call('HDEL', KEYS[2], ARGV[1])
+    redis.call('DECRBY', KEYS[1], left)
+end
+"""
+
+# KEYS: as above; ARGV: batchref, available, batchref, available...
+REPLACE = """
+redis.call('DEL', KEYS[2])
+local total = 0
+for i = 1, #ARGV, 2 do
+    redis.call('HSET', KEYS[2], ARGV[i], ARGV[i + 1])
+    total = total + tonumber(ARGV[i + 1])
+end
+redis.call('SET', KEYS[1], total)
+"""
+
+
+class RedisStockCounters(AbstractStockCounters):
+    """
+    Shared between processes. Each sku has a total and a hash of batch
+    counters, changed together by Lua scripts (and read together) so that
+    readers never see one without the other.
+
+    """
+
+    def __init__(self, client: redis.Redis, prefix: str = "stock:"):
+        self.client = client
+        self.prefix = prefix
+        self._adjust = client.register_script(ADJUST)
+        self._drop_batch = client.register_script(DROP_BATCH)
+        self._replace = client.register_script(REPLACE)
+
+    def keys(self, sku: str):
+        return [f"{self.prefix}{sku}:available", f"{self.prefix}{sku}:batches"]
+
+    def adjust(self, sku, batchref, delta):
+        self._adjust(keys=self.keys(sku), args=[batchref, delta])
+
+    def drop_batch(self, sku, batchref):
+        self._drop_batch(keys=self.keys(sku), args=[batchref])
+
+    def replace(self, skus):
+        # one round trip for all of them
+        pipe = self.client.pipeline(transaction=False)
+        for sku, batches in skus.items():
+            args = [value for item in batches.items() for value in item]
+            self._replace(keys=self.keys(sku), args=args, client=pipe)
+        pipe.execute()
+
+    def get_many(self, skus):
+        skus = list(skus)
+        # one round trip for all of them, in MULTI so that each sku's total
+        # and batches are read together
+        pipe = self.client.pipeline()
+        for sku in skus:
+            available, batches = self.keys(sku)
+            pipe.get(available)
+            pipe.hgetall(batches)
+        replies = iter(pipe.execute())
+        return {
+            sku: dict(
+                available=int(next(replies) or 0),
+                batches={
+                    ref.decode(): int(value) for ref, value in next(replies).items()
+                },
+            )
+            for sku in skus
+        }
+
+
+def from_config() -> Optional[AbstractStockCounters]:
+    backend = config.get_stock_counters_backend()
+    if backend == "redis":
+        return RedisStockCounters(redis.Redis(**config.get_redis_host_and_port()))
+    if backend == "memory":
+        return InMemoryStockCounters()
+    return None
@@ -0,0 +1,195 @@
+"""
+Persistence for striped stock (see domain/striping.py).
+
+Allocating from a striped product bypasses its Product row: each
+allocation is a guarded decrement of one stock_stripes row plus the
+allocation row itself, so allocations landing on different stripes do
+not contend with each other.
+
+Changes made through the Product aggregate (new batches, deallocations,
+quantity changes...) re-sync the stripes of the batches they touched
+from the batches' available quantity, with those stripes locked; an
+allocation racing with them is reported as a concurrency conflict.
+
+"""
+
+from typing import Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import func, select
+
+from src.utils import tracing
+from src.allocation.domain import events, model, striping
+from src.allocation.adapters import orm, repository
+
+
+class StripeConflict(Exception):
+    """
+    A stripe no longer had room for a line allocated from it, because it
+    was allocated from concurrently; the command can be retried.
+    """
+
+
+# events raised by a striped Product that change the available quantity
+# of the batch they name
+_BATCH_EVENTS = {
+    events.Allocated: "batchref",
+    events.Deallocated: "batchref",
+    events.BatchCreated: "ref",
+    events.BatchQuantityChanged: "ref",
+    events.BatchArchived: "ref",
+}
+
+
+class StripeRepository:
+    def __init__(self, session):
+        self.session = session
+        self.seen = []  # type: List[striping.StripedStock]
+        # keyed by id(); holding the events keeps their ids from being reused
+        self._applied = {}  # type: Dict[int, events.Event]
+
+    def is_striped(self, sku: str) -> bool:
+        stripes = self.session.execute(
+            select(orm.products.c.stripes).where(orm.products.c.sku == sku)
+        ).scalar()
+        return bool(stripes)
+
+    def get(self, sku: str) -> striping.StripedStock:
+        with tracing.span("stripes.get", sku=sku):
+            stock = striping.StripedStock(sku, self._stripes(sku, in_stock=True))
+        self.seen.append(stock)
+        return stock
+
+    def striped_skus(self, after: Optional[str] = None, limit: int = 100) -> List[str]:
+        p = orm.products
+        query = select(p.c.sku).where(p.c.stripes > 0).order_by(p.c.sku).limit(limit)
+        if after is not None:
+            query = query.where(p.c.sku > after)
+        return [sku for (sku,) in self.session.execute(query)]
+
+    def rebalance(self, sku: str) -> int:
+        """
+        Evens out the stripes of each of the sku's batches; returns how
+        many stripes changed.
+        """
+        stripes = self._stripes(sku, lock=True)
+        balanced = striping.rebalance(stripes)
+        changed = [s for s in stripes if balanced[s.id] != s.available]
+        for stripe in changed:
+            self._set_available(stripe.id, balanced[stripe.id])
+        return len(changed)
+
+    def record_changes(self, products: Iterable[model.Product]):
+        """
+        Called by the unit of work just before it commits, with the
+        Products it loaded.
+        """
+        s = orm.stock_stripes
+        for stock in self.seen:
+            for stripe, line in stock.allocations:
+                taken = self.session.execute(
+                    s.update()
+                    .where(s.c.id == stripe.id)
+                    .where(s.c.available >= line.qty)
+                    .values(available=s.c.available - line.qty, version=s.c.version + 1)
+                )
+                if taken.rowcount != 1:
+                    raise StripeConflict(f"Stripe {stripe.id} was allocated from")
+                repository.insert_allocation_row(self.session, stripe.batch_id, line)
+            stock.allocations.clear()
+
+        for product in products:
+            new = [e for e in product.events if id(e) not in self._applied]
+            for event in new:
+                self._applied[id(event)] = event
+            if any(isinstance(e, events.StripesChanged) for e in new):
+                self._resync(product, refs=None)
+            elif product.stripes:
+                refs = {
+                    getattr(e, _BATCH_EVENTS[type(e)])
+                    for e in new
+                    if type(e) in _BATCH_EVENTS
+                }
+                if refs:
+                    self._resync(product, refs)
+
+    def _stripes(
+        self, sku: str, in_stock: bool = False, lock: bool = False
+    ) -> List[striping.Stripe]:
+        s, b = orm.stock_stripes, orm.batches
+        query = (
+            select(s.c.id, b.c.id, s.c.batchref, s.c.stripe, b.c.eta, s.c.available)
+            .select_from(s.join(b, b.c.reference == s.c.batchref))
+            .where(s.c.sku == sku)
+            .order_by(b.c.id, s.c.stripe)
+        )
+        if in_stock:
+            query = query.where(s.c.available > 0)
+        if lock:
+            query = query.with_for_update(of=s)
+        return [striping.Stripe(*row) for row in self.session.execute(query)]
+
+    def _set_available(self, stripe_id: int, available: int):
+        s = orm.stock_stripes
+        self.session.execute(
+            s.update().where(s.c.id == stripe_id).values(available=available)
+        )
+
+    def _resync(self, product: model.Product, refs: Optional[Set[str]]):
+        """
+        Re-splits the available quantity of the product's batches `refs`
+        (all of them if None) over product.stripes stripes each, dropping
+        the stripes of batches it no longer has.
+        """
+        s, b, al = orm.stock_stripes, orm.batches, orm.allocation_rows()
+        # deallocations etc. must be in the database before counting
+        self.session.flush()
+        query = select(s.c.id, s.c.batchref, s.c.stripe, s.c.version).where(
+            s.c.sku == product.sku
+        )
+        if refs is not None:
+            query = query.where(s.c.batchref.in_(refs))
+        existing = {}  # type: Dict[str, Dict[int, tuple]]
+        for row in self.session.execute(query.with_for_update()):
+            existing.setdefault(row.batchref, {})[row.stripe] = row
+
+        live = {batch.reference for batch in product.batches}
+        if refs is not None:
+            live &= refs
+        available = dict(
+            self.session.execute(
+                select(
+                    b.c.reference,
+                    b.c._purchased_quantity - func.coalesce(func.sum(al.c.qty), 0),
+                )
+                .select_from(b.outerjoin(al, al.c.batch_id == b.c.id))
+                .where(b.c.reference.in_(live))
+                .group_by(b.c.id, b.c.reference, b.c._purchased_quantity)
+            ).all()
+        )
+
+        dropped = 0
+        for ref in set(existing) | set(available):
+            rows = existing.get(ref, {})
+            quantities = []  # type: List[int]
+            if ref in available and product.stripes:
+                quantities = striping.split(max(available[ref], 0), product.stripes)
+            for stripe, quantity in enumerate(quantities):
+                if stripe in rows:
+                    self._set_available(rows[stripe].id, quantity)
+                else:
+                    self.session.execute(
+                        s.insert(),
+                        dict(
+                            sku=product.sku,
+                            batchref=ref,
+                            stripe=stripe,
+                            available=quantity,
+                        ),
+                    )
+            for stripe, row in rows.items():
+                if stripe >= len(quantities):
+                    self.session.execute(s.delete().where(s.c.id == row.id))
+                    dropped += row.version
+        # stock versions count stripe versions too (see views.product_version);
+        # folding in those of dropped stripes keeps them from going backwards
+        product.version_number += dropped
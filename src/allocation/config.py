@@ -19,3 +19,167 @@ def get_redis_host_and_port():
     host = os.environ.get("REDIS_HOST", "localhost")
     port = 63791 if host == "localhost" else 6379
     return dict(host=host, port=port)
+
+
+def get_message_codec():
+    return os.environ.get("MESSAGE_CODEC", "json")
+
+
+def get_result_store_backend():
+    return os.environ.get("RESULT_STORE", "memory")
+
+
+def get_result_store_size():
+    return int(os.environ.get("RESULT_STORE_SIZE", 10_000))
+
+
+def get_result_store_ttl():
+    return int(os.environ.get("RESULT_STORE_TTL", 3600))
+
+
+def get_out_of_stock_window():
+    return float(os.environ.get("OUT_OF_STOCK_WINDOW", 60))
+
+
+def get_allocation_coalescing_window():
+    # seconds; 0 disables coalescing
+    return float(os.environ.get("ALLOCATE_COALESCE_WINDOW", 0))
+
+
+def get_allocation_coalescing_max_batch():
+    return int(os.environ.get("ALLOCATE_COALESCE_MAX_BATCH", 50))
+
+
+def get_metrics_dump_interval():
+    return float(os.environ.get("METRICS_DUMP_INTERVAL", 60))
+
+
+def get_profile_dir():
+    return os.environ.get("PROFILE_DIR", "/tmp/allocation-profiles")
+
+
+def get_profile_sample_rate():
+    # fraction of requests profiled without being asked to; 0 disables
+    return float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+
+
+def get_profile_max_files():
+    return int(os.environ.get("PROFILE_MAX_FILES", 200))
+
+
+def get_trace_sample_rate():
+    # fraction of new traces recorded; 0 disables tracing
+    return float(os.environ.get("TRACE_SAMPLE_RATE", 0))
+
+
+def get_trace_file():
+    return os.environ.get("TRACE_FILE", "/tmp/allocation-traces.jsonl")
+
+
+def get_persistence_mode():
+    # "orm" (tables mapped onto the aggregate) or "events" (event sourced)
+    return os.environ.get("PERSISTENCE_MODE", "orm")
+
+
+def get_snapshot_interval():
+    # events between Product snapshots in "events" mode; 0 disables them
+    return int(os.environ.get("SNAPSHOT_INTERVAL", 100))
+
+
+def get_allocation_storage():
+    # "join_table" (order_lines + allocations) or "batch_allocations"
+    return os.environ.get("ALLOCATION_STORAGE", "join_table")
+
+
+def get_archive_grace_days():
+    # how long after arrival an exhausted shipment is kept in its Product
+    return int(os.environ.get("ARCHIVE_GRACE_DAYS", 30))
+
+
+def get_archive_chunk_size():
+    return int(os.environ.get("ARCHIVE_CHUNK_SIZE", 100))
+
+
+def get_archive_interval():
+    return float(os.environ.get("ARCHIVE_INTERVAL", 3600))
+
+
+def get_stock_striping():
+    # allocate from the stock stripes of products that have them (see
+    # domain/striping.py); "orm" persistence mode only
+    return os.environ.get("STOCK_STRIPING", "0") == "1"
+
+
+def get_sql_allocation():
+    # allocate plain lines in SQL, without loading their Product (see
+    # adapters/sql_allocation.py); "orm" persistence mode only
+    return os.environ.get("SQL_ALLOCATION", "0") == "1"
+
+
+def get_stripe_rebalance_interval():
+    return float(os.environ.get("STRIPE_REBALANCE_INTERVAL", 5))
+
+
+def get_actor_shards():
+    # worker threads owning the products in memory; 0 disables actors
+    return int(os.environ.get("ACTOR_SHARDS", 0))
+
+
+def get_actor_durability():
+    # "sync" (a commit per command) or "group" (one per batch of queued
+    # commands); either way, callers are answered after the commit
+    return os.environ.get("ACTOR_DURABILITY", "sync")
+
+
+def get_actor_group_window():
+    # seconds a group commit waits for more commands; 0 takes what's queued
+    return float(os.environ.get("ACTOR_GROUP_WINDOW", 0))
+
+
+def get_actor_max_batch():
+    return int(os.environ.get("ACTOR_MAX_BATCH", 100))
+
+
+def get_partition_workers():
+    # sku-partitioned worker processes to forward commands to; 0 disables
+    return int(os.environ.get("PARTITION_WORKERS", 0))
+
+
+def get_partition_socket_dir():
+    return os.environ.get("PARTITION_SOCKET_DIR", "/tmp/allocation-workers")
+
+
+def get_partition_retry_after():
+    # seconds before a worker that couldn't be reached is tried again
+    return float(os.environ.get("PARTITION_RETRY_AFTER", 1.0))
+
+
+def get_stock_counters_backend():
+    # available-stock counters for GET /availability: redis, memory or off
+    return os.environ.get("STOCK_COUNTERS", "off")
+
+
+def get_stock_counters_reconcile_interval():
+    # seconds between rebuilds of the counters from the database
+    return float(os.environ.get("STOCK_COUNTERS_RECONCILE_INTERVAL", 300))
+
+
+def get_replica_uris():
+    # comma-separated read replicas for queries; none sends them to the primary
+    uris = os.environ.get("REPLICA_DB_URIS", "")
+    return [uri.strip() for uri in uris.split(",") if uri.strip()]
+
+
+def get_replica_check_interval():
+    # seconds between health checks of a replica in use
+    return float(os.environ.get("REPLICA_CHECK_INTERVAL", 5))
+
+
+def get_replica_retry_after():
+    # seconds before an unhealthy replica is tried again
+    return float(os.environ.get("REPLICA_RETRY_AFTER", 30))
+
+
+def get_replica_max_lag():
+    # seconds a Postgres replica may be behind before it's left out
+    return float(os.environ.get("REPLICA_MAX_LAG", 5))
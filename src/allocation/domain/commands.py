@@ -12,6 +12,9 @@ class Allocate(Command):
     orderid: str
     sku: str
     qty: int
+    idempotency_key: Optional[str] = None
+    # queue the line if it can't be allocated now, rather than dropping it
+    wait: bool = False
 
 
 @dataclass
@@ -19,6 +22,7 @@ class Deallocate(Command):
     orderid: str
     sku: str
     qty: int
+    idempotency_key: Optional[str] = None
 
 
 @dataclass
@@ -33,3 +37,22 @@ class CreateBatch(Command):
 class ChangeBatchQuantity(Command):
     ref: str
     qty: int
+
+
+@dataclass
+class ChangeAllocationStrategy(Command):
+    sku: str
+    strategy: str
+
+
+@dataclass
+class ArchiveBatches(Command):
+    sku: str
+    as_of: date
+    grace_days: int = 0
+
+
+@dataclass
+class ChangeStripes(Command):
+    sku: str
+    stripes: int
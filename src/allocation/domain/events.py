@@ -27,3 +27,60 @@ class Deallocated(Event):
 @dataclass
 class OutOfStock(Event):
     sku: str
+
+
+@dataclass
+class BatchCreated(Event):
+    ref: str
+    sku: str
+    qty: int
+    eta: Optional[date] = None
+
+
+@dataclass
+class BatchQuantityChanged(Event):
+    ref: str
+    qty: int
+    # None in events recorded before they were added
+    sku: Optional[str] = None
+    previous_qty: Optional[int] = None
+
+
+@dataclass
+class AllocationStrategyChanged(Event):
+    sku: str
+    strategy: str
+
+
+@dataclass
+class BatchArchived(Event):
+    sku: str
+    ref: str
+
+
+@dataclass
+class BatchExhausted(Event):
+    # an in-stock batch found to have run out (see Product.retire_batches)
+    sku: str
+    ref: str
+    on: date
+
+
+@dataclass
+class StripesChanged(Event):
+    sku: str
+    stripes: int
+
+
+@dataclass
+class LineQueued(Event):
+    orderid: str
+    sku: str
+    qty: int
+
+
+@dataclass
+class LineUnqueued(Event):
+    orderid: str
+    sku: str
+    qty: int
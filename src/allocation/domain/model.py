@@ -1,14 +1,15 @@
 """
-Domain model for order allocation service. 
+Domain model for order allocation service.
 
 """
 
-from typing import Optional, List, Set
-from datetime import date
+from typing import Iterable, Optional, List, Set
+from datetime import date, timedelta
 from dataclasses import dataclass
 
 from src.utils.logger import log
-from src.allocation.domain import events, commands
+from src.allocation.domain import events, commands, strategies
+
 
 # -----------------
 # DOMAIN EXCEPTIONS
@@ -38,6 +39,19 @@ class OrderLine:
     qty: int
 
 
+@dataclass(unsafe_hash=True)
+class WaitingLine:
+    """
+    A line that couldn't be allocated when it was placed, queued on its
+    Product until stock arrives.
+
+    """
+
+    orderid: str
+    sku: str
+    qty: int
+
+
 class Batch:
     """
     Represents a batch of stock ordered by the purchasing department,
@@ -87,6 +101,8 @@ class Batch:
         self.eta = eta
         self._purchased_quantity = qty
         self._allocations = set()  # type: Set[OrderLine]
+        # in-stock batches: when archival first found it had run out
+        self.exhausted_on = None  # type: Optional[date]
 
     def allocate(self, line: OrderLine):
         """
@@ -123,6 +139,25 @@ class Batch:
     def can_allocate(self, line: OrderLine) -> bool:
         return self.sku == line.sku and self.available_quantity >= line.qty
 
+    def is_retirable(self, as_of: date, grace: timedelta = timedelta(0)) -> bool:
+        """
+        A batch can be archived once it has no stock left to allocate, and
+        has had none for at least `grace` before `as_of`: counted from its
+        arrival for a shipment, and for an in-stock batch from when it was
+        found to have run out (see Product.retire_batches). Lines in
+        archived batches can no longer be deallocated.
+
+        """
+        if self.available_quantity > 0:
+            return False
+        since = self.eta if self.eta is not None else self.exhausted_on
+        return since is not None and since + grace <= as_of
+
+    def _stock_changed(self):
+        # back in stock: running out again restarts the grace period
+        if self.available_quantity > 0:
+            self.exhausted_on = None
+
 
 class Product:
     """
@@ -130,38 +165,243 @@ class Product:
     This will be the single entrypoint into our domain model.
     """
 
-    def __init__(self, sku: str, batches: List[Batch], version_number: int = 0):
+    def __init__(
+        self,
+        sku: str,
+        batches: List[Batch],
+        version_number: int = 0,
+        allocation_strategy: str = strategies.DEFAULT_STRATEGY,
+        stripes: int = 0,
+        waiting: List[WaitingLine] = None,
+    ):
         self.sku = sku
         self.batches = batches
         self.version_number = version_number
+        self.allocation_strategy = allocation_strategy
+        # number of stock stripes per batch; 0 when not striped
+        self.stripes = stripes
+        # lines waiting for stock, in order of arrival
+        self.waiting = waiting or []
         self.events = []  # type: List[events.Event]
+        self._index = None  # type: Optional[strategies.AllocationStrategy]
 
-    def allocate(self, line: OrderLine) -> str:
+    def allocate(self, line: OrderLine, wait: bool = False) -> str:
         """
-        This implements our earlier domain service for 'allocate'.
+        Allocates the line to the batch picked by this product's
+        allocation strategy. If there is no room for it, the line is
+        dropped, or with `wait` queued until stock arrives.
         """
-        try:
-            batch = next(b for b in sorted(self.batches) if b.can_allocate(line))
-            batch.allocate(line)
-            self.version_number += 1
-            self.events.append(
-                events.Allocated(
-                    orderid=line.orderid,
-                    sku=line.sku,
-                    qty=line.qty,
-                    batchref=batch.reference,
-                )
-            )
-            return batch.reference
-        except StopIteration:
+        if wait:
+            # a retry of a line that was queued, which may since have been
+            # allocated; other allocations are deduplicated by the service
+            for batch in self.batches:
+                if line in batch._allocations:
+                    return batch.reference
+            if _waiting(line) in self.waiting:
+                return None
+        batch = self._allocation_index().choose(line.qty)
+        if batch is None or not batch.can_allocate(line):
             self.events.append(events.OutOfStock(line.sku))
+            if wait:
+                self.waiting.append(_waiting(line))
+                self.version_number += 1
+                self.events.append(events.LineQueued(line.orderid, line.sku, line.qty))
+            return None
+        self._allocate_to(batch, line)
+        return batch.reference
+
+    def add_batch(self, batch: Batch):
+        self.batches.append(batch)
+        self._index = None
+        self.version_number += 1
+        self.events.append(
+            events.BatchCreated(
+                batch.reference, batch.sku, batch._purchased_quantity, batch.eta
+            )
+        )
+        self._allocate_waiting()
+
+    def deallocate(self, line: OrderLine) -> str:
+        """
+        Deallocates the line and returns the batch it was allocated to;
+        a line still waiting for stock is taken out of the queue instead,
+        and None returned.
+        """
+        for batch in self.batches:
+            if line in batch._allocations:
+                batch.deallocate(line)
+                self._batch_changed(batch)
+                self.version_number += 1
+                self.events.append(
+                    events.Deallocated(
+                        line.orderid, line.sku, line.qty, batch.reference
+                    )
+                )
+                return batch.reference
+        if _waiting(line) in self.waiting:
+            self.waiting.remove(_waiting(line))
+            self.version_number += 1
+            self.events.append(events.LineUnqueued(line.orderid, line.sku, line.qty))
             return None
+        raise OrderNotFound(f"Could not find an allocation for line {line.orderid}")
 
     def change_batch_quantity(self, ref: str, qty: int):
         batch = next(b for b in self.batches if b.reference == ref)
-        batch._purchased_quantity = qty
+        previous_qty, batch._purchased_quantity = batch._purchased_quantity, qty
+        self.version_number += 1
+        self.events.append(
+            events.BatchQuantityChanged(ref, qty, self.sku, previous_qty)
+        )
         while batch.available_quantity < 0:
             # de-allocate line orders from the existing batch
             # and try to assign them to another available batch
             line = batch.deallocate_one()
+            self.events.append(
+                events.Deallocated(line.orderid, line.sku, line.qty, ref)
+            )
             self.events.append(commands.Allocate(line.orderid, line.sku, line.qty))
+        self._batch_changed(batch)
+        if qty > previous_qty:
+            self._allocate_waiting()
+
+    def change_allocation_strategy(self, name: str):
+        strategies.get_strategy(name)  # raises UnknownStrategy
+        self.allocation_strategy = name
+        self._index = None
+        self.version_number += 1
+        self.events.append(events.AllocationStrategyChanged(self.sku, name))
+
+    def change_stripes(self, stripes: int):
+        """
+        Splits each batch's stock into `stripes` independently allocatable
+        stripes (see domain/striping.py), or stops striping with 0.
+        """
+        if stripes < 0:
+            raise ValueError(f"Invalid number of stripes {stripes}")
+        self.stripes = stripes
+        self.version_number += 1
+        self.events.append(events.StripesChanged(self.sku, stripes))
+
+    def retire_batches(
+        self, as_of: date, grace: timedelta = timedelta(0)
+    ) -> List[Batch]:
+        """
+        Removes retirable batches from the aggregate and returns them, for
+        the repository to archive. In-stock batches found to have run out
+        are marked so as of `as_of`, which starts their grace period.
+        """
+        exhausted = [
+            b
+            for b in self.batches
+            if b.eta is None and b.exhausted_on is None and b.available_quantity <= 0
+        ]
+        for batch in exhausted:
+            batch.exhausted_on = as_of
+            self.events.append(events.BatchExhausted(self.sku, batch.reference, as_of))
+        retired = [b for b in self.batches if b.is_retirable(as_of, grace)]
+        if exhausted or retired:
+            self.version_number += 1
+        if not retired:
+            return []
+        self.batches[:] = [b for b in self.batches if b not in retired]
+        self._index = None
+        for batch in retired:
+            self.events.append(events.BatchArchived(self.sku, batch.reference))
+        return retired
+
+    def replay(self, history: Iterable[events.Event]):
+        """
+        Applies recorded events to rebuild state (e.g. from an event store),
+        without raising new events or bumping the version.
+        """
+        batches = {b.reference: b for b in self.batches}
+        for event in history:
+            if isinstance(event, events.Allocated):
+                line = OrderLine(event.orderid, event.sku, event.qty)
+                batches[event.batchref]._allocations.add(line)
+                if self.waiting and _waiting(line) in self.waiting:
+                    self.waiting.remove(_waiting(line))
+            elif isinstance(event, events.Deallocated):
+                line = OrderLine(event.orderid, event.sku, event.qty)
+                batches[event.batchref]._allocations.discard(line)
+                batches[event.batchref]._stock_changed()
+            elif isinstance(event, events.BatchCreated):
+                batch = Batch(event.ref, event.sku, event.qty, event.eta)
+                batches[event.ref] = batch
+                self.batches.append(batch)
+            elif isinstance(event, events.BatchQuantityChanged):
+                batches[event.ref]._purchased_quantity = event.qty
+                batches[event.ref]._stock_changed()
+            elif isinstance(event, events.BatchExhausted):
+                batches[event.ref].exhausted_on = event.on
+            elif isinstance(event, events.AllocationStrategyChanged):
+                self.allocation_strategy = event.strategy
+            elif isinstance(event, events.StripesChanged):
+                self.stripes = event.stripes
+            elif isinstance(event, events.BatchArchived):
+                self.batches.remove(batches.pop(event.ref))
+            elif isinstance(event, events.LineQueued):
+                self.waiting.append(WaitingLine(event.orderid, event.sku, event.qty))
+            elif isinstance(event, events.LineUnqueued):
+                self.waiting.remove(WaitingLine(event.orderid, event.sku, event.qty))
+        self._index = None
+
+    def _allocation_index(self) -> strategies.AllocationStrategy:
+        # built lazily, and rebuilt if batches were added behind our back
+        index = self._index
+        if (
+            index is None
+            or index.name != self.allocation_strategy
+            or len(index) != len(self.batches)
+        ):
+            index = self._index = strategies.build(
+                self.allocation_strategy, self.batches
+            )
+        return index
+
+    def _allocate_waiting(self):
+        """
+        Allocates waiting lines in order of arrival, in a single pass that
+        ends as soon as the stock left is used up; lines that don't fit
+        keep their place in the queue.
+        """
+        if not self.waiting:
+            return
+        index = self._allocation_index()
+        left = sum(batch.available_quantity for batch in self.batches)
+        still_waiting = []  # type: List[WaitingLine]
+        for position, waiting in enumerate(self.waiting):
+            if left <= 0:
+                still_waiting.extend(self.waiting[position:])
+                break
+            line = OrderLine(waiting.orderid, waiting.sku, waiting.qty)
+            batch = index.choose(line.qty) if line.qty <= left else None
+            if batch is None or not batch.can_allocate(line):
+                still_waiting.append(waiting)
+                continue
+            self._allocate_to(batch, line)
+            left -= line.qty
+        if len(still_waiting) < len(self.waiting):
+            self.waiting[:] = still_waiting
+
+    def _allocate_to(self, batch: Batch, line: OrderLine):
+        batch.allocate(line)
+        self._index.update(batch)
+        self.version_number += 1
+        self.events.append(
+            events.Allocated(
+                orderid=line.orderid,
+                sku=line.sku,
+                qty=line.qty,
+                batchref=batch.reference,
+            )
+        )
+
+    def _batch_changed(self, batch: Batch):
+        batch._stock_changed()
+        if self._index is not None:
+            self._index.update(batch)
+
+
+def _waiting(line: OrderLine) -> WaitingLine:
+    return WaitingLine(line.orderid, line.sku, line.qty)
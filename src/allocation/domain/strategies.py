@@ -0,0 +1,175 @@
+"""
+Allocation strategies: how a Product picks the batch for an order line.
+
+Each strategy keeps its own index over the product's batches, built once
+and then kept up to date as batches change, so that picking a batch does
+not scan every batch:
+
+    earliest_eta      earliest ETA that fits (in-stock first); a max
+                      segment tree over batches in ETA order
+    best_fit          the smallest batch that fits, to reduce
+                      fragmentation; a sorted list of available quantities
+    in_stock_largest  the largest in-stock batch that fits, else the largest
+                      incoming one; max-heaps of available quantity
+
+Ties are broken by ETA, then by the batch's position in the product.
+
+"""
+
+import abc
+import heapq
+from bisect import bisect_left, insort
+from datetime import date
+from typing import Dict, List, Optional, Tuple, Type
+
+DEFAULT_STRATEGY = "earliest_eta"
+
+
+class UnknownStrategy(Exception):
+    pass
+
+
+def eta_key(batch) -> Tuple[bool, date]:
+    # same order as Batch.__gt__: in-stock (no eta) first, then by eta
+    return (batch.eta is not None, batch.eta or date.min)
+
+
+class AllocationStrategy(abc.ABC):
+    name = None  # type: str
+
+    def __init__(self, batches: list):
+        self.batches = list(batches)
+
+    def __len__(self):
+        return len(self.batches)
+
+    @abc.abstractmethod
+    def choose(self, qty: int):
+        """
+        Returns the batch to allocate `qty` from, or None if none can take it.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def update(self, batch):
+        """
+        Called after `batch`'s available quantity has changed.
+        """
+        raise NotImplementedError
+
+
+class EarliestEta(AllocationStrategy):
+    name = "earliest_eta"
+
+    def __init__(self, batches):
+        super().__init__(batches)
+        ordered = sorted(range(len(self.batches)), key=lambda i: eta_key(batches[i]))
+        self._ordered = [self.batches[i] for i in ordered]
+        self._leaf = {batch: i for i, batch in enumerate(self._ordered)}
+        self._size = 1
+        while self._size < len(self._ordered):
+            self._size *= 2
+        # tree[1] is the root; leaves start at tree[size]
+        self._tree = [float("-inf")] * (2 * self._size)
+        for i, batch in enumerate(self._ordered):
+            self._tree[self._size + i] = batch.available_quantity
+        for node in range(self._size - 1, 0, -1):
+            self._tree[node] = max(self._tree[2 * node], self._tree[2 * node + 1])
+
+    def choose(self, qty):
+        tree = self._tree
+        if not self._ordered or tree[1] < qty:
+            return None
+        node = 1
+        while node < self._size:
+            node = 2 * node if tree[2 * node] >= qty else 2 * node + 1
+        return self._ordered[node - self._size]
+
+    def update(self, batch):
+        tree = self._tree
+        node = self._size + self._leaf[batch]
+        tree[node] = batch.available_quantity
+        node //= 2
+        while node:
+            tree[node] = max(tree[2 * node], tree[2 * node + 1])
+            node //= 2
+
+
+class BestFit(AllocationStrategy):
+    name = "best_fit"
+
+    def __init__(self, batches):
+        super().__init__(batches)
+        self._entries = {}  # type: Dict[object, tuple]
+        for position, batch in enumerate(self.batches):
+            self._entries[batch] = (batch.available_quantity, eta_key(batch), position)
+        self._sorted = sorted(self._entries.values())
+
+    def choose(self, qty):
+        i = bisect_left(self._sorted, (qty,))
+        if i == len(self._sorted):
+            return None
+        return self.batches[self._sorted[i][2]]
+
+    def update(self, batch):
+        old = self._entries[batch]
+        new = self._entries[batch] = (batch.available_quantity,) + old[1:]
+        del self._sorted[bisect_left(self._sorted, old)]
+        insort(self._sorted, new)
+
+
+class PreferInStockThenLargest(AllocationStrategy):
+    name = "in_stock_largest"
+
+    def __init__(self, batches):
+        super().__init__(batches)
+        self._available = [batch.available_quantity for batch in self.batches]
+        self._position = {batch: i for i, batch in enumerate(self.batches)}
+        self._rebuild()
+
+    def _rebuild(self):
+        # entries are (-available, eta key, position); entries whose quantity
+        # no longer matches the batch are stale and skipped lazily
+        self._in_stock, self._incoming = [], []
+        for position, batch in enumerate(self.batches):
+            self._heap_for(batch).append(self._entry(position))
+        heapq.heapify(self._in_stock)
+        heapq.heapify(self._incoming)
+
+    def _heap_for(self, batch) -> list:
+        return self._in_stock if batch.eta is None else self._incoming
+
+    def _entry(self, position):
+        batch = self.batches[position]
+        return (-self._available[position], eta_key(batch), position)
+
+    def choose(self, qty):
+        for heap in (self._in_stock, self._incoming):
+            while heap and -heap[0][0] != self._available[heap[0][2]]:
+                heapq.heappop(heap)
+            if heap and -heap[0][0] >= qty:
+                return self.batches[heap[0][2]]
+        return None
+
+    def update(self, batch):
+        position = self._position[batch]
+        self._available[position] = batch.available_quantity
+        heapq.heappush(self._heap_for(batch), self._entry(position))
+        if len(self._in_stock) + len(self._incoming) > 2 * len(self.batches) + 64:
+            self._rebuild()
+
+
+STRATEGIES = {
+    cls.name: cls for cls in (EarliestEta, BestFit, PreferInStockThenLargest)
+}  # type: Dict[str, Type[AllocationStrategy]]
+
+
+def get_strategy(name: Optional[str]) -> Type[AllocationStrategy]:
+    try:
+        return STRATEGIES[name or DEFAULT_STRATEGY]
+    except KeyError:
+        raise UnknownStrategy(f"Unknown allocation strategy {name!r}")
+
+
+def build(name: Optional[str], batches: List) -> AllocationStrategy:
+    return get_strategy(name)(batches)
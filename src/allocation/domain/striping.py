@@ -0,0 +1,91 @@
+"""
+Striped stock, for skus too hot to serialize every allocation on their
+Product.
+
+Each batch's remaining quantity is split across N stripes, stored (and
+locked) independently. An allocation takes its whole line from a single
+stripe, so Product.allocate's choice of batch (earliest ETA first) holds
+up to stripe boundaries: a line bigger than any one stripe of a batch is
+not allocated from it, even if the stripes add up to enough.
+
+"""
+
+import random
+from dataclasses import dataclass
+from datetime import date
+from typing import Callable, Dict, List, Optional, Tuple
+
+from src.allocation.domain import events
+from src.allocation.domain.model import OrderLine
+from src.allocation.domain.strategies import eta_key
+
+
+@dataclass
+class Stripe:
+    id: int
+    batch_id: int
+    batchref: str
+    stripe: int
+    eta: Optional[date]
+    available: int
+
+
+def split(quantity: int, n: int) -> List[int]:
+    """
+    Splits a quantity into n parts differing by at most one.
+    """
+    base, extra = divmod(quantity, n)
+    return [base + (1 if i < extra else 0) for i in range(n)]
+
+
+def rebalance(stripes: List[Stripe]) -> Dict[int, int]:
+    """
+    New available quantity for each stripe id, evening out each batch's
+    stripes without changing its total.
+    """
+    by_batch = {}  # type: Dict[str, List[Stripe]]
+    for stripe in stripes:
+        by_batch.setdefault(stripe.batchref, []).append(stripe)
+    balanced = {}
+    for batch_stripes in by_batch.values():
+        batch_stripes.sort(key=lambda s: s.stripe)
+        total = sum(s.available for s in batch_stripes)
+        for stripe, quantity in zip(batch_stripes, split(total, len(batch_stripes))):
+            balanced[stripe.id] = quantity
+    return balanced
+
+
+class StripedStock:
+    """
+    The stripes of one sku, standing in for its Product when allocating.
+    Changes are kept in `allocations` for the repository to apply, each
+    guarded against concurrent changes to the same stripe.
+    """
+
+    def __init__(
+        self,
+        sku: str,
+        stripes: List[Stripe],
+        choice: Callable[[list], Stripe] = random.choice,
+    ):
+        self.sku = sku
+        self.stripes = stripes
+        self.choice = choice
+        self.allocations = []  # type: List[Tuple[Stripe, OrderLine]]
+        self.events = []  # type: List[events.Event]
+
+    def allocate(self, line: OrderLine) -> Optional[str]:
+        fits = [s for s in self.stripes if s.available >= line.qty]
+        if not fits:
+            self.events.append(events.OutOfStock(line.sku))
+            return None
+        # the earliest batch with room, then any of its stripes with room,
+        # so that concurrent allocations spread across them
+        first = min(fits, key=lambda s: eta_key(s))
+        stripe = self.choice([s for s in fits if s.batchref == first.batchref])
+        stripe.available -= line.qty
+        self.allocations.append((stripe, line))
+        self.events.append(
+            events.Allocated(line.orderid, line.sku, line.qty, stripe.batchref)
+        )
+        return stripe.batchref
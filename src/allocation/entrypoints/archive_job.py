@@ -0,0 +1,45 @@
+"""
+Scheduled job moving retired batches out of their Products and into the
+archive tables.
+
+    python -m src.allocation.entrypoints.archive_job [--once]
+
+"""
+
+import time
+import argparse
+
+from src.allocation import config
+from src.allocation.adapters import orm
+from src.allocation.service_layer import archival
+from src.utils.logger import log
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--once", action="store_true", help="run a single pass")
+    parser.add_argument("--interval", type=float, default=config.get_archive_interval())
+    parser.add_argument(
+        "--grace-days", type=int, default=config.get_archive_grace_days()
+    )
+    parser.add_argument(
+        "--chunk-size", type=int, default=config.get_archive_chunk_size()
+    )
+    parser.add_argument(
+        "--pause", type=float, default=0.0, help="seconds to sleep between chunks"
+    )
+    args = parser.parse_args(argv)
+
+    orm.start_mappers()
+    while True:
+        archived = archival.archive_all(
+            grace_days=args.grace_days, chunk_size=args.chunk_size, pause=args.pause
+        )
+        log.info("archival pass done, %s batches archived", archived)
+        if args.once:
+            return
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+"""
+Exports all allocations to a file (or stdout) as NDJSON or CSV.
+
+    python -m src.allocation.entrypoints.export_cli --format csv -o allocations.csv
+
+"""
+
+import sys
+import argparse
+
+from src.allocation.adapters import orm
+from src.allocation.service_layer import export, unit_of_work
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--format", choices=sorted(export.FORMATS), default="ndjson")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("-o", "--output", help="output file; defaults to stdout")
+    args = parser.parse_args(argv)
+
+    orm.start_mappers()
+    out = open(args.output, "w", newline="") if args.output else sys.stdout
+    try:
+        for chunk in export.export_allocations(
+            unit_of_work.ReadOnlyUnitOfWork(), args.format, args.chunk_size
+        ):
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,92 @@
+from contextlib import contextmanager
 from datetime import datetime
 
-from flask import Flask, jsonify, request
-
-from src.allocation.domain import commands
-from src.allocation.adapters import orm
-from src.allocation.service_layer import handlers, messagebus, unit_of_work
+from flask import Flask, Response, jsonify, request, stream_with_context
+from sqlalchemy import exc
+from sqlalchemy.orm.exc import StaleDataError
+
+from src.utils import metrics, profiling, tracing
+from src.allocation.domain import commands, strategies
+from src.allocation.adapters import ipc, orm, stripes
+from src.allocation.service_layer import (
+    actors,
+    availability,
+    coalescing,
+    export,
+    handlers,
+    messagebus,
+    partitioning,
+    unit_of_work,
+    views,
+)
 
 orm.start_mappers()
 
 app = Flask(__name__)
 
 
+# optional single-writer mode, every command running on the worker that
+# keeps its sku's Product in memory; None when disabled
+actor_pool = actors.from_config()
+
+# optional forwarding of commands to sku-partitioned worker processes
+# (see entrypoints/supervisor.py); None when disabled
+partition_router = partitioning.from_config()
+
+# requests are profiled when sampled, or when sent with "X-Profile: 1"
+profiler = profiling.from_config()
+tracing.configure_from_config()
+
+# optional group commit of concurrent allocations; None when disabled.
+# Batches are sampled by the same profiler as requests
+coalescer = coalescing.from_config(profiler)
+
+
+def handle(cmd, uow) -> list:
+    if partition_router is not None:
+        return [partition_router.handle(cmd)]
+    if actor_pool is not None:
+        return [actor_pool.handle(cmd)]
+    return messagebus.handle(cmd, uow)
+
+
+@contextmanager
+def instrumented(cmd):
+    # continues the caller's trace when it sends a traceparent header
+    forced = request.headers.get("X-Profile") == "1"
+    with tracing.continue_trace(
+        request.headers.get("traceparent"), f"{request.method} {request.path}"
+    ), profiling.maybe_profile(profiler, cmd, forced):
+        yield
+
+
 @app.route("/allocate", methods=["POST"])
 def allocate_endpoint():
     uow = unit_of_work.SqlAlchemyUnitOfWork()
     try:
         cmd = commands.Allocate(
-            request.json["orderid"], request.json["sku"], request.json["qty"]
+            request.json["orderid"],
+            request.json["sku"],
+            request.json["qty"],
+            idempotency_key=request.headers.get("Idempotency-Key"),
+            wait=bool(request.json.get("wait", False)),
         )
-        results = messagebus.handle(cmd, uow)
-        batchref = results.pop(0)
+        with instrumented(cmd):
+            if (
+                coalescer is not None
+                and actor_pool is None
+                and partition_router is None
+            ):
+                batchref = coalescer.allocate(cmd)
+            else:
+                results = handle(cmd, uow)
+                batchref = results.pop(0)
     except handlers.InvalidSku as e:
         return jsonify({"message": str(e)}), 400
 
+    if batchref is None and cmd.wait:
+        # queued; allocated when stock arrives (see Product.allocate)
+        return jsonify({"batchref": None, "waiting": True}), 202
     return jsonify({"batchref": batchref}), 201
 
 
@@ -31,9 +95,13 @@ def deallocate_endpoint():
     uow = unit_of_work.SqlAlchemyUnitOfWork()
     try:
         cmd = commands.Deallocate(
-            request.json["orderid"], request.json["sku"], request.json["qty"]
+            request.json["orderid"],
+            request.json["sku"],
+            request.json["qty"],
+            idempotency_key=request.headers.get("Idempotency-Key"),
         )
-        results = messagebus.handle(cmd, uow)
+        with instrumented(cmd):
+            results = handle(cmd, uow)
         batchref = results.pop(0)
 
     except handlers.InvalidSku as e:
@@ -52,10 +120,107 @@ def add_batch():
     cmd = commands.CreateBatch(
         request.json["ref"], request.json["sku"], request.json["qty"], eta
     )
-    messagebus.handle(cmd, uow)
+    with instrumented(cmd):
+        handle(cmd, uow)
 
     return "OK", 201
 
 
+@app.route("/products/<sku>/allocation_strategy", methods=["PUT"])
+def allocation_strategy_endpoint(sku):
+    uow = unit_of_work.SqlAlchemyUnitOfWork()
+    cmd = commands.ChangeAllocationStrategy(sku, request.json["strategy"])
+    try:
+        with instrumented(cmd):
+            handle(cmd, uow)
+    except (handlers.InvalidSku, strategies.UnknownStrategy) as e:
+        return jsonify({"message": str(e)}), 400
+
+    return "OK", 200
+
+
+@app.route("/products/<sku>/stripes", methods=["PUT"])
+def stripes_endpoint(sku):
+    uow = unit_of_work.SqlAlchemyUnitOfWork()
+    cmd = commands.ChangeStripes(sku, request.json["stripes"])
+    try:
+        with instrumented(cmd):
+            handle(cmd, uow)
+    except (handlers.InvalidSku, ValueError) as e:
+        return jsonify({"message": str(e)}), 400
+
+    return "OK", 200
+
+
+@app.route("/products/<sku>/stock", methods=["GET"])
+def stock_endpoint(sku):
+    # a matching If-None-Match is answered from the product version alone,
+    # without reading batches or allocations; both read from a replica,
+    # when there is one, so may lag a little behind allocations
+    if request.if_none_match:
+        version = views.product_version(sku, unit_of_work.ReadOnlyUnitOfWork())
+        if version is not None:
+            etag = views.stock_etag(sku, version)
+            if request.if_none_match.contains(etag):
+                response = app.response_class(status=304)
+                response.set_etag(etag)
+                return response
+
+    stock = views.stock(sku, unit_of_work.ReadOnlyUnitOfWork())
+    if stock is None:
+        return jsonify({"message": f"Invalid sku {sku}"}), 404
+
+    response = jsonify(stock)
+    response.set_etag(views.stock_etag(sku, stock["version"]))
+    # caches may store the response, but must revalidate it every time
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+@app.route("/availability", methods=["GET"])
+def availability_endpoint():
+    # ?sku=A&sku=B or ?sku=A,B; answered from the stock counters alone
+    skus = [sku for arg in request.args.getlist("sku") for sku in arg.split(",") if sku]
+    if not skus:
+        return jsonify({"message": "No skus given"}), 400
+    if availability.counters is None:
+        return jsonify({"message": "Stock counters are disabled"}), 404
+    return jsonify(availability.counters.get_many(skus))
+
+
+@app.route("/allocations/export", methods=["GET"])
+def export_allocations_endpoint():
+    fmt = request.args.get("format", "ndjson")
+    if fmt not in export.FORMATS:
+        return jsonify({"message": f"Unknown export format {fmt}"}), 400
+
+    _, mimetype = export.FORMATS[fmt]
+    chunks = export.export_allocations(unit_of_work.ReadOnlyUnitOfWork(), fmt)
+    return Response(stream_with_context(chunks), mimetype=mimetype)
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.errorhandler(exc.DBAPIError)
+@app.errorhandler(StaleDataError)
+@app.errorhandler(stripes.StripeConflict)
+@app.errorhandler(ipc.RemoteError)
+def database_error(e):
+    # concurrent updates to the same product are expected under load;
+    # report them as conflicts, so clients know to retry
+    if unit_of_work.is_concurrency_conflict(e):
+        return jsonify({"message": "Concurrent update, please retry"}), 409
+    raise e
+
+
+@app.errorhandler(partitioning.NoLiveWorkers)
+@app.errorhandler(ipc.WorkerUnavailable)
+def workers_unavailable(e):
+    return jsonify({"message": str(e)}), 503
+
+
 if __name__ == "__main__":
-    app.run(debug=True, port=80)
\ No newline at end of file
+    app.run(debug=True, port=80)
@@ -0,0 +1,39 @@
+"""
+Copies allocations from order_lines + allocations into batch_allocations
+(see adapters/migrations.py for the full procedure).
+
+    python -m src.allocation.entrypoints.migrate_allocations [--prune]
+
+"""
+
+import argparse
+
+from sqlalchemy import create_engine
+
+from src.allocation import config
+from src.allocation.adapters import migrations, orm
+from src.utils.logger import log
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="delete the migrated rows from the old tables instead of copying",
+    )
+    args = parser.parse_args(argv)
+
+    engine = create_engine(config.get_postgres_uri())
+    orm.metadata.create_all(engine, tables=[orm.batch_allocations])
+    with engine.begin() as connection:
+        if args.prune:
+            count = migrations.prune_join_table(connection)
+            log.info("pruned %s allocations from the join table", count)
+        else:
+            count = migrations.copy_to_batch_allocations(connection)
+            log.info("copied %s allocations to batch_allocations", count)
+
+
+if __name__ == "__main__":
+    main()
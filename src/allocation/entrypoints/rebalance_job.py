@@ -0,0 +1,38 @@
+"""
+Background job evening out the stock stripes of striped products.
+
+    python -m src.allocation.entrypoints.rebalance_job [--once]
+
+"""
+
+import time
+import argparse
+import functools
+
+from src.allocation import config
+from src.allocation.adapters import orm
+from src.allocation.service_layer import rebalancing, unit_of_work
+from src.utils.logger import log
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--once", action="store_true", help="run a single pass")
+    parser.add_argument(
+        "--interval", type=float, default=config.get_stripe_rebalance_interval()
+    )
+    parser.add_argument("--chunk-size", type=int, default=100)
+    args = parser.parse_args(argv)
+
+    orm.start_mappers()
+    uow_factory = functools.partial(unit_of_work.SqlAlchemyUnitOfWork, striping=True)
+    while True:
+        changed = rebalancing.rebalance_all(uow_factory, chunk_size=args.chunk_size)
+        log.info("rebalancing pass done, %s stripes changed", changed)
+        if args.once:
+            return
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
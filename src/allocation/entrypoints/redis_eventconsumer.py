@@ -1,18 +1,41 @@
-import json
+import argparse
+
 import redis
 
+from src.utils import metrics, profiling, tracing
 from src.utils.logger import log
 from src.allocation import config
 from src.allocation.domain import commands
-from src.allocation.adapters import orm
-from src.allocation.service_layer import messagebus, unit_of_work
-
+from src.allocation.adapters import orm, serialization
+from src.allocation.service_layer import (
+    handlers,
+    messagebus,
+    partitioning,
+    unit_of_work,
+)
 
 r = redis.Redis(**config.get_redis_host_and_port())
 
+# forwards commands to the sku-partitioned workers, when they are in use
+partition_router = None  # type: partitioning.PartitionRouter
+
+
+profiler = None  # type: profiling.Profiler
+
+
+def main(argv=None):
+    global profiler, partition_router
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--profile", action="store_true", help="profile every message handled"
+    )
+    args = parser.parse_args(argv)
+    profiler = profiling.from_config(sample_rate=1.0 if args.profile else None)
+    partition_router = partitioning.from_config()
+    tracing.configure_from_config()
 
-def main():
     orm.start_mappers()
+    metrics.start_periodic_dump(config.get_metrics_dump_interval(), log.info)
     pubsub = r.pubsub(ignore_subscribe_messages=True)
     pubsub.subscribe("change_batch_quantity")
 
@@ -22,9 +45,22 @@ def main():
 
 def handle_change_batch_quantity(m):
     log.debug("handling %s", m)
-    data = json.loads(m["data"])
+    data = serialization.loads(m["data"])
     cmd = commands.ChangeBatchQuantity(ref=data["batchref"], qty=data["qty"])
-    messagebus.handle(cmd, uow=unit_of_work.SqlAlchemyUnitOfWork())
+    # continue the trace of whoever published the message, if it sent one
+    with tracing.continue_trace(
+        data.get(serialization.TRACE_KEY),
+        "redis.consume",
+        channel="change_batch_quantity",
+    ), profiling.maybe_profile(profiler, cmd):
+        try:
+            if partition_router is not None:
+                partition_router.handle(cmd)
+            else:
+                messagebus.handle(cmd, uow=unit_of_work.SqlAlchemyUnitOfWork())
+        except handlers.UnknownBatch as e:
+            # e.g. a batch archived since; nothing to change, keep listening
+            log.warning("ignoring %s: %s", cmd, e)
 
 
 if __name__ == "__main__":
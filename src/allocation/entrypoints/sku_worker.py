@@ -0,0 +1,80 @@
+"""
+One of the sku-partitioned worker processes started by the supervisor:
+serves commands on its Unix socket, keeping the Products of the skus it
+owns in memory (see service_layer/partitioning.py).
+
+    python -m src.allocation.entrypoints.sku_worker --node 0 --workers 4
+
+"""
+
+import signal
+import argparse
+import threading
+
+from sqlalchemy import create_engine
+
+from src.utils import tracing
+from src.utils.logger import log
+from src.allocation import config
+from src.allocation.adapters import ipc, orm
+from src.allocation.service_layer import (
+    actors,
+    messagebus,
+    partitioning,
+    unit_of_work,
+)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--node", type=int, required=True)
+    parser.add_argument("--workers", type=int, required=True)
+    parser.add_argument("--socket-dir", default=config.get_partition_socket_dir())
+    parser.add_argument("--shards", type=int, default=config.get_actor_shards() or 4)
+    parser.add_argument("--durability", default=config.get_actor_durability())
+    parser.add_argument("--database-uri", help="instead of the configured Postgres")
+    args = parser.parse_args(argv)
+
+    if args.database_uri:
+        # e.g. a SQLite file shared by the workers, for local benchmarks
+        connect_args = {}
+        if args.database_uri.startswith("sqlite"):
+            connect_args = {"check_same_thread": False, "timeout": 30}
+        engine = create_engine(args.database_uri, connect_args=connect_args)
+        unit_of_work.DEFAULT_SESSION_FACTORY.configure(bind=engine)
+    orm.start_mappers()
+    tracing.configure_from_config()
+
+    paths = partitioning.socket_paths(args.socket_dir, args.workers)
+    path = paths[args.node]
+    # the full ring, not the live one: which skus are ours to keep
+    owners = partitioning.HashRing(paths)
+    pool = actors.SkuActorPool(
+        shards=args.shards,
+        durability=args.durability,
+        window=config.get_actor_group_window(),
+        max_batch=config.get_actor_max_batch(),
+    )
+    sku_of = actors.SkuResolver()
+
+    def handle(command):
+        if owners.node_for(sku_of(command)) == path:
+            return pool.handle(command)
+        # standing in for a worker that is down: nothing kept in memory
+        return messagebus.handle(command, unit_of_work.SqlAlchemyUnitOfWork())[0]
+
+    server = ipc.WorkerServer(path, handle, unit_of_work.is_concurrency_conflict)
+    # shutdown() waits for serve_forever(), so it can't run on its thread
+    signal.signal(
+        signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start()
+    )
+    log.info("worker %s of %s serving on %s", args.node, args.workers, path)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        pool.stop()
+
+
+if __name__ == "__main__":
+    main()
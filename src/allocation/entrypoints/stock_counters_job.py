@@ -0,0 +1,44 @@
+"""
+Background job rebuilding the available-stock counters from the database.
+
+    python -m src.allocation.entrypoints.stock_counters_job [--once]
+
+"""
+
+import time
+import argparse
+
+from src.allocation import config
+from src.allocation.adapters import orm
+from src.allocation.service_layer import availability, unit_of_work
+from src.utils.logger import log
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--once", action="store_true", help="run a single pass")
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=config.get_stock_counters_reconcile_interval(),
+    )
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    if availability.counters is None:
+        parser.error("stock counters are disabled; set STOCK_COUNTERS")
+    orm.start_mappers()
+    while True:
+        written = availability.reconcile(
+            unit_of_work.SqlAlchemyUnitOfWork(),
+            availability.counters,
+            chunk_size=args.chunk_size,
+        )
+        log.info("reconciled the stock counters of %s skus", written)
+        if args.once:
+            return
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
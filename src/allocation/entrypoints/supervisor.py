@@ -0,0 +1,88 @@
+"""
+Starts the sku-partitioned worker processes and restarts them when they
+exit; point the API and consumer at them with PARTITION_WORKERS and
+PARTITION_SOCKET_DIR (see service_layer/partitioning.py).
+
+    python -m src.allocation.entrypoints.supervisor --workers 4
+
+"""
+
+import os
+import sys
+import time
+import signal
+import argparse
+import subprocess
+from typing import Dict, List
+
+from src.utils.logger import log
+from src.allocation import config
+
+
+def worker_command(node: int, args: argparse.Namespace) -> List[str]:
+    command = [
+        sys.executable,
+        "-m",
+        "src.allocation.entrypoints.sku_worker",
+        "--node",
+        str(node),
+        "--workers",
+        str(args.workers),
+        "--socket-dir",
+        args.socket_dir,
+    ]
+    if args.database_uri:
+        command += ["--database-uri", args.database_uri]
+    return command
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=config.get_partition_workers() or os.cpu_count(),
+    )
+    parser.add_argument("--socket-dir", default=config.get_partition_socket_dir())
+    parser.add_argument("--database-uri", help="instead of the configured Postgres")
+    parser.add_argument(
+        "--restart-delay",
+        type=float,
+        default=1.0,
+        help="seconds to wait before restarting a worker that exited",
+    )
+    args = parser.parse_args(argv)
+    os.makedirs(args.socket_dir, exist_ok=True)
+
+    stopping = []
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stopping.append(True))
+
+    workers = {}  # type: Dict[int, subprocess.Popen]
+    exited = {}  # type: Dict[int, float]
+    for node in range(args.workers):
+        workers[node] = subprocess.Popen(worker_command(node, args))
+
+    while not stopping:
+        for node, process in workers.items():
+            if process.poll() is None:
+                continue
+            # while it is down, the routers move its skus along the ring
+            if node not in exited:
+                log.warning(
+                    "worker %s exited with %s, restarting", node, process.returncode
+                )
+                exited[node] = time.monotonic()
+            if time.monotonic() - exited[node] >= args.restart_delay:
+                workers[node] = subprocess.Popen(worker_command(node, args))
+                del exited[node]
+        time.sleep(0.1)
+
+    for process in workers.values():
+        process.terminate()
+    for process in workers.values():
+        process.wait()
+
+
+if __name__ == "__main__":
+    main()
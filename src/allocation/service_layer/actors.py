@@ -0,0 +1,212 @@
+"""
+Single-writer execution of commands: each sku's Product is owned by one
+worker thread of a sharded pool, which keeps it in memory between
+commands and writes its changes behind them.
+
+Commands are routed to the owning shard's queue and applied in order, by
+the regular handlers, against the shard's WriteBehindUnitOfWork. With
+"sync" durability every command is committed before its caller is
+answered; with "group" durability a shard applies everything queued (up
+to `max_batch`, optionally waiting `window` seconds for more) and commits
+once for all of them. Either way, callers are only answered once their
+changes are committed, and events are only dispatched after that.
+
+If a commit fails, the whole group fails and the shard drops its
+resident products, to be reloaded from the database by the next command.
+The pool must be the only writer for its skus: products are not
+re-read, so changes made elsewhere would be overwritten.
+
+"""
+
+import queue
+import threading
+import time
+import zlib
+from typing import Callable, Dict, List, Optional
+
+from src.utils.logger import log
+from src.allocation import config
+from src.allocation.domain import commands, events
+from src.allocation.service_layer import handlers, messagebus, unit_of_work
+
+SYNC, GROUP = "sync", "group"
+
+_STOP = object()
+
+
+class _Request:
+    def __init__(self, command: commands.Command, waited: bool = True):
+        self.command = command
+        self.result = None
+        self.error = None  # type: Optional[Exception]
+        self.messages = []  # type: List[messagebus.Message]
+        self.done = threading.Event() if waited else None
+
+
+class SkuResolver:
+    """
+    The sku a command is for, to route it by; commands that only name a
+    batch (ChangeBatchQuantity) are looked up once, as batches never move.
+    """
+
+    def __init__(
+        self,
+        lookup_uow_factory: Callable[
+            [], unit_of_work.AbstractUnitOfWork
+        ] = unit_of_work.SqlAlchemyUnitOfWork,
+    ):
+        self.lookup_uow_factory = lookup_uow_factory
+        self._skus_by_batchref = {}  # type: Dict[str, str]
+
+    def __call__(self, command: commands.Command) -> str:
+        sku = getattr(command, "sku", None)
+        if sku is not None:
+            return sku
+        ref = command.ref
+        if ref not in self._skus_by_batchref:
+            with self.lookup_uow_factory() as uow:
+                product = uow.products.get_by_batchref(ref)
+                if product is None:
+                    raise handlers.UnknownBatch(f"Unknown or archived batch {ref}")
+                self._skus_by_batchref[ref] = product.sku
+        return self._skus_by_batchref[ref]
+
+
+class SkuActorPool:
+    def __init__(
+        self,
+        uow_factory: Callable[
+            [], unit_of_work.AbstractUnitOfWork
+        ] = unit_of_work.WriteBehindUnitOfWork,
+        shards: int = 4,
+        durability: str = SYNC,
+        window: float = 0.0,
+        max_batch: int = 100,
+        lookup_uow_factory: Callable[
+            [], unit_of_work.AbstractUnitOfWork
+        ] = unit_of_work.SqlAlchemyUnitOfWork,
+    ):
+        if durability not in (SYNC, GROUP):
+            raise ValueError(f"Unknown durability {durability!r}")
+        self.uow_factory = uow_factory
+        self.durability = durability
+        self.window = window
+        self.max_batch = max_batch if durability == GROUP else 1
+        self._sku = SkuResolver(lookup_uow_factory)
+        self._inboxes = [queue.Queue() for _ in range(shards)]
+        self._threads = [
+            threading.Thread(
+                target=self._run,
+                args=(inbox, uow_factory()),
+                name=f"sku-actor-{i}",
+                daemon=True,
+            )
+            for i, inbox in enumerate(self._inboxes)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def handle(self, command: commands.Command):
+        """
+        Runs the command on the shard owning its sku and returns the
+        handler's result, once committed.
+        """
+        cached = messagebus.lookup_result(command, self.uow_factory())
+        if cached is not None:
+            return cached
+        request = _Request(command)
+        self._inboxes[self.shard_of(self._sku(command))].put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def shard_of(self, sku: str) -> int:
+        return zlib.crc32(sku.encode()) % len(self._inboxes)
+
+    def stop(self):
+        for inbox in self._inboxes:
+            inbox.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+
+    def _run(self, inbox: queue.Queue, uow: unit_of_work.AbstractUnitOfWork):
+        while True:
+            request = inbox.get()
+            if request is _STOP:
+                return
+            batch = [request]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                try:
+                    request = inbox.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if request is _STOP:
+                    inbox.put(_STOP)  # after this batch
+                    break
+                batch.append(request)
+            self._apply(batch, uow)
+
+    def _apply(self, batch: List[_Request], uow: unit_of_work.AbstractUnitOfWork):
+        for request in batch:
+            command = request.command
+            try:
+                handler = messagebus.COMMAND_HANDLERS[type(command)]
+                request.result = handler(command, uow=uow)
+                request.messages = list(uow.collect_new_events())
+            except Exception as e:
+                # handlers raise before changing anything (InvalidSku,
+                # OrderNotFound...), so the rest of the batch stands
+                request.error = e
+
+        try:
+            uow.flush()
+        except Exception as e:
+            if unit_of_work.is_concurrency_conflict(e):
+                # written behind our back (e.g. by another process); the
+                # callers get a conflict to retry, against fresh state
+                log.warning(f"Commit of {len(batch)} commands conflicted, reloading")
+            else:
+                log.exception(f"Commit of {len(batch)} commands failed, reloading")
+            uow.reset()
+            for request in batch:
+                if request.error is None:
+                    request.error = e
+                request.messages = []
+
+        for request in batch:
+            if request.error is None:
+                messagebus.record_result(request.command, request.result, uow)
+            for message in request.messages:
+                if isinstance(message, commands.Command):
+                    # e.g. re-allocations: same sku, so our own queue; queued
+                    # before the caller is answered, so they run before
+                    # whatever it sends next
+                    self._inboxes[self.shard_of(self._sku(message))].put(
+                        _Request(message, waited=False)
+                    )
+            if request.done is not None:
+                request.done.set()
+
+        for request in batch:
+            for message in request.messages:
+                if isinstance(message, commands.Command):
+                    continue
+                try:
+                    messagebus.handle(message, uow)
+                except Exception:
+                    # already logged by the messagebus; keep the shard alive
+                    continue
+
+
+def from_config() -> Optional[SkuActorPool]:
+    shards = config.get_actor_shards()
+    if not shards:
+        return None
+    return SkuActorPool(
+        shards=shards,
+        durability=config.get_actor_durability(),
+        window=config.get_actor_group_window(),
+        max_batch=config.get_actor_max_batch(),
+    )
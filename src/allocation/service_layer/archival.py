@@ -0,0 +1,52 @@
+"""
+Archival of retired batches (see Batch.is_retirable), so that Products
+only carry the batches that can still be allocated from.
+
+Skus are walked in chunks of `chunk_size`, each product archived in its
+own transaction, with an optional pause between chunks to leave room for
+regular traffic.
+
+"""
+
+import time
+from datetime import date
+from typing import Callable, Optional
+
+from src.allocation.domain import commands
+from src.allocation.service_layer import handlers, messagebus, unit_of_work
+from src.utils.logger import log
+
+
+def archive_all(
+    uow_factory: Callable[
+        [], unit_of_work.AbstractUnitOfWork
+    ] = unit_of_work.SqlAlchemyUnitOfWork,
+    as_of: Optional[date] = None,
+    grace_days: int = 0,
+    chunk_size: int = 100,
+    pause: float = 0.0,
+) -> int:
+    """
+    Archives the retirable batches of every product; returns how many
+    batches were archived.
+    """
+    as_of = as_of or date.today()
+    archived = 0
+    after = None
+    while True:
+        with uow_factory() as uow:
+            skus = uow.products.skus(after=after, limit=chunk_size)
+        if not skus:
+            return archived
+        for sku in skus:
+            cmd = commands.ArchiveBatches(sku, as_of, grace_days)
+            try:
+                [refs] = messagebus.handle(cmd, uow_factory())
+            except handlers.InvalidSku:
+                continue  # removed since we listed it
+            if refs:
+                log.info("archived %s batches of %s", len(refs), sku)
+            archived += len(refs)
+        after = skus[-1]
+        if pause:
+            time.sleep(pause)
@@ -0,0 +1,66 @@
+"""
+Available stock per sku and per batch, for storefront availability checks
+that don't touch the database.
+
+The counters (see adapters/stock_counters.py) are adjusted by handlers of
+the events that change availability, after the changes are committed.
+They are not updated in the same transaction as the database, so a crash
+or a Redis outage between the two leaves them off; `reconcile` rebuilds
+them from the database, and is run periodically by
+entrypoints/stock_counters_job.py. An event handled while it runs may be
+overwritten by the value read just before it, until the next run.
+
+"""
+
+from itertools import groupby
+from typing import Dict
+
+from src.allocation.adapters import stock_counters
+from src.allocation.domain import events
+from src.allocation.service_layer import unit_of_work
+
+# None when disabled (see config.get_stock_counters_backend)
+counters = stock_counters.from_config()
+
+
+def apply(event: events.Event, counters: stock_counters.AbstractStockCounters):
+    if isinstance(event, events.Allocated):
+        counters.adjust(event.sku, event.batchref, -event.qty)
+    elif isinstance(event, events.Deallocated):
+        counters.adjust(event.sku, event.batchref, event.qty)
+    elif isinstance(event, events.BatchCreated):
+        counters.adjust(event.sku, event.ref, event.qty)
+    elif isinstance(event, events.BatchQuantityChanged):
+        # lines this deallocates come as Deallocated events of their own
+        counters.adjust(event.sku, event.ref, event.qty - event.previous_qty)
+    elif isinstance(event, events.BatchArchived):
+        counters.drop_batch(event.sku, event.ref)
+
+
+def reconcile(
+    uow: unit_of_work.AbstractUnitOfWork,
+    counters: stock_counters.AbstractStockCounters,
+    chunk_size: int = 1000,
+) -> int:
+    """
+    Rebuilds the counters of every sku from the database, `chunk_size`
+    rows at a time, writing each chunk's skus in one go; returns how many
+    skus were written.
+    """
+    written = 0
+    chunk = {}  # type: Dict[str, Dict[str, int]]
+    rows = 0
+    with uow:
+        for sku, batches in groupby(
+            uow.products.iter_availability(chunk_size), key=lambda row: row[0]
+        ):
+            chunk[sku] = {ref: available for _, ref, available in batches}
+            rows += len(chunk[sku])
+            if rows >= chunk_size:
+                counters.replace(chunk)
+                written += len(chunk)
+                chunk, rows = {}, 0
+    if chunk:
+        counters.replace(chunk)
+        written += len(chunk)
+    return written
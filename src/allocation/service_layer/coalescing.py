@@ -0,0 +1,158 @@
+"""
+Request coalescing ("group commit") for allocations.
+
+Concurrent Allocate commands for the same sku are gathered for a short
+window and applied to a single Product in one transaction, rather than
+each request loading the aggregate, bumping its version and committing on
+its own. Every caller still gets back its own batchref.
+
+"""
+
+import time
+import threading
+from typing import Callable, Dict, List, Optional, Set
+
+from src.allocation import config
+from src.allocation.domain import commands
+from src.allocation.service_layer import handlers, messagebus, unit_of_work
+from src.utils import profiling, tracing
+from src.utils.logger import log
+
+
+class _Request:
+    def __init__(self, command: commands.Allocate):
+        self.command = command
+        self.leader = False
+        self.done = False
+        self.result = None  # type: Optional[str]
+        self.error = None  # type: Optional[Exception]
+
+
+class AllocationCoalescer:
+    """
+    The first request for a sku becomes that sku's leader: it waits up to
+    `window` seconds (or until `max_batch` requests are queued), applies
+    the batch, and then hands leadership to the oldest request still
+    waiting, if any. Other requests just wait for their result.
+
+    """
+
+    def __init__(
+        self,
+        uow_factory: Callable[
+            [], unit_of_work.AbstractUnitOfWork
+        ] = unit_of_work.SqlAlchemyUnitOfWork,
+        window: float = 0.005,
+        max_batch: int = 50,
+        profiler: Optional[profiling.Profiler] = None,
+    ):
+        self.uow_factory = uow_factory
+        self.window = window
+        self.max_batch = max_batch
+        self.profiler = profiler
+        self._pending = {}  # type: Dict[str, List[_Request]]
+        self._leading = set()  # type: Set[str]
+        self._cond = threading.Condition()
+
+    def allocate(self, command: commands.Allocate) -> Optional[str]:
+        cached = messagebus.lookup_result(command, self.uow_factory())
+        if cached is not None:
+            return cached
+
+        request = _Request(command)
+        with self._cond:
+            self._pending.setdefault(command.sku, []).append(request)
+            if command.sku in self._leading:
+                self._cond.notify_all()
+            else:
+                self._leading.add(command.sku)
+                request.leader = True
+            while not (request.leader or request.done):
+                self._cond.wait()
+
+        if not request.done:
+            self._lead(command.sku)
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _lead(self, sku: str):
+        with self._cond:
+            deadline = time.monotonic() + self.window
+            while len(self._pending[sku]) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._pending[sku][: self.max_batch]
+            del self._pending[sku][: self.max_batch]
+
+        try:
+            self._apply(batch)
+        finally:
+            with self._cond:
+                for request in batch:
+                    request.done = True
+                if self._pending[sku]:
+                    self._pending[sku][0].leader = True
+                else:
+                    del self._pending[sku]
+                    self._leading.discard(sku)
+                self._cond.notify_all()
+
+    def _apply(self, batch: List[_Request]):
+        # a retry may arrive while the original is still queued;
+        # allocate each idempotency key only once
+        unique = {}  # type: Dict[str, commands.Allocate]
+        for request in batch:
+            unique.setdefault(
+                messagebus.idempotency_key(request.command), request.command
+            )
+
+        # instrumented like messagebus.handle_command; the batch runs on
+        # the leader's thread, so its span and profile are the leader's
+        cmds = list(unique.values())
+        labels = dict(
+            kind="command", message="Allocate", handler=handlers.allocate_many.__name__
+        )
+        uow = self.uow_factory()
+        try:
+            with tracing.span(
+                "coalescer.apply", sku=cmds[0].sku, size=len(cmds)
+            ), profiling.maybe_profile(self.profiler, cmds[0]):
+                with messagebus.HANDLER_LATENCY.time(**labels), tracing.span(
+                    labels["handler"]
+                ):
+                    results = handlers.allocate_many(cmds, uow)
+        except Exception as e:
+            messagebus.HANDLER_ERRORS.inc(**labels)
+            log.exception(
+                f"Exception allocating {len(cmds)} commands for {cmds[0].sku}"
+            )
+            for request in batch:
+                request.error = e
+            return
+
+        by_key = dict(zip(unique, results))
+        for command in unique.values():
+            messagebus.record_result(
+                command, by_key[messagebus.idempotency_key(command)], uow
+            )
+        for request in batch:
+            request.result = by_key[messagebus.idempotency_key(request.command)]
+
+        for event in list(uow.collect_new_events()):
+            messagebus.handle(event, uow)
+
+
+def from_config(
+    profiler: Optional[profiling.Profiler] = None,
+) -> Optional[AllocationCoalescer]:
+    window = config.get_allocation_coalescing_window()
+    if not window:
+        return None
+    return AllocationCoalescer(
+        window=window,
+        max_batch=config.get_allocation_coalescing_max_batch(),
+        profiler=profiler,
+    )
@@ -0,0 +1,64 @@
+"""
+Streaming export of allocations as NDJSON or CSV, in constant memory:
+rows are read from the repository in chunks and written out as they come.
+
+"""
+
+import csv
+import io
+import json
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, Tuple
+
+from src.allocation.service_layer import unit_of_work
+
+COLUMNS = ("orderid", "sku", "qty", "batchref")
+
+Row = Tuple[str, str, int, str]
+
+
+def _chunks(rows: Iterable[Row], size: int) -> Iterator[list]:
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def to_ndjson(rows: Iterable[Row], chunk_size: int = 1000) -> Iterator[str]:
+    encode = json.JSONEncoder(separators=(",", ":")).encode
+    for chunk in _chunks(rows, chunk_size):
+        yield "".join(encode(dict(zip(COLUMNS, row))) + "\n" for row in chunk)
+
+
+def to_csv(rows: Iterable[Row], chunk_size: int = 1000) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for chunk in _chunks(rows, chunk_size):
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():  # header only, when there are no rows
+        yield buffer.getvalue()
+
+
+FORMATS = {
+    "ndjson": (to_ndjson, "application/x-ndjson"),
+    "csv": (to_csv, "text/csv"),
+}  # type: Dict[str, Tuple[Callable, str]]
+
+
+def export_allocations(
+    uow: unit_of_work.AbstractUnitOfWork, fmt: str = "ndjson", chunk_size: int = 1000
+) -> Iterator[str]:
+    """
+    Generator of output chunks; the unit of work (and with it, the cursor)
+    stays open until the generator is exhausted or closed.
+
+    """
+    formatter, _ = FORMATS[fmt]
+    with uow:
+        yield from formatter(uow.products.iter_allocations(chunk_size), chunk_size)
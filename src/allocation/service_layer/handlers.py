@@ -1,16 +1,20 @@
-from typing import Optional
-from datetime import date
+from typing import List, Optional
+from datetime import date, timedelta
 
 from src.utils.logger import log
 from src.allocation.domain import model, events, commands
-from src.allocation.service_layer import unit_of_work
-from src.allocation.adapters import email, redis_eventpublisher
+from src.allocation.service_layer import availability, notifications, unit_of_work
+from src.allocation.adapters import redis_eventpublisher, sql_allocation
 
 
 class InvalidSku(Exception):
     pass
 
 
+class UnknownBatch(Exception):
+    pass
+
+
 def is_valid_sku(sku, batches):
     return sku in {batch.sku for batch in batches}
 
@@ -18,10 +22,7 @@ def is_valid_sku(sku, batches):
 def send_out_of_stock_notification(
     event: events.OutOfStock, uow: unit_of_work.AbstractUnitOfWork
 ):
-    email.send(
-        "stock@made.com",
-        f"Out of stock for {event.sku}",
-    )
+    notifications.out_of_stock.record(event.sku)
 
 
 def add_batch(
@@ -33,37 +34,63 @@ def add_batch(
         if product is None:
             product = model.Product(event.sku, batches=[])
             uow.products.add(product)
-        product.batches.append(model.Batch(event.ref, event.sku, event.qty, event.eta))
+        product.add_batch(model.Batch(event.ref, event.sku, event.qty, event.eta))
         uow.commit()
 
 
 def allocate(event: commands.Allocate, uow: unit_of_work.AbstractUnitOfWork) -> str:
     line = model.OrderLine(event.orderid, event.sku, event.qty)
     with uow:
+        striped = uow.stripes is not None and uow.stripes.is_striped(line.sku)
+        if striped and not event.wait:
+            # hot skus: taken from one of the stripes, leaving the Product be
+            batchref = uow.stripes.get(line.sku).allocate(line)
+            uow.commit()
+            return batchref
+        if uow.allocator is not None and not event.wait:
+            # plain allocations, without loading the Product
+            batchref = uow.allocator.allocate(line)
+            if batchref is not sql_allocation.NOT_HANDLED:
+                uow.commit()
+                return batchref
         product = uow.products.get(sku=line.sku)
         if product is None:
             raise InvalidSku(f"Invalid sku {line.sku}")
-        batchref = product.allocate(line)
+        batchref = product.allocate(line, wait=event.wait)
         uow.commit()
         return batchref
 
 
+def allocate_many(
+    cmds: List[commands.Allocate], uow: unit_of_work.AbstractUnitOfWork
+) -> List[Optional[str]]:
+    """
+    Allocates several lines of the same sku against a single load of the
+    Product, with a single commit; results are in the order of `cmds`.
+    """
+    with uow:
+        product = uow.products.get(sku=cmds[0].sku)
+        if product is None:
+            raise InvalidSku(f"Invalid sku {cmds[0].sku}")
+        batchrefs = [
+            product.allocate(
+                model.OrderLine(cmd.orderid, cmd.sku, cmd.qty), wait=cmd.wait
+            )
+            for cmd in cmds
+        ]
+        uow.commit()
+        return batchrefs
+
+
 def deallocate(event: commands.Deallocate, uow: unit_of_work.AbstractUnitOfWork):
     line = model.OrderLine(event.orderid, event.sku, event.qty)
     with uow:
         product = uow.products.get(sku=line.sku)
         if product is None:
             raise InvalidSku(f"Invalid sku {line.sku}")
-
-        for batch in product.batches:
-            if line in batch._allocations:
-                batch.deallocate(line)
-                uow.commit()
-                return batch.reference
-        else:
-            raise model.OrderNotFound(
-                f"Could not find an allocation for line {line.orderid}"
-            )
+        batchref = product.deallocate(line)
+        uow.commit()
+        return batchref
 
 
 def change_batch_quantity(
@@ -71,12 +98,55 @@ def change_batch_quantity(
 ):
     with uow:
         product = uow.products.get_by_batchref(batchref=event.ref)
+        if product is None:
+            raise UnknownBatch(f"Unknown or archived batch {event.ref}")
         product.change_batch_quantity(ref=event.ref, qty=event.qty)
         uow.commit()
 
 
+def change_allocation_strategy(
+    event: commands.ChangeAllocationStrategy, uow: unit_of_work.AbstractUnitOfWork
+):
+    with uow:
+        product = uow.products.get(sku=event.sku)
+        if product is None:
+            raise InvalidSku(f"Invalid sku {event.sku}")
+        product.change_allocation_strategy(event.strategy)
+        uow.commit()
+
+
+def change_stripes(event: commands.ChangeStripes, uow: unit_of_work.AbstractUnitOfWork):
+    with uow:
+        product = uow.products.get(sku=event.sku)
+        if product is None:
+            raise InvalidSku(f"Invalid sku {event.sku}")
+        product.change_stripes(event.stripes)
+        uow.commit()
+
+
+def archive_batches(
+    event: commands.ArchiveBatches, uow: unit_of_work.AbstractUnitOfWork
+) -> List[str]:
+    with uow:
+        product = uow.products.get(sku=event.sku)
+        if product is None:
+            raise InvalidSku(f"Invalid sku {event.sku}")
+        retired = product.retire_batches(event.as_of, timedelta(days=event.grace_days))
+        uow.products.archive(product, retired)
+        uow.commit()
+        return [batch.reference for batch in retired]
+
+
 def publish_allocation_event(
     event: events.Allocated,
     uow: unit_of_work.AbstractUnitOfWork,
 ):
     redis_eventpublisher.publish("line_allocated", event)
+
+
+def update_stock_counters(
+    event: events.Event,
+    uow: unit_of_work.AbstractUnitOfWork,
+):
+    if availability.counters is not None:
+        availability.apply(event, availability.counters)
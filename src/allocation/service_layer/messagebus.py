@@ -1,29 +1,56 @@
 from src.allocation.domain.model import OutOfStock
 from typing import Dict, Type, List, Callable, Union
 
-from tenacity import Retrying, RetryError, stop_after_attempt, wait_exponential
+from tenacity import RetryError
 
+from src.utils import metrics, tracing
 from src.utils.logger import log
 from src.allocation.domain import commands, events
-from src.allocation.service_layer import handlers, unit_of_work
-
+from src.allocation.service_layer import (
+    availability,
+    handlers,
+    resilience,
+    unit_of_work,
+)
 
 Message = Union[commands.Command, events.Event]
 
+HANDLER_LATENCY = metrics.histogram(
+    "allocation_handler_duration_seconds", "Time spent in message handlers."
+)
+HANDLER_ERRORS = metrics.counter(
+    "allocation_handler_errors_total", "Exceptions raised by message handlers."
+)
+
 
 def handle(message: Message, uow: unit_of_work.AbstractUnitOfWork) -> list:
 
+    # retried commands are answered from the result store, without
+    # reloading the aggregate; only the incoming message is looked up,
+    # since commands raised internally (e.g. re-allocations) must run
+    if isinstance(message, commands.Command):
+        cached = lookup_result(message, uow)
+        if cached is not None:
+            log.debug(f"answering command {message} from result store")
+            return [cached]
+
     results = []
     queue = [message]
-    while queue:
-        message = queue.pop(0)
-        if isinstance(message, events.Event):
-            handle_event(message, queue, uow)
-        elif isinstance(message, commands.Command):
-            cmd_result = handle_command(message, queue, uow)
-            results.append(cmd_result)
-        else:
-            raise Exception(f"{message} was not an Event or Command")
+    # one span for the message and everything it raises, so follow-up
+    # events are linked to the command that caused them; and one session,
+    # so that handlers after the first reuse the products it loaded
+    with tracing.span(
+        "messagebus.handle", message=type(message).__name__
+    ), uow.shared_session():
+        while queue:
+            message = queue.pop(0)
+            if isinstance(message, events.Event):
+                handle_event(message, queue, uow)
+            elif isinstance(message, commands.Command):
+                cmd_result = handle_command(message, queue, uow)
+                results.append(cmd_result)
+            else:
+                raise Exception(f"{message} was not an Event or Command")
 
     return results
 
@@ -31,48 +58,190 @@ def handle(message: Message, uow: unit_of_work.AbstractUnitOfWork) -> list:
 def handle_event(
     event: events.Event, queue: List[Message], uow: unit_of_work.AbstractUnitOfWork
 ):
-    for handler in EVENT_HANDLERS[type(event)]:
+    with tracing.span("handle_event", message=type(event).__name__):
+        for handler in EVENT_HANDLERS.get(type(event), []):
+            policy = HANDLER_POLICIES.get(handler, DEFAULT_POLICY)
+            try:
+                policy.call(_run_event_handler, handler, event, queue, uow)
+                if policy.fallback is not None and len(policy.fallback):
+                    replay_diverted(policy, queue, uow)
+            except resilience.CircuitOpen as open_circuit:
+                diverted = policy.divert(handler, event)
+                log.warning(
+                    "Circuit %s open, %s event %s",
+                    open_circuit,
+                    "diverted" if diverted else "dropped",
+                    event,
+                )
+            except RetryError as retry_failure:
+                log.error(
+                    "Failed to handle event %s times, giving up!",
+                    retry_failure.last_attempt.attempt_number,
+                )
+                policy.divert(handler, event)
+
+
+def replay_diverted(
+    policy: resilience.Policy,
+    queue: List[Message],
+    uow: unit_of_work.AbstractUnitOfWork,
+):
+    """
+    Re-runs some of the events diverted while a handler's dependency was
+    down, now that a call to it has gone through: at most
+    REPLAY_BATCH_SIZE, oldest first, each attempted once, so that the
+    request doing it only pays for a bounded amount of extra work. The
+    first failure puts it and the rest back at the front of the queue.
+
+    """
+    diverted = policy.fallback.drain(limit=REPLAY_BATCH_SIZE)
+    for i, (handler, event) in enumerate(diverted):
         try:
-            for attempt in Retrying(
-                stop=stop_after_attempt(3), wait=wait_exponential()
-            ):
-                with attempt:
-                    log.debug(f"handling event {event} with handler {handler}")
-                    handler(event, uow=uow)
-                    queue.extend(uow.collect_new_events())
-        except RetryError as retry_failure:
-            log.error(
-                "Failed to handle event %s times, giving up!",
-                retry_failure.last_attempt.attempt_number,
-            )
-            continue
+            policy.call_once(_run_event_handler, handler, event, queue, uow)
+        except Exception:
+            policy.fallback.requeue(diverted[i:])
+            log.warning("replay stopped, %s events diverted again", len(diverted) - i)
+            return
 
 
-def handle_command(
-    command: commands.Command,
+def _run_event_handler(
+    handler: Callable,
+    event: events.Event,
     queue: List[Message],
     uow: unit_of_work.AbstractUnitOfWork,
 ):
-    log.debug(f"handling command {command}")
+    log.debug(f"handling event {event} with handler {handler}")
+    labels = dict(kind="event", message=type(event).__name__, handler=handler.__name__)
     try:
-        handler = COMMAND_HANDLERS[type(command)]
-        result = handler(command, uow=uow)
-        queue.extend(uow.collect_new_events())
-        return result
+        with HANDLER_LATENCY.time(**labels), tracing.span(handler.__name__):
+            handler(event, uow=uow)
     except Exception:
-        log.exception(f"Exception handling command {command}")
+        HANDLER_ERRORS.inc(**labels)
         raise
+    queue.extend(uow.collect_new_events())
+
+
+def handle_command(
+    command: commands.Command,
+    queue: List[Message],
+    uow: unit_of_work.AbstractUnitOfWork,
+):
+    log.debug(f"handling command {command}")
+    handler = COMMAND_HANDLERS[type(command)]
+    labels = dict(
+        kind="command", message=type(command).__name__, handler=handler.__name__
+    )
+    with tracing.span("handle_command", message=type(command).__name__):
+        try:
+            with HANDLER_LATENCY.time(**labels), tracing.span(handler.__name__):
+                result = handler(command, uow=uow)
+            queue.extend(uow.collect_new_events())
+            record_result(command, result, uow)
+            return result
+        except Exception:
+            HANDLER_ERRORS.inc(**labels)
+            log.exception(f"Exception handling command {command}")
+            raise
+
+
+def idempotency_key(command: commands.Command) -> str:
+    if command.idempotency_key:
+        return f"{type(command).__name__}:{command.idempotency_key}"
+    return line_key(type(command), command)
+
 
+def line_key(command_type: Type[commands.Command], command: commands.Command) -> str:
+    # the default idempotency key, and the group of every result for the line
+    return f"{command_type.__name__}:{command.orderid}:{command.sku}"
 
+
+def lookup_result(command: commands.Command, uow: unit_of_work.AbstractUnitOfWork):
+    if type(command) not in IDEMPOTENT_COMMANDS:
+        return None
+    return uow.results.get(idempotency_key(command))
+
+
+def record_result(
+    command: commands.Command, result, uow: unit_of_work.AbstractUnitOfWork
+):
+    if type(command) not in IDEMPOTENT_COMMANDS:
+        return
+    # failed attempts (e.g. out of stock) are not cached so they can be retried
+    key = idempotency_key(command)
+    if result is None:
+        uow.results.discard(key)
+    else:
+        uow.results.put(key, result, group=line_key(type(command), command))
+
+    # an allocation undoes an earlier deallocation of the same line and
+    # vice versa, so the opposite command's results are stale, whichever
+    # idempotency keys they were stored under
+    opposite = IDEMPOTENT_COMMANDS[type(command)]
+    uow.results.discard_group(line_key(opposite, command))
+
+
+# events without handlers (e.g. those only recorded for event sourcing)
+# are simply not dispatched
 EVENT_HANDLERS = {
     events.OutOfStock: [handlers.send_out_of_stock_notification],
     events.Allocated: [handlers.publish_allocation_event],
 }  # type: Dict[Type[events.Event], List[Callable]]
 
+# events that change available stock; the counters' handler is only
+# registered when they are enabled, as dispatching even a no-op handler
+# costs more than the rest of a quick command
+STOCK_COUNTER_EVENTS = (
+    events.Allocated,
+    events.Deallocated,
+    events.BatchCreated,
+    events.BatchQuantityChanged,
+    events.BatchArchived,
+)
+if availability.counters is not None:
+    for _event in STOCK_COUNTER_EVENTS:
+        EVENT_HANDLERS.setdefault(_event, []).append(handlers.update_stock_counters)
+
+
+# retry and circuit-breaker policies for the handlers above; handlers
+# without an entry get DEFAULT_POLICY
+REDIS_BREAKER = resilience.CircuitBreaker(
+    "redis", failure_threshold=5, reset_timeout=30
+)
+
+HANDLER_POLICIES = {
+    handlers.publish_allocation_event: resilience.Policy(
+        attempts=3,
+        breaker=REDIS_BREAKER,
+        fallback=resilience.FallbackQueue("line_allocated"),
+    ),
+    handlers.send_out_of_stock_notification: resilience.Policy(attempts=1),
+    # increments aren't idempotent, so not retried: the counters are
+    # reconciled from the database instead
+    handlers.update_stock_counters: resilience.Policy(
+        attempts=1, breaker=REDIS_BREAKER
+    ),
+}  # type: Dict[Callable, resilience.Policy]
+
+DEFAULT_POLICY = resilience.Policy(attempts=3)
+
+# diverted events replayed after each successful call to their handler
+REPLAY_BATCH_SIZE = 20
+
 
 COMMAND_HANDLERS = {
     commands.Allocate: handlers.allocate,
     commands.Deallocate: handlers.deallocate,
     commands.CreateBatch: handlers.add_batch,
     commands.ChangeBatchQuantity: handlers.change_batch_quantity,
+    commands.ChangeAllocationStrategy: handlers.change_allocation_strategy,
+    commands.ArchiveBatches: handlers.archive_batches,
+    commands.ChangeStripes: handlers.change_stripes,
 }  # type: Dict[Type[commands.Command], Callable]
+
+
+# commands answered from the result store, mapped to the command whose
+# cached results they invalidate
+IDEMPOTENT_COMMANDS = {
+    commands.Allocate: commands.Deallocate,
+    commands.Deallocate: commands.Allocate,
+}  # type: Dict[Type[commands.Command], Type[commands.Command]]
@@ -0,0 +1,95 @@
+"""
+Aggregation of notifications raised while handling messages, so that a
+burst of identical events produces one email rather than thousands.
+
+"""
+
+import time
+import threading
+from typing import Callable, Dict
+
+from src.allocation import config
+from src.allocation.adapters import email
+from src.utils.logger import log
+
+
+class OutOfStockDigest:
+    """
+    De-duplicates OutOfStock events per sku within a time window, and sends
+    a single digest email per window listing each sku and how many of its
+    events were suppressed.
+
+    The window opens on the first event after a flush; it is flushed by a
+    timer thread when it expires (auto_flush), or by the next event to
+    arrive after it has expired.
+
+    """
+
+    def __init__(
+        self,
+        sender: email.AbstractEmailSender,
+        recipient: str = "stock@made.com",
+        window: float = 60.0,
+        clock: Callable[[], float] = time.monotonic,
+        auto_flush: bool = True,
+    ):
+        self.sender = sender
+        self.recipient = recipient
+        self.window = window
+        self.clock = clock
+        self.auto_flush = auto_flush
+        self.suppressed = 0  # running total, across all windows
+        self._counts = {}  # type: Dict[str, int]
+        self._window_started = None
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def record(self, sku: str):
+        with self._lock:
+            now = self.clock()
+            if self._window_started is not None and self._expired(now):
+                self._flush()
+            if self._window_started is None:
+                self._open_window(now)
+            self._counts[sku] = self._counts.get(sku, 0) + 1
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _expired(self, now: float) -> bool:
+        return now - self._window_started >= self.window
+
+    def _open_window(self, now: float):
+        self._window_started = now
+        if self.auto_flush:
+            self._timer = threading.Timer(self.window, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        counts, self._counts = self._counts, {}
+        self._window_started = None
+        if not counts:
+            return
+
+        suppressed = sum(count - 1 for count in counts.values())
+        self.suppressed += suppressed
+        log.debug("out-of-stock digest for %s, %s suppressed", counts, suppressed)
+        self.sender.send(
+            self.recipient,
+            f"Out of stock for {', '.join(sorted(counts))}",
+            "\n".join(
+                f"{sku}: {count} out-of-stock events ({count - 1} suppressed)"
+                for sku, count in sorted(counts.items())
+            ),
+        )
+
+
+out_of_stock = OutOfStockDigest(
+    email.BackgroundEmailSender(email.ConsoleEmailSender()),
+    window=config.get_out_of_stock_window(),
+)
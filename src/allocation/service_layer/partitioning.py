@@ -0,0 +1,154 @@
+"""
+Partitioning of skus across worker processes (see entrypoints/supervisor.py).
+
+Each worker owns the skus that a consistent-hash ring over the workers'
+socket paths assigns to it, and keeps their Products in memory (see
+service_layer/actors.py), so no two processes contend on an aggregate.
+The API and the consumer forward commands to the owner with a
+PartitionRouter.
+
+When a worker can't be reached, the router takes it off its ring, so its
+skus fall to the next workers along (and only those skus move); it is put
+back on the ring after `retry_after` seconds, once restarted. Workers
+standing in for another don't keep its skus in memory, so the owner finds
+the database up to date when it gets them back.
+
+"""
+
+import bisect
+import hashlib
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+from src.utils.logger import log
+from src.allocation import config
+from src.allocation.adapters import ipc
+from src.allocation.domain import commands, model, strategies
+from src.allocation.service_layer import actors, handlers, unit_of_work
+
+
+class NoLiveWorkers(Exception):
+    pass
+
+
+def socket_paths(socket_dir: str, workers: int) -> List[str]:
+    return [os.path.join(socket_dir, f"worker-{i}.sock") for i in range(workers)]
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    Consistent hashing: each node is placed at `replicas` points on the
+    ring, and a key belongs to the first node at or after its own hash.
+    """
+
+    def __init__(self, nodes: Iterable[str] = (), replicas: int = 64):
+        self.replicas = replicas
+        self._points = []  # type: List[int]
+        self._nodes = {}  # type: Dict[int, str]
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node: str):
+        for i in range(self.replicas):
+            point = _hash(f"{node}#{i}")
+            if point not in self._nodes:
+                bisect.insort(self._points, point)
+                self._nodes[point] = node
+
+    def remove(self, node: str):
+        for i in range(self.replicas):
+            point = _hash(f"{node}#{i}")
+            if self._nodes.get(point) == node:
+                del self._nodes[point]
+                self._points.remove(point)
+
+    def node_for(self, key: str) -> str:
+        if not self._points:
+            raise NoLiveWorkers("No workers on the ring")
+        index = bisect.bisect_left(self._points, _hash(key)) % len(self._points)
+        return self._nodes[self._points[index]]
+
+    @property
+    def nodes(self) -> set:
+        return set(self._nodes.values())
+
+
+# errors raised by handlers that callers deal with, re-raised as such
+# when they come back from a worker
+REMOTE_ERRORS = {
+    "InvalidSku": handlers.InvalidSku,
+    "UnknownBatch": handlers.UnknownBatch,
+    "UnknownStrategy": strategies.UnknownStrategy,
+    "OrderNotFound": model.OrderNotFound,
+    "ValueError": ValueError,
+}  # type: Dict[str, Callable[[str], Exception]]
+
+
+class PartitionRouter:
+    def __init__(
+        self,
+        paths: List[str],
+        replicas: int = 64,
+        retry_after: float = 1.0,
+        codec: str = None,
+        lookup_uow_factory: Callable[
+            [], unit_of_work.AbstractUnitOfWork
+        ] = unit_of_work.SqlAlchemyUnitOfWork,
+    ):
+        self.retry_after = retry_after
+        self.clients = {path: ipc.WorkerClient(path, codec) for path in paths}
+        self.ring = HashRing(paths, replicas)
+        self._sku = actors.SkuResolver(lookup_uow_factory)
+        self._down = {}  # type: Dict[str, float]
+        self._lock = threading.Lock()
+
+    def handle(self, command: commands.Command):
+        """
+        Runs the command on the worker owning its sku, returning the
+        handler's result.
+        """
+        sku = self._sku(command)
+        while True:
+            node = self._route(sku)
+            try:
+                return self.clients[node].call(command)
+            except ipc.WorkerUnavailable as e:
+                # not sent, so it can go to the next worker along
+                self._mark_down(node, e)
+            except ipc.RemoteError as e:
+                error = REMOTE_ERRORS.get(e.kind)
+                if error is None:
+                    raise
+                raise error(str(e)) from e
+
+    def _route(self, sku: str) -> str:
+        with self._lock:
+            now = time.monotonic()
+            for node, since in list(self._down.items()):
+                if now - since >= self.retry_after:
+                    del self._down[node]
+                    self.ring.add(node)
+            return self.ring.node_for(sku)
+
+    def _mark_down(self, node: str, error: Exception):
+        with self._lock:
+            if node not in self._down:
+                log.warning("%s; moving its skus to the other workers", error)
+                self._down[node] = time.monotonic()
+                self.ring.remove(node)
+
+
+def from_config() -> Optional[PartitionRouter]:
+    workers = config.get_partition_workers()
+    if not workers:
+        return None
+    return PartitionRouter(
+        socket_paths(config.get_partition_socket_dir(), workers),
+        retry_after=config.get_partition_retry_after(),
+    )
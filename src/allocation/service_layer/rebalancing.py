@@ -0,0 +1,45 @@
+"""
+Background rebalancing of striped stock (see domain/striping.py).
+
+Allocations drain stripes unevenly, and a line only fits in a single
+stripe; evening out each batch's stripes now and then keeps lines that
+would fit the batch from being turned away. Each sku is rebalanced in
+its own short transaction, with its stripes locked.
+
+"""
+
+import time
+from typing import Callable
+
+from src.allocation.service_layer import unit_of_work
+from src.utils.logger import log
+
+
+def rebalance_all(
+    uow_factory: Callable[
+        [], unit_of_work.AbstractUnitOfWork
+    ] = unit_of_work.SqlAlchemyUnitOfWork,
+    chunk_size: int = 100,
+    pause: float = 0.0,
+) -> int:
+    """
+    Rebalances the stripes of every striped product; returns how many
+    stripes changed.
+    """
+    changed = 0
+    after = None
+    while True:
+        with uow_factory() as uow:
+            skus = uow.stripes.striped_skus(after=after, limit=chunk_size)
+        if not skus:
+            return changed
+        for sku in skus:
+            with uow_factory() as uow:
+                moved = uow.stripes.rebalance(sku)
+                uow.commit()
+            if moved:
+                log.debug("rebalanced %s stripes of %s", moved, sku)
+            changed += moved
+        after = skus[-1]
+        if pause:
+            time.sleep(pause)
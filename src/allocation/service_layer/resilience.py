@@ -0,0 +1,249 @@
+"""
+Retry and circuit-breaker policies for message handlers that depend on
+external services, so that an outage fails fast instead of making every
+request pay the full retry backoff.
+
+"""
+
+import time
+import threading
+from collections import deque
+from typing import Callable, Deque, List, Optional, Tuple
+
+from tenacity import Retrying, stop_after_attempt, wait_exponential
+
+from src.utils import metrics as _metrics
+from src.utils.logger import log
+
+BREAKERS = []  # type: List[CircuitBreaker]
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures; while open, calls
+    are rejected without being attempted. After `reset_timeout` seconds it
+    goes half-open and lets a single probe call through, which either closes
+    it again (success) or re-opens it (failure).
+
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+        registry: Optional[List["CircuitBreaker"]] = BREAKERS,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.times_opened = 0
+        self.rejected = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+        # breakers in the registry are exported on /metrics
+        if registry is not None:
+            registry.append(self)
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return self.CLOSED
+        if self.clock() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.failure_threshold:
+                if self._opened_at is None or self._probing:
+                    log.warning("circuit breaker %s opened", self.name)
+                    self.times_opened += 1
+                self._opened_at = self.clock()
+                self._probing = False
+
+    def metrics(self) -> dict:
+        return dict(
+            name=self.name,
+            state=self.state,
+            failures=self.failures,
+            times_opened=self.times_opened,
+            rejected=self.rejected,
+        )
+
+
+class FallbackQueue:
+    """
+    Bounded holding area for messages whose handler could not run; the
+    oldest entries are dropped when full. The messagebus replays a few of
+    them after each successful call to their handler.
+
+    """
+
+    def __init__(self, name: str, max_size: int = 10_000):
+        self.name = name
+        self.dropped = 0
+        self._items = deque(maxlen=max_size)  # type: Deque[Tuple[Callable, object]]
+        self._lock = threading.Lock()
+
+    def put(self, handler: Callable, message):
+        with self._lock:
+            if len(self._items) == self._items.maxlen:
+                self.dropped += 1
+            self._items.append((handler, message))
+
+    def drain(self, limit: Optional[int] = None) -> List[Tuple[Callable, object]]:
+        """
+        Takes up to `limit` entries (all of them by default), oldest first.
+
+        """
+        with self._lock:
+            count = len(self._items) if limit is None else min(limit, len(self._items))
+            return [self._items.popleft() for _ in range(count)]
+
+    def requeue(self, items: List[Tuple[Callable, object]]):
+        """
+        Puts drained entries back at the front, in their original order;
+        entries beyond max_size are dropped from the newest end.
+
+        """
+        with self._lock:
+            for item in reversed(items):
+                if len(self._items) == self._items.maxlen:
+                    self.dropped += 1
+                self._items.appendleft(item)
+
+    def __len__(self):
+        return len(self._items)
+
+
+class Policy:
+    """
+    How a handler is retried and guarded. Policies are built once, when
+    handlers are registered, rather than on every call.
+
+    """
+
+    def __init__(
+        self,
+        attempts: int = 3,
+        wait_multiplier: float = 1.0,
+        wait_max: float = 10.0,
+        breaker: Optional[CircuitBreaker] = None,
+        fallback: Optional[FallbackQueue] = None,
+    ):
+        self.attempts = attempts
+        self.wait = wait_exponential(multiplier=wait_multiplier, max=wait_max)
+        self.stop = stop_after_attempt(attempts)
+        if breaker is not None:
+            # stop backing off as soon as the breaker trips
+            self.stop = self.stop | (
+                lambda retry_state: breaker.state != breaker.CLOSED
+            )
+        self.breaker = breaker
+        self.fallback = fallback
+
+    def call(self, fn: Callable, *args, **kwargs):
+        """
+        Raises CircuitOpen without calling fn if the breaker is open,
+        and tenacity.RetryError once attempts are exhausted.
+
+        """
+        if self.breaker is not None and not self.breaker.allow():
+            raise CircuitOpen(self.breaker.name)
+        for attempt in Retrying(stop=self.stop, wait=self.wait):
+            with attempt:
+                try:
+                    result = fn(*args, **kwargs)
+                except Exception:
+                    if self.breaker is not None:
+                        self.breaker.record_failure()
+                    raise
+        if self.breaker is not None:
+            self.breaker.record_success()
+        return result
+
+    def call_once(self, fn: Callable, *args, **kwargs):
+        """
+        Like call(), but a single attempt without backoff: for replays,
+        which must not keep the caller waiting.
+
+        """
+        if self.breaker is not None and not self.breaker.allow():
+            raise CircuitOpen(self.breaker.name)
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            if self.breaker is not None:
+                self.breaker.record_failure()
+            raise
+        if self.breaker is not None:
+            self.breaker.record_success()
+        return result
+
+    def divert(self, handler: Callable, message) -> bool:
+        if self.fallback is None:
+            return False
+        self.fallback.put(handler, message)
+        return True
+
+
+def metrics() -> List[dict]:
+    return [breaker.metrics() for breaker in BREAKERS]
+
+
+STATE_VALUES = {
+    CircuitBreaker.CLOSED: 0,
+    CircuitBreaker.HALF_OPEN: 1,
+    CircuitBreaker.OPEN: 2,
+}
+
+
+def _collect_breaker_metrics() -> List[str]:
+    lines = [
+        "# HELP allocation_circuit_breaker_state 0=closed, 1=half-open, 2=open.",
+        "# TYPE allocation_circuit_breaker_state gauge",
+    ]
+    for m in metrics():
+        lines.append(
+            f'allocation_circuit_breaker_state{{name="{m["name"]}"}} '
+            f"{STATE_VALUES[m['state']]}"
+        )
+    for field in ("times_opened", "rejected"):
+        lines.append(f"# TYPE allocation_circuit_breaker_{field}_total counter")
+        lines.extend(
+            f'allocation_circuit_breaker_{field}_total{{name="{m["name"]}"}} {m[field]}'
+            for m in metrics()
+        )
+    return lines
+
+
+_metrics.register_collector(_collect_breaker_metrics)
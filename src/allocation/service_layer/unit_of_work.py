@@ -1,18 +1,111 @@
 import abc
+import time
+import threading
+import functools
+import contextlib
+from typing import Optional, Set
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker, clear_mappers
+from sqlalchemy.orm.exc import StaleDataError
 
 from src.allocation import config
-from src.allocation.adapters import repository
+from src.allocation.domain import model
+from src.allocation.adapters import (
+    event_store,
+    ipc,
+    replicas,
+    repository,
+    result_store,
+    sql_allocation,
+    stripes,
+)
+from src.utils import metrics
 
 DEFAULT_SESSION_FACTORY = sessionmaker(
     bind=create_engine(config.get_postgres_uri(), isolation_level="REPEATABLE READ")
 )
+DEFAULT_RESULT_STORE = result_store.from_config()
+# falls back to whatever DEFAULT_SESSION_FACTORY is bound to
+DEFAULT_REPLICAS = replicas.from_config(DEFAULT_SESSION_FACTORY)
+
+
+def repository_factory_from_config():
+    if config.get_persistence_mode() == "events":
+        return functools.partial(
+            event_store.EventSourcedRepository,
+            snapshot_interval=config.get_snapshot_interval(),
+        )
+    return repository.SqlAlchemyRepository
+
+
+DEFAULT_REPOSITORY_FACTORY = repository_factory_from_config()
+
+COMMIT_LATENCY = metrics.histogram(
+    "allocation_uow_commit_duration_seconds", "Time spent committing units of work."
+)
+ROLLBACK_LATENCY = metrics.histogram(
+    "allocation_uow_rollback_duration_seconds", "Time spent rolling back units of work."
+)
+SQL_STATEMENTS = metrics.histogram(
+    "allocation_uow_sql_statements",
+    "SQL statements executed per unit of work.",
+    buckets=metrics.COUNT_BUCKETS,
+)
+
+# running count of statements executed by each thread; a unit of work
+# records the difference between its __enter__ and __exit__
+_statements = threading.local()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count_statement(*args):
+    _statements.count = getattr(_statements, "count", 0) + 1
+
+
+def _statement_count() -> int:
+    return getattr(_statements, "count", 0)
+
+
+# SQLSTATEs for serialization failures and deadlocks
+CONFLICT_PGCODES = {"40001", "40P01"}
+# two writers appending the same sequence number to an event stream
+STREAM_CONFLICT_MARKERS = (
+    "uq_product_events_stream",
+    "product_events.sku, product_events.sequence",  # sqlite
+)
+
+
+def is_concurrency_conflict(error: Exception) -> bool:
+    """
+    Whether a database error was caused by a concurrent update of the same
+    rows (so the command can be retried), rather than by a genuine fault.
+    """
+    if isinstance(error, stripes.StripeConflict):
+        return True
+    if isinstance(error, ipc.RemoteError):
+        return error.conflict  # as classified by the worker
+    if isinstance(error, StaleDataError):
+        return True  # a product changed since it was loaded
+    if not isinstance(error, exc.DBAPIError):
+        return False
+    if getattr(error.orig, "pgcode", None) in CONFLICT_PGCODES:
+        return True
+    message = str(error.orig)
+    if any(marker in message for marker in STREAM_CONFLICT_MARKERS):
+        return True
+    return "database is locked" in message  # sqlite
 
 
 class AbstractUnitOfWork(abc.ABC):
     products: repository.AbstractProductRepository
+    results: result_store.AbstractResultStore
+    # striped stock of hot skus, when enabled (see adapters/stripes.py)
+    stripes = None  # type: Optional[stripes.StripeRepository]
+    # allocation without loading the Product, when enabled (see
+    # adapters/sql_allocation.py)
+    allocator = None  # type: Optional[sql_allocation.SqlAllocator]
 
     def __enter__(self):
         return self
@@ -23,10 +116,24 @@ class AbstractUnitOfWork(abc.ABC):
     def commit(self):
         self._commit()
 
+    @contextlib.contextmanager
+    def shared_session(self):
+        """
+        Units of work entered within share one session, and so reuse what
+        was loaded by earlier ones, while each still commits or rolls back
+        its own transaction; used across everything one message raises.
+        """
+        yield
+
     def collect_new_events(self):
         for product in self.products.seen:
             while product.events:
                 yield product.events.pop(0)
+        for stock in self.stripes.seen if self.stripes is not None else ():
+            while stock.events:
+                yield stock.events.pop(0)
+        while self.allocator is not None and self.allocator.events:
+            yield self.allocator.events.pop(0)
 
     @abc.abstractmethod
     def _commit(self):
@@ -38,33 +145,199 @@ class AbstractUnitOfWork(abc.ABC):
 
 
 class SqlAlchemyUnitOfWork(AbstractUnitOfWork):
-    def __init__(self, session_factory=DEFAULT_SESSION_FACTORY):
+    def __init__(
+        self,
+        session_factory=DEFAULT_SESSION_FACTORY,
+        results=None,
+        repository_factory=DEFAULT_REPOSITORY_FACTORY,
+        striping=config.get_stock_striping(),
+        sql_allocation=config.get_sql_allocation(),
+    ):
         self.session_factory = session_factory
+        # looked up when None rather than bound as the default, so that
+        # tests can swap in their own store
+        self.results = results if results is not None else DEFAULT_RESULT_STORE
+        self.repository_factory = repository_factory
+        self.striping = striping
+        self.sql_allocation = sql_allocation
+        # set within shared_session()
+        self._shared = None  # type: Optional[Session]
+        self._shared_products = None
+        self._kept = set()  # type: Set[model.Product]
+
+    @contextlib.contextmanager
+    def shared_session(self):
+        if self._shared is not None:
+            yield  # already sharing one
+            return
+        # loaded state must survive commits for later units of work to
+        # reuse it; products changed concurrently in between are caught by
+        # their version check (see orm.start_mappers)
+        self._shared = self.session_factory(expire_on_commit=False)
+        try:
+            yield
+        finally:
+            self._shared.close()
+            self._shared = self._shared_products = None
+            self._kept.clear()
 
     def __enter__(self):
-        self.session = self.session_factory()  # type: Session
-        self.products = repository.SqlAlchemyRepository(self.session)
+        if self._shared is None:
+            self.session = self.session_factory()  # type: Session
+            self.products = self.repository_factory(self.session)
+        else:
+            self.session = self._shared
+            if self._shared_products is None:
+                self._shared_products = self.repository_factory(self.session)
+            self.products = self._shared_products
+            # only what this unit of work touches has events to collect;
+            # the rest is kept, as the identity map only holds it weakly
+            self._kept.update(self.products.seen)
+            self.products.seen = set()
+        if self.striping:
+            self.stripes = stripes.StripeRepository(self.session)
+        # the event store keeps no allocation rows to insert into
+        if self.sql_allocation and isinstance(
+            self.products, repository.SqlAlchemyRepository
+        ):
+            self.allocator = sql_allocation.SqlAllocator(self.session)
+        self._statements_at_enter = _statement_count()
         return super().__enter__()
 
     def __exit__(self, *args):
-        super().__exit__(*args)
-        self.session.close()
+        if self._shared is None:
+            super().__exit__(*args)
+            self.session.close()
+        else:
+            if self.session.in_transaction():
+                # not committed: the session expires what it loaded when
+                # rolled back, but products kept by the repository itself
+                # (e.g. event-sourced ones) must be dropped with it
+                self._shared_products = None
+            super().__exit__(*args)
+        SQL_STATEMENTS.observe(_statement_count() - self._statements_at_enter)
+
+    def _commit(self):
+        with COMMIT_LATENCY.time():
+            self.products.record_changes()
+            if self.stripes is not None:
+                self.stripes.record_changes(self.products.seen)
+            self.session.commit()
+
+    def rollback(self):
+        with ROLLBACK_LATENCY.time():
+            self.session.rollback()
+
+
+class ReadOnly(Exception):
+    pass
+
+
+def _refuse_flush(*args):
+    raise ReadOnly("Read-only units of work can't write")
+
+
+class ReadOnlyUnitOfWork(SqlAlchemyUnitOfWork):
+    """
+    For queries: runs on a healthy replica, or on the primary when there
+    is none, and refuses to flush or commit anything.
+    """
+
+    def __init__(
+        self,
+        replica_set=DEFAULT_REPLICAS,
+        results=None,
+        repository_factory=DEFAULT_REPOSITORY_FACTORY,
+    ):
+        super().__init__(
+            None, results, repository_factory, striping=False, sql_allocation=False
+        )
+        self.replica_set = replica_set
+        self.replica = None  # type: Optional[replicas.Replica]
+
+    # nothing is kept from one query to the next
+    shared_session = AbstractUnitOfWork.shared_session
+
+    def __enter__(self):
+        self.replica = self.replica_set.pick()
+        self.session_factory = self.replica_set.session_factory(self.replica)
+        super().__enter__()
+        # queries don't flush first, and nothing else may
+        self.session.autoflush = False
+        event.listen(self.session, "before_flush", _refuse_flush)
+        return self
+
+    def __exit__(self, exc_type, error, traceback):
+        super().__exit__(exc_type, error, traceback)
+        lost = isinstance(error, exc.DBAPIError) and error.connection_invalidated
+        if lost and self.replica is not None:
+            self.replica_set.mark_down(self.replica, error)
+
+    def _commit(self):
+        raise ReadOnly("Read-only units of work can't commit")
+
+
+class WriteBehindUnitOfWork(AbstractUnitOfWork):
+    """
+    A unit of work reused across commands by the single owner of a set of
+    skus (see service_layer/actors.py): the products it loads stay
+    resident, and handlers' commits only mark them changed until the owner
+    calls flush(). reset() drops everything, to be reloaded from the
+    database.
+    """
+
+    def __init__(
+        self,
+        session_factory=DEFAULT_SESSION_FACTORY,
+        results=None,
+    ):
+        self.session_factory = session_factory
+        self.results = results if results is not None else DEFAULT_RESULT_STORE
+        self.session = None
+        self.dirty = False
+
+    def __enter__(self):
+        if self.session is None:
+            # loaded state must survive commits, or every flush would
+            # have the next command reload it
+            self.session = self.session_factory(expire_on_commit=False)
+            self.products = repository.ResidentRepository(self.session)
+        # only what this command touches has events to collect
+        self.products.seen = set()
+        return super().__enter__()
 
     def _commit(self):
-        self.session.commit()
+        self.dirty = True
 
     def rollback(self):
-        self.session.rollback()
+        pass
+
+    def flush(self):
+        if not self.dirty:
+            return
+        with COMMIT_LATENCY.time():
+            self.products.record_changes()
+            self.session.commit()
+        self.dirty = False
+
+    def reset(self):
+        if self.session is not None:
+            with ROLLBACK_LATENCY.time():
+                self.session.rollback()
+            self.session.close()
+        self.session = None
+        self.dirty = False
 
 
 # for mocks during tests
 class FakeUnitOfWork(AbstractUnitOfWork):
     def __init__(self):
         self.products = repository.FakeRepository([])
+        self.results = result_store.InMemoryResultStore()
         self.committed = False
 
     def _commit(self):
         self.committed = True
 
     def rollback(self):
-        pass
\ No newline at end of file
+        pass
@@ -0,0 +1,103 @@
+"""
+Read-only queries, answered with plain SQL rather than by loading
+aggregates through the repository; except in event-sourced mode, where
+the products and batches tables aren't written and a product's batches
+only exist in its rebuilt aggregate.
+
+"""
+
+from datetime import date
+from typing import Optional
+
+from sqlalchemy import func, select
+
+from src.allocation.adapters import event_store, orm
+from src.allocation.service_layer import unit_of_work
+
+# allocations from a striped product bump the version of the stripe they
+# came from rather than the product's, so both count
+PRODUCT_VERSION = """
+    SELECT version_number + COALESCE(
+        (SELECT SUM(version) FROM stock_stripes WHERE sku = :sku), 0
+    )
+    FROM products WHERE sku = :sku
+"""
+
+# every recorded event carries the product version it was recorded at,
+# and a rebuilt product takes that of its last one
+EVENT_SOURCED_PRODUCT_VERSION = """
+    SELECT MAX(version_number) + COALESCE(
+        (SELECT SUM(version) FROM stock_stripes WHERE sku = :sku), 0
+    )
+    FROM product_events WHERE sku = :sku
+"""
+
+
+def _version(sku: str, uow: unit_of_work.SqlAlchemyUnitOfWork) -> Optional[int]:
+    event_sourced = isinstance(uow.products, event_store.EventSourcedRepository)
+    query = EVENT_SOURCED_PRODUCT_VERSION if event_sourced else PRODUCT_VERSION
+    row = uow.session.execute(query, dict(sku=sku)).first()
+    return row[0] if row else None
+
+
+def product_version(sku: str, uow: unit_of_work.SqlAlchemyUnitOfWork) -> Optional[int]:
+    with uow:
+        return _version(sku, uow)
+
+
+def stock(sku: str, uow: unit_of_work.SqlAlchemyUnitOfWork) -> Optional[dict]:
+    """
+    Available quantity and ETA of each of a product's batches, along with the
+    product version they were read at (both from one transaction).
+
+    """
+    with uow:
+        version = _version(sku, uow)
+        if version is None:
+            return None
+        if isinstance(uow.products, event_store.EventSourcedRepository):
+            batches = _batches_from_events(sku, uow)
+            return dict(sku=sku, version=version, batches=batches)
+        # built with Core, as allocations live in different tables
+        # depending on how the ORM is mapped (see orm.allocation_rows)
+        b, al = orm.batches, orm.allocation_rows()
+        rows = uow.session.execute(
+            select(
+                b.c.reference,
+                b.c.eta,
+                b.c._purchased_quantity - func.coalesce(func.sum(al.c.qty), 0),
+            )
+            .select_from(b.outerjoin(al, al.c.batch_id == b.c.id))
+            .where(b.c.sku == sku)
+            .group_by(b.c.id, b.c.reference, b.c.eta, b.c._purchased_quantity)
+            .order_by(b.c.eta.nulls_first(), b.c.id)
+        )
+        batches = [
+            dict(
+                batchref=reference,
+                available=available,
+                eta=str(eta) if eta is not None else None,
+            )
+            for reference, eta, available in rows
+        ]
+    return dict(sku=sku, version=version, batches=batches)
+
+
+def _batches_from_events(sku: str, uow: unit_of_work.SqlAlchemyUnitOfWork) -> list:
+    # in the same order as the query above: shipments last, by eta
+    batches = sorted(
+        uow.products.get(sku).batches,
+        key=lambda b: (b.eta is not None, b.eta or date.min),
+    )
+    return [
+        dict(
+            batchref=b.reference,
+            available=b.available_quantity,
+            eta=str(b.eta) if b.eta is not None else None,
+        )
+        for b in batches
+    ]
+
+
+def stock_etag(sku: str, version: int) -> str:
+    return f"{sku}-v{version}"
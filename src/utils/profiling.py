@@ -0,0 +1,124 @@
+"""
+Opt-in cProfile capture around message handling, written to a rotating
+local directory, plus an aggregated report of the hottest functions.
+
+    python -m src.utils.profiling [--dir DIR] [--top 20] [--match SKU]
+
+"""
+
+import io
+import os
+import re
+import time
+import random
+import pstats
+import cProfile
+import argparse
+import threading
+from contextlib import contextmanager
+from typing import List, Optional
+
+from src.allocation import config
+from src.utils.logger import log
+
+
+class Profiler:
+    def __init__(
+        self,
+        directory: str,
+        sample_rate: float = 0.0,
+        max_files: int = 200,
+    ):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.max_files = max_files
+        self._lock = threading.Lock()
+
+    def should_profile(self, forced: bool = False) -> bool:
+        return forced or (self.sample_rate > 0 and random.random() < self.sample_rate)
+
+    @contextmanager
+    def profile(self, tag: str):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # only one profiler can be active at a time on newer pythons
+            log.debug("profiler busy, not profiling %s", tag)
+            yield
+            return
+        try:
+            yield
+        finally:
+            profile.disable()
+            self._save(profile, tag)
+
+    def files(self, match: str = "") -> List[str]:
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory)
+            if name.endswith(".prof") and match in name
+        )
+
+    def report(self, top: int = 20, match: str = "") -> str:
+        files = self.files(match)
+        if not files:
+            return "no profiles captured\n"
+        out = io.StringIO()
+        stats = pstats.Stats(*files, stream=out)
+        out.write(f"{len(files)} profiles aggregated\n")
+        stats.sort_stats("cumulative").print_stats(top)
+        return out.getvalue()
+
+    def _save(self, profile: cProfile.Profile, tag: str):
+        safe_tag = re.sub(r"[^A-Za-z0-9_.-]", "_", tag)
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"{time.time_ns()}-{safe_tag}.prof")
+            profile.dump_stats(path)
+            for stale in self.files()[: -self.max_files]:
+                os.remove(stale)
+        log.debug("saved profile %s", path)
+
+
+def message_tag(message) -> str:
+    sku = getattr(message, "sku", None) or getattr(message, "ref", "")
+    return f"{type(message).__name__}-{sku}"
+
+
+@contextmanager
+def maybe_profile(profiler: Optional[Profiler], message, forced: bool = False):
+    """
+    Profiles the enclosed block, tagged with the message type and sku, if
+    the profiler samples it (or it is forced); otherwise does nothing.
+    """
+    if profiler is None or not profiler.should_profile(forced):
+        yield
+        return
+    with profiler.profile(message_tag(message)):
+        yield
+
+
+def from_config(sample_rate: Optional[float] = None) -> Profiler:
+    return Profiler(
+        config.get_profile_dir(),
+        sample_rate=(
+            config.get_profile_sample_rate() if sample_rate is None else sample_rate
+        ),
+        max_files=config.get_profile_max_files(),
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Top-N report over saved profiles.")
+    parser.add_argument("--dir", default=config.get_profile_dir())
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--match", default="", help="e.g. a sku or command name")
+    args = parser.parse_args(argv)
+    print(Profiler(args.dir).report(args.top, args.match), end="")
+
+
+if __name__ == "__main__":
+    main()
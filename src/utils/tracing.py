@@ -0,0 +1,255 @@
+"""
+Lightweight tracing: nested spans tracked with contextvars, sampled per
+trace, and exported as JSON lines to a file (or kept in memory, as a
+stand-in for a collector in tests).
+
+Trace context crosses process boundaries as a W3C-style traceparent
+string ("00-<trace id>-<span id>-<flags>"), e.g. inside serialized events.
+
+"""
+
+import abc
+import json
+import time
+import random
+import threading
+from contextvars import ContextVar
+from typing import List, Optional
+
+from src.allocation import config
+
+
+class Span:
+    __slots__ = (
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "name",
+        "sampled",
+        "start",
+        "end",
+        "attributes",
+        "error",
+        "_exporter",
+        "_token",
+    )
+
+    def __init__(
+        self, trace_id, span_id, parent_id, name, sampled, attributes, exporter=None
+    ):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        self.sampled = sampled
+        self.attributes = attributes
+        self.start = time.time()
+        self.end = None
+        self.error = None
+        self._exporter = exporter
+        self._token = None
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.error = repr(exc)
+        _current.reset(self._token)
+        self.end = time.time()
+        self._exporter.export(self)
+
+    def set(self, **attributes):
+        if self.sampled:
+            self.attributes.update(attributes)
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.time()) - self.start
+
+    def to_dict(self) -> dict:
+        return dict(
+            trace_id=self.trace_id,
+            span_id=self.span_id,
+            parent_id=self.parent_id,
+            name=self.name,
+            start=self.start,
+            duration=self.duration,
+            attributes=self.attributes,
+            error=self.error,
+        )
+
+
+# ---------
+# EXPORTERS
+# ---------
+class AbstractExporter(abc.ABC):
+    @abc.abstractmethod
+    def export(self, span: Span):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class NullExporter(AbstractExporter):
+    def export(self, span):
+        pass
+
+
+class FileExporter(AbstractExporter):
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "a", buffering=1)  # line-buffered
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+# for mocks during tests
+class InMemoryExporter(AbstractExporter):
+    def __init__(self):
+        self.spans = []  # type: List[Span]
+
+    def export(self, span):
+        self.spans.append(span)
+
+
+# ------
+# TRACER
+# ------
+_current = ContextVar("current_span", default=None)  # type: ContextVar[Optional[Span]]
+
+
+def _new_id(bits: int) -> str:
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+class _NoopSpan:
+    """
+    Stands in for the spans of traces that can't be sampled (at a
+    sample_rate of 0): records nothing and doesn't become the current span,
+    so that the hot path pays next to nothing for tracing.
+    """
+
+    __slots__ = ()
+
+    sampled = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def set(self, **attributes):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class _UnsampledSpan(_NoopSpan):
+    """
+    A span of an unsampled trace: records nothing, but is the current span
+    while it lasts, so that its children aren't sampled either.
+    """
+
+    __slots__ = ("_token",)
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, *args):
+        _current.reset(self._token)
+
+
+class Tracer:
+    def __init__(self, exporter: AbstractExporter, sample_rate: float = 0.0):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+
+    def span(self, name: str, parent: Optional[Span] = None, **attributes):
+        """
+        Starts a span as a child of `parent`, or of the current span; a span
+        without either starts a new trace, which is sampled at `sample_rate`.
+        Only spans of sampled traces are given ids and exported; unsampled
+        traces aren't propagated either (see traceparent), so a downstream
+        service decides afresh.
+        """
+        parent = parent if parent is not None else _current.get()
+        if parent is None:
+            if not self.sample_rate:
+                return NOOP_SPAN
+            if random.random() >= self.sample_rate:
+                return _UnsampledSpan()
+            trace_id, parent_id = _new_id(128), None
+        elif not parent.sampled:
+            return _UnsampledSpan()
+        else:
+            trace_id, parent_id = parent.trace_id, parent.span_id
+        return Span(
+            trace_id, _new_id(64), parent_id, name, True, attributes, self.exporter
+        )
+
+
+_tracer = Tracer(NullExporter())
+
+
+def configure(exporter: AbstractExporter, sample_rate: float):
+    global _tracer
+    if _tracer.exporter is not exporter:
+        _tracer.exporter.close()
+    _tracer = Tracer(exporter, sample_rate)
+    return _tracer
+
+
+def configure_from_config():
+    sample_rate = config.get_trace_sample_rate()
+    path = config.get_trace_file()
+    exporter = FileExporter(path) if path and sample_rate > 0 else NullExporter()
+    return configure(exporter, sample_rate)
+
+
+def span(name: str, **attributes):
+    if not _tracer.sample_rate and _current.get() is None:
+        return NOOP_SPAN  # the common case, short-circuited
+    return _tracer.span(name, **attributes)
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+# -----------
+# PROPAGATION
+# -----------
+def traceparent() -> Optional[str]:
+    current = _current.get()
+    if current is None or not current.sampled:
+        return None
+    return f"00-{current.trace_id}-{current.span_id}-01"
+
+
+def continue_trace(header: Optional[str], name: str, **attributes):
+    """
+    Starts a span that continues the trace described by a traceparent
+    string, or a new trace if it is missing or malformed.
+    """
+    parent = None
+    if header:
+        try:
+            _, trace_id, span_id, flags = header.split("-")
+            parent = Span(trace_id, span_id, None, "remote", flags == "01", {})
+        except ValueError:
+            pass
+    return _tracer.span(name, parent=parent, **attributes)
@@ -0,0 +1,69 @@
+"""
+Allocate latency through the regular unit of work, which loads the
+Product every time, and through a one-shard actor pool keeping it in
+memory, as the lines already allocated grow, on a SQLite file.
+
+"""
+
+import os
+import tempfile
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import clear_mappers, sessionmaker
+
+from src.allocation.adapters import orm, result_store
+from src.allocation.domain import commands, model
+from src.allocation.service_layer import actors, messagebus, unit_of_work
+from tests.benchmarks.harness import benchmark
+
+ALLOCATED_LINES = (0, 1000)
+
+
+def _register(n_lines, mode):
+    @benchmark(f"actors.allocate[lines={n_lines},{mode}]")
+    def allocate():
+        path = os.path.join(tempfile.mkdtemp(), "bench.db")
+        engine = create_engine(
+            f"sqlite:///{path}", connect_args={"check_same_thread": False}
+        )
+        orm.metadata.create_all(engine)
+        orm.start_mappers()
+        session_factory = sessionmaker(bind=engine)
+        with unit_of_work.SqlAlchemyUnitOfWork(session_factory) as uow:
+            batch = model.Batch("hot", "BENCH-SKU", 10**9, eta=None)
+            for i in range(n_lines):
+                batch.allocate(model.OrderLine(f"old-{i}", "BENCH-SKU", 1))
+            uow.products.add(model.Product("BENCH-SKU", [batch]))
+            uow.commit()
+        counter = iter(range(10**9))
+        # a store of its own, or allocations would be answered from cache
+        results = result_store.InMemoryResultStore()
+        pool = None
+        if mode == "product":
+
+            def op():
+                cmd = commands.Allocate(f"x{next(counter)}", "BENCH-SKU", 1)
+                uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory, results)
+                messagebus.handle(cmd, uow)
+
+        else:
+            pool = actors.SkuActorPool(
+                lambda: unit_of_work.WriteBehindUnitOfWork(session_factory, results),
+                shards=1,
+                durability=mode,
+            )
+
+            def op():
+                pool.handle(commands.Allocate(f"x{next(counter)}", "BENCH-SKU", 1))
+
+        try:
+            yield op
+        finally:
+            if pool is not None:
+                pool.stop()
+            clear_mappers()
+
+
+for _n_lines in ALLOCATED_LINES:
+    for _mode in ("product", actors.SYNC):
+        _register(_n_lines, _mode)
@@ -0,0 +1,49 @@
+"""
+Write cost of an allocation (and its deallocation), each in its own unit
+of work, with Batch._allocations mapped onto order_lines + allocations and
+onto the single batch_allocations table, on an in-memory SQLite database.
+
+"""
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import clear_mappers, sessionmaker
+
+from src.allocation.adapters import orm
+from src.allocation.domain import model
+from src.allocation.service_layer import unit_of_work
+from tests.benchmarks.harness import benchmark
+
+EXISTING_ALLOCATIONS = 100
+
+
+def _register(storage):
+    @benchmark(f"allocation_storage.allocate_deallocate[{storage}]")
+    def allocate_deallocate():
+        engine = create_engine("sqlite://")
+        orm.metadata.create_all(engine)
+        orm.start_mappers(storage=storage)
+        session_factory = sessionmaker(bind=engine)
+
+        with unit_of_work.SqlAlchemyUnitOfWork(session_factory) as uow:
+            batch = model.Batch("b1", "BENCH-SKU", 10**9, eta=None)
+            for i in range(EXISTING_ALLOCATIONS):
+                batch.allocate(model.OrderLine(f"o{i}", "BENCH-SKU", 1))
+            uow.products.add(model.Product("BENCH-SKU", [batch]))
+            uow.commit()
+
+        def op():
+            for change in (model.Product.allocate, model.Product.deallocate):
+                # a new line each time, as mapped instances belong to a session
+                line = model.OrderLine("bench-order", "BENCH-SKU", 1)
+                with unit_of_work.SqlAlchemyUnitOfWork(session_factory) as uow:
+                    change(uow.products.get("BENCH-SKU"), line)
+                    uow.commit()
+
+        try:
+            yield op
+        finally:
+            clear_mappers()
+
+
+for _storage in (orm.JOIN_TABLE, orm.BATCH_ALLOCATIONS):
+    _register(_storage)
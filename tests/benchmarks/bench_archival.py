@@ -0,0 +1,64 @@
+"""
+Allocate-and-commit latency as a Product's history of exhausted batches
+grows, with the history left in place and after it has been archived,
+on an in-memory SQLite database.
+
+"""
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import clear_mappers, sessionmaker
+
+from src.allocation.adapters import orm
+from src.allocation.domain import model
+from src.allocation.service_layer import archival, unit_of_work
+from tests.benchmarks.harness import benchmark
+
+EXHAUSTED_BATCHES = (0, 100, 1000)
+LINES_PER_BATCH = 10
+
+
+def seed(session_factory, n_exhausted):
+    with unit_of_work.SqlAlchemyUnitOfWork(session_factory) as uow:
+        batches = []
+        for i in range(n_exhausted):
+            batch = model.Batch(f"old-{i}", "BENCH-SKU", LINES_PER_BATCH, eta=None)
+            for j in range(LINES_PER_BATCH):
+                batch.allocate(model.OrderLine(f"o{i}-{j}", "BENCH-SKU", 1))
+            batches.append(batch)
+        batches.append(model.Batch("live", "BENCH-SKU", 10**9, eta=None))
+        uow.products.add(model.Product("BENCH-SKU", batches))
+        uow.commit()
+
+
+def _register(n_exhausted, archived):
+    state = "archived" if archived else "kept"
+
+    @benchmark(f"archival.allocate[exhausted={n_exhausted},{state}]")
+    def allocate():
+        engine = create_engine("sqlite://")
+        orm.metadata.create_all(engine)
+        orm.start_mappers()
+        session_factory = sessionmaker(bind=engine)
+        seed(session_factory, n_exhausted)
+        if archived:
+            archival.archive_all(
+                lambda: unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+            )
+        counter = iter(range(10**9))
+
+        def op():
+            with unit_of_work.SqlAlchemyUnitOfWork(session_factory) as uow:
+                product = uow.products.get("BENCH-SKU")
+                product.allocate(model.OrderLine(f"x{next(counter)}", "BENCH-SKU", 1))
+                uow.commit()
+
+        try:
+            yield op
+        finally:
+            clear_mappers()
+
+
+for _n_exhausted in EXHAUSTED_BATCHES:
+    for _archived in (False, True):
+        if _n_exhausted or not _archived:
+            _register(_n_exhausted, _archived)
@@ -0,0 +1,41 @@
+"""
+Product.allocate against the number of batches, and the number of
+allocations already held by each batch.
+
+"""
+
+from src.allocation.domain import model
+from tests.benchmarks.harness import benchmark
+
+BATCH_COUNTS = (10, 100, 1000)
+ALLOCATIONS_PER_BATCH = (0, 100)
+
+
+def make_product(n_batches: int, n_allocations: int) -> model.Product:
+    batches = []
+    for i in range(n_batches):
+        batch = model.Batch(f"b{i}", "BENCH-SKU", 10**9, eta=None)
+        for j in range(n_allocations):
+            batch.allocate(model.OrderLine(f"o{i}-{j}", "BENCH-SKU", 1))
+        batches.append(batch)
+    return model.Product("BENCH-SKU", batches)
+
+
+def _register(n_batches, n_allocations):
+    @benchmark(f"domain.product_allocate[batches={n_batches},allocs={n_allocations}]")
+    def allocate():
+        product = make_product(n_batches, n_allocations)
+        line = model.OrderLine("bench-order", "BENCH-SKU", 1)
+
+        # deallocate again, so every call sees the same state
+        def op():
+            product.allocate(line)
+            product.deallocate(line)
+            product.events.clear()
+
+        yield op
+
+
+for _n_batches in BATCH_COUNTS:
+    for _n_allocations in ALLOCATIONS_PER_BATCH:
+        _register(_n_batches, _n_allocations)
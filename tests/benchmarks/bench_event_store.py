@@ -0,0 +1,95 @@
+"""
+Loading, and allocating against, a Product with a long history of
+allocations, persisted through the ORM mapping and through the event
+store (with and without snapshots), on an in-memory SQLite database.
+
+"""
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import clear_mappers, sessionmaker
+
+from src.allocation.adapters import event_store, orm, repository
+from src.allocation.domain import model
+from src.allocation.service_layer import unit_of_work
+from tests.benchmarks.harness import benchmark
+
+HISTORY_SIZES = (1000, 10_000)
+N_BATCHES = 10
+
+MODES = {
+    "orm": repository.SqlAlchemyRepository,
+    "events": lambda session: event_store.EventSourcedRepository(
+        session, snapshot_interval=0
+    ),
+    "events+snapshots": lambda session: event_store.EventSourcedRepository(
+        session, snapshot_interval=100
+    ),
+}
+
+
+def seed(uow, n_allocations):
+    with uow:
+        product = model.Product("BENCH-SKU", [])
+        uow.products.add(product)
+        for i in range(N_BATCHES):
+            product.add_batch(model.Batch(f"b{i}", "BENCH-SKU", 10**9, eta=None))
+        for i in range(n_allocations):
+            product.allocate(model.OrderLine(f"o{i}", "BENCH-SKU", 1))
+        uow.commit()
+    # a few events after the last snapshot, as there would be in practice
+    with uow:
+        product = uow.products.get("BENCH-SKU")
+        for i in range(50):
+            product.allocate(model.OrderLine(f"late-{i}", "BENCH-SKU", 1))
+        uow.commit()
+
+
+def _register(mode, n_allocations):
+    def setup():
+        engine = create_engine("sqlite://")
+        orm.metadata.create_all(engine)
+        orm.start_mappers()
+        session_factory = sessionmaker(bind=engine)
+
+        def new_uow():
+            return unit_of_work.SqlAlchemyUnitOfWork(
+                session_factory, repository_factory=MODES[mode]
+            )
+
+        seed(new_uow(), n_allocations)
+        return new_uow
+
+    @benchmark(f"event_store.load_product[{mode},history={n_allocations}]")
+    def load_product():
+        new_uow = setup()
+
+        def op():
+            with new_uow() as uow:
+                product = uow.products.get("BENCH-SKU")
+                sum(batch.available_quantity for batch in product.batches)
+
+        try:
+            yield op
+        finally:
+            clear_mappers()
+
+    @benchmark(f"event_store.allocate_and_commit[{mode},history={n_allocations}]")
+    def allocate_and_commit():
+        new_uow = setup()
+        counter = iter(range(10**9))
+
+        def op():
+            with new_uow() as uow:
+                product = uow.products.get("BENCH-SKU")
+                product.allocate(model.OrderLine(f"x{next(counter)}", "BENCH-SKU", 1))
+                uow.commit()
+
+        try:
+            yield op
+        finally:
+            clear_mappers()
+
+
+for _mode in MODES:
+    for _n_allocations in HISTORY_SIZES:
+        _register(_mode, _n_allocations)
@@ -0,0 +1,115 @@
+"""
+Peak RSS of the streaming allocation export against row count, compared
+with loading every Product through SqlAlchemyRepository.list().
+
+Each measurement runs in a fresh subprocess, so ru_maxrss reflects only
+that run. Run with:  python -m tests.benchmarks.bench_export
+
+"""
+
+import os
+import sys
+import resource
+import tempfile
+import subprocess
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from src.allocation.adapters import orm
+
+ROW_COUNTS = (1_000, 10_000, 100_000)
+LINES_PER_BATCH = 100
+
+
+def seed(path: str, rows: int):
+    engine = create_engine(f"sqlite:///{path}")
+    orm.metadata.create_all(engine)
+    n_batches = rows // LINES_PER_BATCH
+    with engine.begin() as conn:
+        conn.execute(
+            orm.products.insert(),
+            [dict(sku=f"sku-{i}", version_number=1) for i in range(n_batches)],
+        )
+        conn.execute(
+            orm.batches.insert(),
+            [
+                dict(
+                    id=i + 1,
+                    reference=f"b-{i}",
+                    sku=f"sku-{i}",
+                    _purchased_quantity=rows,
+                )
+                for i in range(n_batches)
+            ],
+        )
+        conn.execute(
+            orm.order_lines.insert(),
+            [
+                dict(
+                    id=i + 1, orderid=f"o-{i}", sku=f"sku-{i // LINES_PER_BATCH}", qty=1
+                )
+                for i in range(rows)
+            ],
+        )
+        conn.execute(
+            orm.allocations.insert(),
+            [
+                dict(orderline_id=i + 1, batch_id=i // LINES_PER_BATCH + 1)
+                for i in range(rows)
+            ],
+        )
+
+
+def run(path: str, mode: str):
+    from src.allocation.service_layer import export, unit_of_work
+
+    orm.start_mappers()
+    uow = unit_of_work.SqlAlchemyUnitOfWork(
+        sessionmaker(bind=create_engine(f"sqlite:///{path}"))
+    )
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with open(os.devnull, "w") as out:
+        if mode == "stream":
+            for chunk in export.export_allocations(uow, "ndjson"):
+                out.write(chunk)
+        else:
+            with uow:
+                for product in uow.products.list():
+                    for batch in product.batches:
+                        for line in batch._allocations:
+                            out.write(f"{line.orderid},{batch.reference}\n")
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(peak - baseline)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{'rows':>10} {'stream (KiB)':>14} {'list() (KiB)':>14}")
+        for rows in ROW_COUNTS:
+            path = os.path.join(tmp, f"export-{rows}.db")
+            seed(path, rows)
+            growth = {}
+            for mode in ("stream", "list"):
+                output = subprocess.run(
+                    [
+                        sys.executable,
+                        "-m",
+                        "tests.benchmarks.bench_export",
+                        "--run",
+                        path,
+                        mode,
+                    ],
+                    check=True,
+                    capture_output=True,
+                    text=True,
+                ).stdout
+                growth[mode] = int(output.split()[-1])
+            print(f"{rows:>10} {growth['stream']:>14} {growth['list']:>14}")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--run"]:
+        run(*sys.argv[2:4])
+    else:
+        main()
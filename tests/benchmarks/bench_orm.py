@@ -0,0 +1,70 @@
+"""
+Loading a large Product (and all of its batches and allocations) through
+the ORM, from an in-memory SQLite database.
+
+"""
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import clear_mappers, sessionmaker
+
+from src.allocation.adapters import orm
+from src.allocation.service_layer import unit_of_work
+from tests.benchmarks.harness import benchmark
+
+SHAPES = ((100, 10), (1000, 10))
+
+
+def seed(engine, n_batches, n_allocations):
+    with engine.begin() as conn:
+        conn.execute(orm.products.insert(), dict(sku="BENCH-SKU", version_number=1))
+        conn.execute(
+            orm.batches.insert(),
+            [
+                dict(
+                    id=i + 1,
+                    reference=f"b{i}",
+                    sku="BENCH-SKU",
+                    _purchased_quantity=10**9,
+                )
+                for i in range(n_batches)
+            ],
+        )
+        n_lines = n_batches * n_allocations
+        conn.execute(
+            orm.order_lines.insert(),
+            [
+                dict(id=i + 1, orderid=f"o{i}", sku="BENCH-SKU", qty=1)
+                for i in range(n_lines)
+            ],
+        )
+        conn.execute(
+            orm.allocations.insert(),
+            [
+                dict(orderline_id=i + 1, batch_id=i // n_allocations + 1)
+                for i in range(n_lines)
+            ],
+        )
+
+
+def _register(n_batches, n_allocations):
+    @benchmark(f"orm.load_product[batches={n_batches},allocs={n_allocations}]")
+    def load_product():
+        engine = create_engine("sqlite://")
+        orm.metadata.create_all(engine)
+        seed(engine, n_batches, n_allocations)
+        orm.start_mappers()
+        session_factory = sessionmaker(bind=engine)
+
+        def op():
+            with unit_of_work.SqlAlchemyUnitOfWork(session_factory) as uow:
+                product = uow.products.get("BENCH-SKU")
+                sum(batch.available_quantity for batch in product.batches)
+
+        try:
+            yield op
+        finally:
+            clear_mappers()
+
+
+for _shape in SHAPES:
+    _register(*_shape)
@@ -0,0 +1,48 @@
+"""
+Per-call cost of the repository's Product lookups, each in a fresh session
+(so never answered from an identity map), on an in-memory SQLite database
+holding a small product, so that building the statements shows.
+
+"""
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import clear_mappers, sessionmaker
+
+from src.allocation.adapters import orm, repository
+from src.allocation.domain import model
+from tests.benchmarks.harness import benchmark
+
+LOOKUPS = {
+    "get": lambda repo: repo.get("BENCH-SKU"),
+    "get_by_batchref": lambda repo: repo.get_by_batchref("b1"),
+}
+
+
+def _register(lookup):
+    @benchmark(f"repository.{lookup}")
+    def lookup_product():
+        engine = create_engine("sqlite://")
+        orm.metadata.create_all(engine)
+        orm.start_mappers()
+        session_factory = sessionmaker(bind=engine)
+        session = session_factory()
+        session.add(
+            model.Product("BENCH-SKU", [model.Batch("b1", "BENCH-SKU", 100, eta=None)])
+        )
+        session.commit()
+        session.close()
+        find = LOOKUPS[lookup]
+
+        def op():
+            session = session_factory()
+            assert find(repository.SqlAlchemyRepository(session)) is not None
+            session.close()
+
+        try:
+            yield op
+        finally:
+            clear_mappers()
+
+
+for _lookup in LOOKUPS:
+    _register(_lookup)
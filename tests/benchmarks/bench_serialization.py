@@ -0,0 +1,40 @@
+"""
+Encode/decode throughput of the event codecs, against the
+json.dumps(asdict(event)) approach they replaced.
+
+"""
+
+import json
+from dataclasses import asdict
+
+from src.allocation.domain import events
+from src.allocation.adapters import serialization
+from tests.benchmarks.harness import benchmark
+
+EVENT = events.Allocated(orderid="order-1", sku="RED-CHAIR", qty=10, batchref="b1")
+
+
+@benchmark("serialization.legacy_json.encode")
+def legacy_encode():
+    yield lambda: json.dumps(asdict(EVENT))
+
+
+@benchmark("serialization.legacy_json.decode")
+def legacy_decode():
+    data = json.dumps(asdict(EVENT))
+    yield lambda: events.Allocated(**json.loads(data))
+
+
+def _register_codec(name):
+    @benchmark(f"serialization.{name}.encode")
+    def encode():
+        yield lambda: serialization.dumps(EVENT, codec=name)
+
+    @benchmark(f"serialization.{name}.decode")
+    def decode():
+        data = serialization.dumps(EVENT, codec=name)
+        yield lambda: serialization.decode(data)
+
+
+for _name in serialization.CODECS:
+    _register_codec(_name)
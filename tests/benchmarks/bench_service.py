@@ -0,0 +1,54 @@
+"""
+Service-layer handlers on FakeUnitOfWork, and the overhead the messagebus
+adds on top of calling a handler directly.
+
+"""
+
+from src.allocation.domain import commands
+from src.allocation.service_layer import handlers, messagebus
+from src.allocation.service_layer.unit_of_work import FakeUnitOfWork
+from tests.benchmarks.harness import benchmark
+
+
+def make_uow(n_batches=10):
+    uow = FakeUnitOfWork()
+    for i in range(n_batches):
+        handlers.add_batch(commands.CreateBatch(f"b{i}", "BENCH-SKU", 10**9), uow)
+    return uow
+
+
+@benchmark("service.allocate_then_deallocate")
+def allocate_then_deallocate():
+    uow = make_uow()
+    allocate = commands.Allocate("bench-order", "BENCH-SKU", 1)
+    deallocate = commands.Deallocate("bench-order", "BENCH-SKU", 1)
+
+    def op():
+        handlers.allocate(allocate, uow)
+        handlers.deallocate(deallocate, uow)
+        list(uow.collect_new_events())
+
+    yield op
+
+
+# ChangeBatchQuantity raises a single BatchQuantityChanged, which has no
+# handlers unless stock counters are enabled (they aren't here); both
+# variants collect it, so the difference is the messagebus's own cost:
+# result lookup, spans, metrics and dispatching that one event
+@benchmark("service.change_batch_quantity.direct")
+def change_batch_quantity_direct():
+    uow = make_uow()
+    cmd = commands.ChangeBatchQuantity("b0", 10**9)
+
+    def op():
+        handlers.change_batch_quantity(cmd, uow)
+        list(uow.collect_new_events())
+
+    yield op
+
+
+@benchmark("service.change_batch_quantity.messagebus")
+def change_batch_quantity_messagebus():
+    uow = make_uow()
+    cmd = commands.ChangeBatchQuantity("b0", 10**9)
+    yield lambda: messagebus.handle(cmd, uow)
@@ -0,0 +1,59 @@
+"""
+Product.allocate under each allocation strategy at 10k batches per sku,
+with a spread of quantities and ETAs, plus the cost of building each
+strategy's index.
+
+"""
+
+import random
+from datetime import date, timedelta
+
+from src.allocation.domain import model, strategies
+from tests.benchmarks.harness import benchmark
+
+N_BATCHES = 10_000
+
+
+def make_batches(n_batches: int):
+    rng = random.Random(n_batches)
+    today = date.today()
+    return [
+        model.Batch(
+            f"b{i}",
+            "BENCH-SKU",
+            rng.randint(10, 1000),
+            None if rng.random() < 0.2 else today + timedelta(days=rng.randint(1, 90)),
+        )
+        for i in range(n_batches)
+    ]
+
+
+def _register(name):
+    @benchmark(f"strategies.allocate[{name},batches={N_BATCHES}]")
+    def allocate():
+        product = model.Product(
+            "BENCH-SKU", make_batches(N_BATCHES), allocation_strategy=name
+        )
+        by_ref = {b.reference: b for b in product.batches}
+        line = model.OrderLine("bench-order", "BENCH-SKU", 7)
+
+        # undo the allocation on the batch directly, so every call sees the
+        # same state without timing Product.deallocate's scan of all batches
+        def op():
+            batch = by_ref[product.allocate(line)]
+            batch.deallocate(line)
+            product._batch_changed(batch)
+            product.events.clear()
+
+        op()  # build the index outside the timed op
+
+        yield op
+
+    @benchmark(f"strategies.build_index[{name},batches={N_BATCHES}]")
+    def build_index():
+        batches = make_batches(N_BATCHES)
+        yield lambda: strategies.build(name, batches)
+
+
+for _name in strategies.STRATEGIES:
+    _register(_name)
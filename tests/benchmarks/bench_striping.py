@@ -0,0 +1,55 @@
+"""
+Allocate-and-commit latency for one sku through its Product and from its
+stock stripes, as the lines already allocated from it grow, on an
+in-memory SQLite database.
+
+"""
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import clear_mappers, sessionmaker
+
+from src.allocation.adapters import orm
+from src.allocation.domain import commands, model
+from src.allocation.service_layer import handlers, unit_of_work
+from tests.benchmarks.harness import benchmark
+
+ALLOCATED_LINES = (0, 1000)
+STRIPES = 8
+
+
+def _register(n_lines, stripes):
+    path = f"stripes={stripes}" if stripes else "product"
+
+    @benchmark(f"striping.allocate[lines={n_lines},{path}]")
+    def allocate():
+        engine = create_engine("sqlite://")
+        orm.metadata.create_all(engine)
+        orm.start_mappers()
+        session_factory = sessionmaker(bind=engine)
+
+        def uow():
+            return unit_of_work.SqlAlchemyUnitOfWork(session_factory, striping=True)
+
+        with uow() as seed:
+            batch = model.Batch("hot", "BENCH-SKU", 10**9, eta=None)
+            for i in range(n_lines):
+                batch.allocate(model.OrderLine(f"old-{i}", "BENCH-SKU", 1))
+            seed.products.add(model.Product("BENCH-SKU", [batch]))
+            seed.commit()
+        if stripes:
+            handlers.change_stripes(commands.ChangeStripes("BENCH-SKU", stripes), uow())
+        counter = iter(range(10**9))
+
+        def op():
+            cmd = commands.Allocate(f"x{next(counter)}", "BENCH-SKU", 1)
+            handlers.allocate(cmd, uow())
+
+        try:
+            yield op
+        finally:
+            clear_mappers()
+
+
+for _n_lines in ALLOCATED_LINES:
+    for _stripes in (0, STRIPES):
+        _register(_n_lines, _stripes)
@@ -0,0 +1,78 @@
+"""
+Compares benchmark results against a stored baseline, and exits non-zero
+if any benchmark got slower by more than the threshold.
+
+    python -m tests.benchmarks.compare bench_results.json \
+        [--baseline tests/benchmarks/baseline.json] [--threshold 0.2]
+
+Comparisons use each benchmark's fastest run, which is the least noisy.
+
+"""
+
+import os
+import sys
+import json
+import argparse
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+def compare(baseline: dict, current: dict, threshold: float):
+    """
+    Returns (rows, regressions); each row is (name, baseline, current, change),
+    where change is the relative slowdown (negative is faster).
+
+    """
+    rows, regressions = [], []
+    for name in sorted(set(baseline) | set(current)):
+        if name not in baseline or name not in current:
+            rows.append(
+                (
+                    name,
+                    baseline.get(name, {}).get("min"),
+                    current.get(name, {}).get("min"),
+                    None,
+                )
+            )
+            continue
+        before, after = baseline[name]["min"], current[name]["min"]
+        change = after / before - 1
+        rows.append((name, before, after, change))
+        if change > threshold:
+            regressions.append(name)
+    return rows, regressions
+
+
+def _us(seconds):
+    return "-" if seconds is None else f"{seconds * 1e6:.2f}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("results")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+    with open(args.results) as f:
+        current = json.load(f)["results"]
+
+    rows, regressions = compare(baseline, current, args.threshold)
+    print(f"{'benchmark':<60} {'base us':>10} {'now us':>10} {'change':>8}")
+    for name, before, after, change in rows:
+        flag = " REGRESSION" if name in regressions else ""
+        if change is None:
+            pct = "new" if before is None else "missing"
+        else:
+            pct = f"{change:+.1%}"
+        print(f"{name:<60} {_us(before):>10} {_us(after):>10} {pct:>8}{flag}")
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond {args.threshold:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
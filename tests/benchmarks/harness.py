@@ -0,0 +1,46 @@
+"""
+A small registry and timer for micro-benchmarks.
+
+Benchmarks are generator functions registered under a name: the code
+before the `yield` is setup, the yielded callable is the operation being
+timed, and the code after it is teardown.
+
+"""
+
+import timeit
+import statistics
+from contextlib import contextmanager
+from typing import Callable, Dict
+
+BENCHMARKS = {}  # type: Dict[str, Callable]
+
+
+def benchmark(name: str):
+    def register(setup: Callable):
+        BENCHMARKS[name] = contextmanager(setup)
+        return setup
+
+    return register
+
+
+def measure(op: Callable, repeat: int = 5) -> dict:
+    """
+    Times `op` with enough loops per run to take at least 0.2s, and reports
+    per-call seconds over `repeat` runs.
+
+    """
+    timer = timeit.Timer(op)
+    loops, _ = timer.autorange()
+    per_call = [t / loops for t in timer.repeat(repeat=repeat, number=loops)]
+    return dict(
+        min=min(per_call),
+        mean=statistics.mean(per_call),
+        stdev=statistics.stdev(per_call) if repeat > 1 else 0.0,
+        loops=loops,
+        repeat=repeat,
+    )
+
+
+def run(name: str, repeat: int = 5) -> dict:
+    with BENCHMARKS[name]() as op:
+        return measure(op, repeat)
@@ -0,0 +1,69 @@
+"""
+Runs the registered benchmarks and writes the results as JSON.
+
+    python -m tests.benchmarks.run -o bench_results.json [-k orm]
+
+"""
+
+import sys
+import json
+import argparse
+import platform
+from datetime import datetime, timezone
+
+import sqlalchemy
+
+from tests.benchmarks import harness
+
+# importing the modules registers their benchmarks
+from tests.benchmarks import (  # noqa: F401
+    bench_actors,
+    bench_allocation_storage,
+    bench_archival,
+    bench_domain,
+    bench_event_store,
+    bench_orm,
+    bench_repository,
+    bench_serialization,
+    bench_service,
+    bench_strategies,
+    bench_striping,
+)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-o", "--output", help="results file; defaults to stdout")
+    parser.add_argument("-k", "--filter", default="", help="run names containing this")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name in sorted(harness.BENCHMARKS):
+        if args.filter not in name:
+            continue
+        results[name] = harness.run(name, args.repeat)
+        print(
+            f"{name:<60} {results[name]['min'] * 1e6:>12.2f} us/call",
+            file=sys.stderr,
+        )
+
+    report = dict(
+        meta=dict(
+            created=datetime.now(timezone.utc).isoformat(),
+            python=platform.python_version(),
+            sqlalchemy=sqlalchemy.__version__,
+            machine=platform.machine(),
+        ),
+        results=results,
+    )
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,7 +10,9 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, clear_mappers
 from sqlalchemy.exc import OperationalError
 
+from src.allocation.adapters import stock_counters
 from src.allocation.adapters.orm import metadata, start_mappers
+from src.allocation.service_layer import availability, handlers, messagebus
 from src.allocation import config
 
 
@@ -33,6 +35,22 @@ def session(session_factory):
     return session_factory()
 
 
+@pytest.fixture
+def in_memory_stock_counters(monkeypatch):
+    """
+    Enables stock counters, as STOCK_COUNTERS=memory would at startup.
+    """
+    counters = stock_counters.InMemoryStockCounters()
+    monkeypatch.setattr(availability, "counters", counters)
+    for event in messagebus.STOCK_COUNTER_EVENTS:
+        monkeypatch.setitem(
+            messagebus.EVENT_HANDLERS,
+            event,
+            messagebus.EVENT_HANDLERS.get(event, []) + [handlers.update_stock_counters],
+        )
+    return counters
+
+
 def wait_for_postgres_spinup(engine):
     deadline = time.time() + 10
     while time.time() < deadline:
@@ -37,4 +37,10 @@ def post_to_deallocate(orderid, sku, qty, expect_success=True):
     )
     if expect_success:
         assert r.status_code == 201
-    return r
\ No newline at end of file
+    return r
+
+
+def get_stock(sku, etag=None):
+    url = config.get_api_url()
+    headers = {"If-None-Match": etag} if etag else {}
+    return requests.get(f"{url}/products/{sku}/stock", headers=headers)
@@ -54,4 +54,25 @@ def test_deallocate():
     # now we can allocate second order
     r = api_client.post_to_allocate(order2, sku, 100, expect_success=True)
     assert r.ok
-    assert r.json()["batchref"] == batch
\ No newline at end of file
+    assert r.json()["batchref"] == batch
+
+
+@pytest.mark.usefixtures("postgres_db")
+@pytest.mark.usefixtures("restart_api")
+def test_stock_is_revalidated_with_etag():
+    sku, batch = random_sku(), random_batchref()
+    api_client.post_to_add_batch(batch, sku, 100, None)
+
+    r = api_client.get_stock(sku)
+    assert r.status_code == 200
+    assert r.json()["batches"] == [{"batchref": batch, "available": 100, "eta": None}]
+    etag = r.headers["ETag"]
+
+    r = api_client.get_stock(sku, etag=etag)
+    assert r.status_code == 304
+
+    api_client.post_to_allocate(random_orderid(), sku, 10)
+    r = api_client.get_stock(sku, etag=etag)
+    assert r.status_code == 200
+    assert r.json()["batches"][0]["available"] == 90
+    assert r.headers["ETag"] != etag
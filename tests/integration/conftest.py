@@ -0,0 +1,15 @@
+import pytest
+
+from src.allocation.adapters import result_store
+from src.allocation.service_layer import unit_of_work
+
+
+@pytest.fixture(autouse=True)
+def results(monkeypatch):
+    """
+    A result store of the test's own for units of work built without one,
+    so that results cached by earlier tests can't answer its commands.
+    """
+    store = result_store.InMemoryResultStore()
+    monkeypatch.setattr(unit_of_work, "DEFAULT_RESULT_STORE", store)
+    return store
@@ -0,0 +1,128 @@
+import threading
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import clear_mappers, sessionmaker
+
+from src.allocation.adapters import orm, result_store
+from src.allocation.domain import commands, model
+from src.allocation.service_layer import actors, unit_of_work, views
+from tests.random_refs import random_orderid
+
+
+class CountingUnitOfWork(unit_of_work.WriteBehindUnitOfWork):
+    commits = 0
+    fail_next_flush = False
+
+    def flush(self):
+        if self.dirty:
+            if CountingUnitOfWork.fail_next_flush:
+                CountingUnitOfWork.fail_next_flush = False
+                raise RuntimeError("database went away")
+            CountingUnitOfWork.commits += 1
+        super().flush()
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    # a file, as the shards' threads each have their own connection
+    engine = create_engine(
+        f"sqlite:///{tmp_path}/actors.db", connect_args={"check_same_thread": False}
+    )
+    orm.metadata.create_all(engine)
+    orm.start_mappers()
+    yield sessionmaker(bind=engine)
+    clear_mappers()
+
+
+@pytest.fixture
+def loads():
+    loaded = []
+
+    def count(product, _):
+        loaded.append(product.sku)
+
+    event.listen(model.Product, "load", count)
+    yield loaded
+    event.remove(model.Product, "load", count)
+
+
+def make_pool(session_factory, **kwargs):
+    results = result_store.InMemoryResultStore()
+    CountingUnitOfWork.commits = 0
+
+    def uow_factory():
+        return CountingUnitOfWork(session_factory, results=results)
+
+    def lookup_uow_factory():
+        return unit_of_work.SqlAlchemyUnitOfWork(session_factory, results=results)
+
+    return actors.SkuActorPool(
+        uow_factory, lookup_uow_factory=lookup_uow_factory, **kwargs
+    )
+
+
+def available(session_factory, sku):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    return {b["batchref"]: b["available"] for b in views.stock(sku, uow)["batches"]}
+
+
+def test_products_stay_in_memory_between_commands(session_factory, loads):
+    pool = make_pool(session_factory, shards=2)
+    pool.handle(commands.CreateBatch("b1", "RESIDENT-LAMP", 10))
+    for qty in (1, 2, 3):
+        assert pool.handle(commands.Allocate(random_orderid(), "RESIDENT-LAMP", qty))
+    pool.stop()
+
+    assert loads == []
+    assert CountingUnitOfWork.commits == 4  # sync: one per command
+    assert available(session_factory, "RESIDENT-LAMP") == {"b1": 4}
+
+
+def test_group_commit_answers_every_caller_after_one_commit(session_factory):
+    pool = make_pool(session_factory, shards=1, durability=actors.GROUP, window=0.05)
+    pool.handle(commands.CreateBatch("b1", "GROUPED-LAMP", 100))
+    CountingUnitOfWork.commits = 0
+    results = []
+
+    def allocate():
+        cmd = commands.Allocate(random_orderid(), "GROUPED-LAMP", 1)
+        results.append(pool.handle(cmd))
+
+    threads = [threading.Thread(target=allocate) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    pool.stop()
+
+    assert results == ["b1"] * 20
+    assert CountingUnitOfWork.commits < 20
+    assert available(session_factory, "GROUPED-LAMP") == {"b1": 80}
+
+
+def test_failed_commit_fails_the_callers_and_reloads(session_factory, loads):
+    pool = make_pool(session_factory, shards=1)
+    pool.handle(commands.CreateBatch("b1", "FLAKY-LAMP", 10))
+
+    CountingUnitOfWork.fail_next_flush = True
+    with pytest.raises(RuntimeError):
+        pool.handle(commands.Allocate(random_orderid(), "FLAKY-LAMP", 10))
+    # the lost allocation is forgotten along with the rest of memory
+    assert pool.handle(commands.Allocate(random_orderid(), "FLAKY-LAMP", 10)) == "b1"
+    pool.stop()
+
+    assert loads == ["FLAKY-LAMP"]
+    assert available(session_factory, "FLAKY-LAMP") == {"b1": 0}
+
+
+def test_batch_commands_reach_the_owner_of_their_sku(session_factory):
+    pool = make_pool(session_factory, shards=4)
+    pool.handle(commands.CreateBatch("small", "SHRINKING-LAMP", 10))
+    pool.handle(commands.CreateBatch("big", "SHRINKING-LAMP", 50))
+    pool.handle(commands.Allocate(random_orderid(), "SHRINKING-LAMP", 10))
+
+    pool.handle(commands.ChangeBatchQuantity("small", 5))
+    pool.stop()  # after the re-allocation it queued
+
+    assert available(session_factory, "SHRINKING-LAMP") == {"small": 5, "big": 40}
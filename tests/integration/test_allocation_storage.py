@@ -0,0 +1,75 @@
+import pytest
+from sqlalchemy.orm import clear_mappers, sessionmaker
+
+from src.allocation.adapters import migrations, orm
+from src.allocation.domain import commands
+from src.allocation.service_layer import messagebus, unit_of_work, views
+from tests.random_refs import random_orderid
+
+
+@pytest.fixture
+def batch_allocations_session_factory(in_memory_db):
+    orm.start_mappers(storage=orm.BATCH_ALLOCATIONS)
+    yield sessionmaker(bind=in_memory_db)
+    clear_mappers()
+
+
+def rows(session, table):
+    return list(session.execute(f"SELECT * FROM {table}"))
+
+
+def test_allocations_are_single_rows(batch_allocations_session_factory):
+    session_factory = batch_allocations_session_factory
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    orderid = random_orderid()
+    messagebus.handle(commands.CreateBatch("b1", "FLAT-PACK", 100), uow)
+    messagebus.handle(commands.Allocate(orderid, "FLAT-PACK", 10), uow)
+
+    session = session_factory()
+    [(_, _, allocated_orderid, sku, qty)] = rows(session, "batch_allocations")
+    assert (allocated_orderid, sku, qty) == (orderid, "FLAT-PACK", 10)
+    assert rows(session, "order_lines") == rows(session, "allocations") == []
+
+    messagebus.handle(commands.Deallocate(orderid, "FLAT-PACK", 10), uow)
+    assert rows(session_factory(), "batch_allocations") == []
+
+
+def test_views_and_export_read_batch_allocations(batch_allocations_session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(batch_allocations_session_factory)
+    orderid = random_orderid()
+    messagebus.handle(commands.CreateBatch("b1", "FLAT-PACK", 100), uow)
+    messagebus.handle(commands.Allocate(orderid, "FLAT-PACK", 10), uow)
+
+    [batch] = views.stock("FLAT-PACK", uow)["batches"]
+    assert batch["available"] == 90
+    with uow:
+        assert list(uow.products.iter_allocations()) == [
+            (orderid, "FLAT-PACK", 10, "b1")
+        ]
+
+
+def test_migration_copies_join_table_allocations(in_memory_db):
+    orm.start_mappers(storage=orm.JOIN_TABLE)
+    try:
+        uow = unit_of_work.SqlAlchemyUnitOfWork(sessionmaker(bind=in_memory_db))
+        messagebus.handle(commands.CreateBatch("b1", "OLD-SKU", 100), uow)
+        for orderid in ("o1", "o2"):
+            messagebus.handle(commands.Allocate(orderid, "OLD-SKU", 5), uow)
+    finally:
+        clear_mappers()
+
+    with in_memory_db.begin() as connection:
+        assert migrations.copy_to_batch_allocations(connection) == 2
+        # re-running doesn't duplicate rows
+        assert migrations.copy_to_batch_allocations(connection) == 0
+        assert migrations.prune_join_table(connection) == 2
+
+    orm.start_mappers(storage=orm.BATCH_ALLOCATIONS)
+    try:
+        uow = unit_of_work.SqlAlchemyUnitOfWork(sessionmaker(bind=in_memory_db))
+        with uow:
+            [batch] = uow.products.get("OLD-SKU").batches
+            assert {line.orderid for line in batch._allocations} == {"o1", "o2"}
+            assert rows(uow.session, "order_lines") == []
+    finally:
+        clear_mappers()
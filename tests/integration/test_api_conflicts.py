@@ -0,0 +1,90 @@
+import os
+import tempfile
+
+import pytest
+from sqlalchemy import create_engine, event, update
+from sqlalchemy.orm import Session, clear_mappers
+
+from src.allocation.adapters import orm
+from src.allocation.domain import model
+from src.allocation.entrypoints import flask_app
+from src.allocation.service_layer import actors, coalescing, unit_of_work
+from tests.random_refs import random_orderid, random_sku
+
+# flask_app maps on import; tests map (and unmap) in their fixtures
+clear_mappers()
+
+
+@pytest.fixture
+def engine():
+    """
+    The app's default session factory, bound to a SQLite file for the
+    test (so that the actor pool's threads share it).
+    """
+    path = os.path.join(tempfile.mkdtemp(), "api.db")
+    engine = create_engine(
+        f"sqlite:///{path}", connect_args={"check_same_thread": False}
+    )
+    orm.metadata.create_all(engine)
+    orm.start_mappers()
+    previous = unit_of_work.DEFAULT_SESSION_FACTORY.kw["bind"]
+    unit_of_work.DEFAULT_SESSION_FACTORY.configure(bind=engine)
+    yield engine
+    unit_of_work.DEFAULT_SESSION_FACTORY.configure(bind=previous)
+    clear_mappers()
+    os.remove(path)
+
+
+@pytest.fixture
+def race(engine):
+    """
+    Arms a writer that bumps the version of the next product flushed, from
+    another connection: as if another request had committed an allocation
+    after this one loaded the product.
+    """
+
+    armed = []
+
+    def bump(session, flush_context, instances):
+        if not armed:
+            return
+        armed.clear()
+        [product] = [p for p in session.dirty if isinstance(p, model.Product)]
+        with engine.begin() as connection:
+            connection.execute(
+                update(orm.products)
+                .where(orm.products.c.sku == product.sku)
+                .values(version_number=orm.products.c.version_number + 1)
+            )
+
+    event.listen(Session, "before_flush", bump)
+    yield lambda: armed.append(True)
+    event.remove(Session, "before_flush", bump)
+
+
+@pytest.fixture(params=["messagebus", "coalescer", "actors"])
+def client(request, engine, monkeypatch):
+    if request.param == "coalescer":
+        monkeypatch.setattr(
+            flask_app, "coalescer", coalescing.AllocationCoalescer(window=0)
+        )
+    if request.param == "actors":
+        pool = actors.SkuActorPool(shards=1)
+        monkeypatch.setattr(flask_app, "actor_pool", pool)
+        request.addfinalizer(pool.stop)
+    return flask_app.app.test_client()
+
+
+def test_lost_races_are_reported_as_conflicts(client, race):
+    sku = random_sku()
+    r = client.post("/add_batch", json=dict(ref="b1", sku=sku, qty=10, eta=None))
+    assert r.status_code == 201
+
+    race()
+    r = client.post("/allocate", json=dict(orderid=random_orderid(), sku=sku, qty=1))
+
+    assert r.status_code == 409
+    assert r.json["message"] == "Concurrent update, please retry"
+    # and the retry goes through, against the other writer's version
+    r = client.post("/allocate", json=dict(orderid=random_orderid(), sku=sku, qty=1))
+    assert r.status_code == 201
@@ -0,0 +1,140 @@
+from datetime import date
+
+import pytest
+from sqlalchemy.orm import clear_mappers, sessionmaker
+
+from src.allocation.adapters import event_store, orm
+from src.allocation.domain import commands
+from src.allocation.service_layer import (
+    archival,
+    handlers,
+    messagebus,
+    unit_of_work,
+    views,
+)
+from tests.random_refs import random_orderid
+
+
+@pytest.fixture(params=[orm.JOIN_TABLE, orm.BATCH_ALLOCATIONS])
+def session_factory(request, in_memory_db):
+    orm.start_mappers(storage=request.param)
+    yield sessionmaker(bind=in_memory_db)
+    clear_mappers()
+
+
+def count(session, table):
+    return session.execute(f"SELECT count(*) FROM {table}").scalar()
+
+
+def test_exhausted_batches_move_to_the_archive(session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    o1, o2 = random_orderid(1), random_orderid(2)
+    messagebus.handle(commands.CreateBatch("old", "DUSTY-SHELF", 10), uow)
+    messagebus.handle(commands.CreateBatch("new", "DUSTY-SHELF", 10), uow)
+    messagebus.handle(commands.Allocate(o1, "DUSTY-SHELF", 6), uow)
+    messagebus.handle(commands.Allocate(o2, "DUSTY-SHELF", 4), uow)
+
+    assert (
+        archival.archive_all(lambda: unit_of_work.SqlAlchemyUnitOfWork(session_factory))
+        == 1
+    )
+
+    session = session_factory()
+    assert list(
+        session.execute(
+            "SELECT reference, sku, purchased_quantity FROM archived_batches"
+        )
+    ) == [("old", "DUSTY-SHELF", 10)]
+    assert sorted(
+        session.execute("SELECT batchref, orderid, qty FROM archived_allocations")
+    ) == [("old", o1, 6), ("old", o2, 4)]
+    assert count(session, "batches") == 1
+    if orm.allocation_storage == orm.JOIN_TABLE:
+        assert count(session, "allocations") == count(session, "order_lines") == 0
+    else:
+        assert count(session, "batch_allocations") == 0
+
+    [batch] = views.stock(
+        "DUSTY-SHELF", unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    )["batches"]
+    assert batch["batchref"] == "new"
+    [batchref] = messagebus.handle(
+        commands.Allocate(random_orderid(3), "DUSTY-SHELF", 1), uow
+    )
+    assert batchref == "new"
+
+
+def test_archival_walks_every_sku_in_chunks(session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    for i in range(5):
+        messagebus.handle(commands.CreateBatch(f"b{i}", f"SKU-{i}", 0), uow)
+
+    archived = archival.archive_all(
+        lambda: unit_of_work.SqlAlchemyUnitOfWork(session_factory), chunk_size=2
+    )
+
+    assert archived == 5
+    assert count(session_factory(), "archived_batches") == 5
+
+
+def test_archival_in_event_sourced_mode(session_factory):
+    def uow_factory():
+        return unit_of_work.SqlAlchemyUnitOfWork(
+            session_factory, repository_factory=event_store.EventSourcedRepository
+        )
+
+    messagebus.handle(commands.CreateBatch("old", "ES-LAMP", 5), uow_factory())
+    messagebus.handle(commands.CreateBatch("new", "ES-LAMP", 5), uow_factory())
+    messagebus.handle(commands.Allocate(random_orderid(), "ES-LAMP", 5), uow_factory())
+
+    assert archival.archive_all(uow_factory, as_of=date.today()) == 1
+
+    with uow_factory() as uow:
+        assert [b.reference for b in uow.products.get("ES-LAMP").batches] == ["new"]
+    assert count(session_factory(), "archived_allocations") == 1
+
+
+@pytest.mark.parametrize("mode", ["tables", "events"])
+def test_grace_period_of_in_stock_batches_survives_reloads(session_factory, mode):
+    def uow_factory():
+        if mode == "events":
+            return unit_of_work.SqlAlchemyUnitOfWork(
+                session_factory,
+                repository_factory=lambda s: event_store.EventSourcedRepository(
+                    s, snapshot_interval=3
+                ),
+            )
+        return unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+
+    sku = f"GRACEFUL-LAMP-{mode}"
+    messagebus.handle(commands.CreateBatch("b1", sku, 5), uow_factory())
+    messagebus.handle(commands.Allocate(random_orderid(), sku, 5), uow_factory())
+    first_pass = date(2026, 1, 1)
+
+    assert archival.archive_all(uow_factory, as_of=first_pass, grace_days=30) == 0
+    with uow_factory() as uow:
+        [batch] = uow.products.get(sku).batches
+        assert batch.exhausted_on == first_pass
+
+    later = date(2026, 1, 31)
+    assert archival.archive_all(uow_factory, as_of=later, grace_days=30) == 1
+
+
+@pytest.mark.parametrize("mode", ["tables", "events"])
+def test_archived_batches_are_unknown_to_quantity_changes(session_factory, mode):
+    def uow_factory():
+        if mode == "events":
+            return unit_of_work.SqlAlchemyUnitOfWork(
+                session_factory, repository_factory=event_store.EventSourcedRepository
+            )
+        return unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+
+    sku = f"GONE-LAMP-{mode}"
+    messagebus.handle(commands.CreateBatch("old", sku, 5), uow_factory())
+    messagebus.handle(commands.CreateBatch("new", sku, 5), uow_factory())
+    messagebus.handle(commands.Allocate(random_orderid(), sku, 5), uow_factory())
+    assert archival.archive_all(uow_factory, as_of=date.today()) == 1
+
+    with pytest.raises(handlers.UnknownBatch, match="old"):
+        messagebus.handle(commands.ChangeBatchQuantity("old", 20), uow_factory())
+    messagebus.handle(commands.ChangeBatchQuantity("new", 20), uow_factory())
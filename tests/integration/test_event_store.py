@@ -0,0 +1,127 @@
+from datetime import date
+
+import pytest
+from sqlalchemy import exc
+
+from src.allocation.adapters import event_store
+from src.allocation.domain import commands, model
+from src.allocation.service_layer import messagebus, unit_of_work
+from tests.random_refs import random_orderid
+
+
+def event_sourced_uow(session_factory, snapshot_interval=100):
+    return unit_of_work.SqlAlchemyUnitOfWork(
+        session_factory,
+        repository_factory=lambda session: event_store.EventSourcedRepository(
+            session, snapshot_interval=snapshot_interval
+        ),
+    )
+
+
+def load(session_factory, sku, snapshot_interval=100):
+    with event_sourced_uow(session_factory, snapshot_interval) as uow:
+        return uow.products.get(sku)
+
+
+def count(session, table, sku):
+    return session.execute(
+        f"SELECT count(*) FROM {table} WHERE sku=:sku", dict(sku=sku)
+    ).scalar()
+
+
+def test_product_is_rebuilt_from_its_events(session_factory):
+    uow = event_sourced_uow(session_factory)
+    messagebus.handle(commands.CreateBatch("b1", "RETRO-CLOCK", 10), uow)
+    messagebus.handle(
+        commands.CreateBatch("b2", "RETRO-CLOCK", 50, date(2031, 1, 1)), uow
+    )
+    messagebus.handle(commands.Allocate(random_orderid(), "RETRO-CLOCK", 8), uow)
+    messagebus.handle(commands.Allocate("o2", "RETRO-CLOCK", 3), uow)
+    messagebus.handle(commands.Deallocate("o2", "RETRO-CLOCK", 3), uow)
+    messagebus.handle(commands.ChangeBatchQuantity("b1", 5), uow)
+
+    product = load(session_factory, "RETRO-CLOCK")
+
+    b1, b2 = product.batches
+    assert (b1.reference, b1.available_quantity) == ("b1", 5)
+    # the 8 units from b1 were re-allocated to b2
+    assert (b2.reference, b2.eta, b2.available_quantity) == ("b2", date(2031, 1, 1), 42)
+    assert product.version_number == 7
+    assert product.events == []
+    assert count(session_factory(), "order_lines", "RETRO-CLOCK") == 0
+
+
+def test_get_by_batchref(session_factory):
+    uow = event_sourced_uow(session_factory)
+    messagebus.handle(commands.CreateBatch("b1", "SHINY-KETTLE", 10), uow)
+
+    with event_sourced_uow(session_factory) as uow:
+        assert uow.products.get_by_batchref("b1").sku == "SHINY-KETTLE"
+        assert uow.products.get_by_batchref("nope") is None
+        assert uow.products.get("NONEXISTENT") is None
+
+
+def test_bulk_iterators_keep_no_products_in_memory(session_factory):
+    uow = event_sourced_uow(session_factory)
+    for i in range(5):
+        messagebus.handle(commands.CreateBatch(f"b{i}", f"BULK-LAMP-{i}", 10), uow)
+    messagebus.handle(commands.Allocate("o1", "BULK-LAMP-0", 3), uow)
+
+    with event_sourced_uow(session_factory) as uow:
+        availability = list(uow.products.iter_availability())
+        allocations = list(uow.products.iter_allocations())
+
+        assert availability[0] == ("BULK-LAMP-0", "b0", 7)
+        assert len(availability) == 5
+        assert allocations == [("o1", "BULK-LAMP-0", 3, "b0")]
+        assert uow.products._products == {}
+        assert uow.products._streams == {}
+
+
+def test_snapshots_are_written_every_interval(session_factory):
+    uow = event_sourced_uow(session_factory, snapshot_interval=3)
+    messagebus.handle(commands.CreateBatch("b1", "TALL-LAMP", 100), uow)
+    for i in range(7):
+        messagebus.handle(commands.Allocate(f"o{i}", "TALL-LAMP", 1), uow)
+
+    session = session_factory()
+    assert count(session, "product_events", "TALL-LAMP") == 8
+    assert count(session, "product_snapshots", "TALL-LAMP") == 2
+
+    from_snapshot = load(session_factory, "TALL-LAMP", snapshot_interval=3)
+    [batch] = from_snapshot.batches
+    assert batch.available_quantity == 93
+    assert from_snapshot.version_number == 8
+
+
+def test_snapshot_round_trip():
+    batch = model.Batch("b1", "SOFT-RUG", 10, date(2031, 1, 1))
+    batch.allocate(model.OrderLine("o1", "SOFT-RUG", 4))
+    product = model.Product("SOFT-RUG", [batch], 3, allocation_strategy="best_fit")
+
+    state = event_store.to_snapshot(product)
+    restored = event_store.from_snapshot("SOFT-RUG", 3, state)
+
+    [restored_batch] = restored.batches
+    assert restored_batch.eta == date(2031, 1, 1)
+    assert restored_batch._allocations == batch._allocations
+    assert restored.allocation_strategy == "best_fit"
+
+
+def test_concurrent_appends_to_a_stream_conflict(session_factory):
+    messagebus.handle(
+        commands.CreateBatch("b1", "BUSY-SOFA", 100), event_sourced_uow(session_factory)
+    )
+
+    first, second = event_sourced_uow(session_factory), event_sourced_uow(
+        session_factory
+    )
+    with first:
+        first.products.get("BUSY-SOFA").allocate(model.OrderLine("o1", "BUSY-SOFA", 1))
+        with second:
+            product = second.products.get("BUSY-SOFA")
+            product.allocate(model.OrderLine("o2", "BUSY-SOFA", 1))
+            second.commit()
+        with pytest.raises(exc.IntegrityError) as e:
+            first.commit()
+    assert unit_of_work.is_concurrency_conflict(e.value)
@@ -0,0 +1,57 @@
+import csv
+import io
+import json
+
+from src.allocation.domain import commands
+from src.allocation.service_layer import export, messagebus, unit_of_work
+from tests.random_refs import random_orderid
+
+
+def allocate_lines(uow, n):
+    messagebus.handle(commands.CreateBatch("b1", "sku1", 1000, None), uow)
+    orderids = [random_orderid(i) for i in range(n)]
+    for orderid in orderids:
+        messagebus.handle(commands.Allocate(orderid, "sku1", 1), uow)
+    return orderids
+
+
+def test_exports_allocations_as_ndjson(session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    orderids = allocate_lines(uow, 5)
+
+    chunks = list(export.export_allocations(uow, "ndjson", chunk_size=2))
+
+    assert len(chunks) == 3
+    rows = [json.loads(line) for line in "".join(chunks).splitlines()]
+    assert rows == [
+        {"orderid": orderid, "sku": "sku1", "qty": 1, "batchref": "b1"}
+        for orderid in orderids
+    ]
+
+
+def test_exports_allocations_as_csv(session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    orderids = allocate_lines(uow, 3)
+
+    output = "".join(export.export_allocations(uow, "csv", chunk_size=2))
+
+    rows = list(csv.reader(io.StringIO(output)))
+    assert rows[0] == ["orderid", "sku", "qty", "batchref"]
+    assert rows[1:] == [[orderid, "sku1", "1", "b1"] for orderid in orderids]
+
+
+def test_empty_csv_export_still_has_a_header(session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    output = "".join(export.export_allocations(uow, "csv"))
+    assert output.splitlines() == ["orderid,sku,qty,batchref"]
+
+
+def test_closing_the_export_early_releases_the_session(session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    allocate_lines(uow, 5)
+
+    chunks = export.export_allocations(uow, "ndjson", chunk_size=1)
+    next(chunks)
+    chunks.close()
+
+    assert not uow.session.in_transaction()
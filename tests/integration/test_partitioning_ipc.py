@@ -0,0 +1,144 @@
+import threading
+import time
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import clear_mappers, sessionmaker
+
+from src.allocation.adapters import ipc, orm, result_store
+from src.allocation.domain import commands
+from src.allocation.service_layer import (
+    handlers,
+    messagebus,
+    partitioning,
+    unit_of_work,
+)
+from tests.random_refs import random_orderid
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    # a file, as the workers' threads each have their own connection
+    engine = create_engine(
+        f"sqlite:///{tmp_path}/workers.db", connect_args={"check_same_thread": False}
+    )
+    orm.metadata.create_all(engine)
+    orm.start_mappers()
+    yield sessionmaker(bind=engine)
+    clear_mappers()
+
+
+class Workers:
+    """
+    In-process stand-ins for the sku_worker processes, recording which of
+    them handled each command.
+    """
+
+    def __init__(self, session_factory, paths):
+        self.session_factory = session_factory
+        self.results = result_store.InMemoryResultStore()
+        self.paths = paths
+        self.handled_by = {}
+        self.servers = {}
+        for path in paths:
+            self.start(path)
+
+    def start(self, path):
+        def handle(command):
+            self.handled_by[getattr(command, "orderid", None) or command.ref] = path
+            uow = unit_of_work.SqlAlchemyUnitOfWork(
+                self.session_factory, results=self.results
+            )
+            return messagebus.handle(command, uow)[0]
+
+        server = ipc.WorkerServer(path, handle, unit_of_work.is_concurrency_conflict)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.servers[path] = server
+
+    def stop(self, path):
+        server = self.servers.pop(path)
+        server.shutdown()
+        server.server_close()
+
+    def router(self, **kwargs):
+        def lookup_uow_factory():
+            return unit_of_work.SqlAlchemyUnitOfWork(self.session_factory)
+
+        return partitioning.PartitionRouter(
+            self.paths, lookup_uow_factory=lookup_uow_factory, **kwargs
+        )
+
+
+@pytest.fixture
+def workers(session_factory, tmp_path):
+    workers = Workers(session_factory, partitioning.socket_paths(str(tmp_path), 3))
+    yield workers
+    for path in list(workers.servers):
+        workers.stop(path)
+
+
+def test_commands_are_handled_by_the_owner_of_their_sku(workers):
+    router = workers.router()
+    skus = [f"PARTITIONED-LAMP-{i}" for i in range(12)]
+    for sku in skus:
+        router.handle(commands.CreateBatch(f"{sku}-batch", sku, 10))
+
+    for sku in skus:
+        orderid = random_orderid()
+        assert router.handle(commands.Allocate(orderid, sku, 1)) == f"{sku}-batch"
+        assert workers.handled_by[orderid] == router.ring.node_for(sku)
+
+
+def test_batch_commands_are_routed_by_the_sku_of_their_batch(workers):
+    router = workers.router()
+    router.handle(commands.CreateBatch("partitioned-b1", "PARTITIONED-TABLE", 10))
+
+    router.handle(commands.ChangeBatchQuantity("partitioned-b1", 5))
+
+    assert workers.handled_by["partitioned-b1"] == router.ring.node_for(
+        "PARTITIONED-TABLE"
+    )
+
+
+def test_handler_errors_are_raised_as_themselves(workers):
+    router = workers.router()
+    with pytest.raises(handlers.InvalidSku, match="Invalid sku NONEXISTENT-SKU"):
+        router.handle(commands.Allocate(random_orderid(), "NONEXISTENT-SKU", 1))
+
+
+def test_skus_of_a_worker_that_is_down_move_to_the_next_one(workers):
+    router = workers.router(retry_after=60)
+    sku = "PARTITIONED-CHAIR"
+    router.handle(commands.CreateBatch("partitioned-b2", sku, 10))
+    owner = router.ring.node_for(sku)
+    workers.stop(owner)
+
+    orderid = random_orderid()
+    assert router.handle(commands.Allocate(orderid, sku, 1)) == "partitioned-b2"
+
+    assert workers.handled_by[orderid] != owner
+    assert owner not in router.ring.nodes
+
+
+def test_restarted_workers_get_their_skus_back(workers):
+    router = workers.router(retry_after=0.05)
+    sku = "PARTITIONED-SOFA"
+    router.handle(commands.CreateBatch("partitioned-b3", sku, 10))
+    owner = router.ring.node_for(sku)
+    workers.stop(owner)
+    router.handle(commands.Allocate(random_orderid(), sku, 1))
+
+    workers.start(owner)
+    time.sleep(0.1)
+    orderid = random_orderid()
+    router.handle(commands.Allocate(orderid, sku, 1))
+
+    assert workers.handled_by[orderid] == owner
+
+
+def test_no_live_workers(workers):
+    router = workers.router(retry_after=60)
+    for path in list(workers.servers):
+        workers.stop(path)
+    with pytest.raises(partitioning.NoLiveWorkers):
+        router.handle(commands.Allocate(random_orderid(), "PARTITIONED-RUG", 1))
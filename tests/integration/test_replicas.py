@@ -0,0 +1,113 @@
+import os
+import shutil
+import tempfile
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import clear_mappers, sessionmaker
+
+from src.allocation.adapters import orm, replicas
+from src.allocation.domain import commands, model
+from src.allocation.service_layer import export, messagebus, unit_of_work, views
+from tests.random_refs import random_orderid
+
+
+@pytest.fixture
+def databases():
+    """
+    A primary SQLite file with a batch, and two "replicas" copied from it
+    before a line was allocated, so reads show which one they came from.
+    """
+    tmp = tempfile.mkdtemp()
+    paths = [os.path.join(tmp, name) for name in ("primary.db", "r1.db", "r2.db")]
+    engines = [create_engine(f"sqlite:///{path}") for path in paths]
+    orm.metadata.create_all(engines[0])
+    orm.start_mappers()
+    primary = sessionmaker(bind=engines[0])
+    uow = unit_of_work.SqlAlchemyUnitOfWork(primary)
+    messagebus.handle(commands.CreateBatch("b1", "COPIED-CHAIR", 10), uow)
+    for path in paths[1:]:
+        shutil.copy(paths[0], path)
+    messagebus.handle(commands.Allocate(random_orderid(), "COPIED-CHAIR", 4), uow)
+    yield primary, engines[1:]
+    clear_mappers()
+    shutil.rmtree(tmp)
+
+
+def available(uow):
+    return views.stock("COPIED-CHAIR", uow)["batches"][0]["available"]
+
+
+def test_reads_are_spread_over_the_replicas(databases):
+    primary, engines = databases
+    replica_set = replicas.ReplicaSet(primary, engines)
+    uow = unit_of_work.ReadOnlyUnitOfWork(replica_set)
+
+    picked = []
+    for _ in range(4):
+        assert available(uow) == 10
+        picked.append(uow.replica)
+
+    assert picked == replica_set.replicas * 2
+    rows = list(export.export_allocations(unit_of_work.ReadOnlyUnitOfWork(replica_set)))
+    assert rows == []
+
+
+def test_reads_fall_back_to_the_primary_without_healthy_replicas(databases):
+    primary, [engine, _] = databases
+    missing = os.path.join(tempfile.mkdtemp(), "not-yet", "replica.db")
+    replica_set = replicas.ReplicaSet(
+        primary, [create_engine(f"sqlite:///{missing}")], retry_after=60
+    )
+    uow = unit_of_work.ReadOnlyUnitOfWork(replica_set)
+
+    assert available(uow) == 6
+    assert uow.replica is None
+    [replica] = replica_set.replicas
+    assert replica.down_since is not None
+
+    # back, but not tried again until retry_after has passed
+    os.mkdir(os.path.dirname(missing))
+    shutil.copy(engine.url.database, missing)
+    assert available(uow) == 6
+    replica.down_since -= 60
+    assert available(uow) == 10
+    assert uow.replica is replica
+
+
+def test_replicas_are_checked_every_interval(databases):
+    primary, [engine, _] = databases
+    replica_set = replicas.ReplicaSet(primary, [engine], check_interval=60)
+    checks = []
+    replica_set.check = lambda replica: checks.append(replica) or True
+
+    for _ in range(3):
+        replica_set.pick()
+    assert len(checks) == 1
+
+    replica_set.replicas[0].checked_at -= 60
+    replica_set.pick()
+    assert len(checks) == 2
+
+
+def test_read_only_units_of_work_refuse_to_write(databases):
+    primary, engines = databases
+    uow = unit_of_work.ReadOnlyUnitOfWork(replicas.ReplicaSet(primary, engines))
+
+    with pytest.raises(unit_of_work.ReadOnly):
+        with uow:
+            product = uow.products.get("COPIED-CHAIR")
+            product.allocate(model.OrderLine("o2", "COPIED-CHAIR", 1))
+            uow.commit()
+
+    with pytest.raises(unit_of_work.ReadOnly):
+        with uow:
+            uow.products.get("COPIED-CHAIR").change_batch_quantity("b1", 1)
+            uow.session.flush()
+
+    with unit_of_work.ReadOnlyUnitOfWork(replicas.ReplicaSet(primary)) as uow:
+        assert uow.replica is None
+        uow.products.get("COPIED-CHAIR").change_batch_quantity("b1", 1)
+        with pytest.raises(unit_of_work.ReadOnly):
+            uow.session.flush()
+    assert available(unit_of_work.SqlAlchemyUnitOfWork(primary)) == 6
@@ -0,0 +1,140 @@
+import random
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import clear_mappers, sessionmaker
+
+from src.allocation.adapters import orm, sql_allocation
+from src.allocation.domain import commands, model
+from src.allocation.service_layer import messagebus, unit_of_work, views
+from tests.random_refs import random_batchref, random_orderid, random_sku
+
+
+@pytest.fixture(params=[orm.JOIN_TABLE, orm.BATCH_ALLOCATIONS])
+def session_factory(request, in_memory_db):
+    orm.start_mappers(storage=request.param)
+    yield sessionmaker(bind=in_memory_db)
+    clear_mappers()
+
+
+def sql_uow(session_factory):
+    return unit_of_work.SqlAlchemyUnitOfWork(session_factory, sql_allocation=True)
+
+
+def add_product(session_factory, sku, batches, **kwargs):
+    session = session_factory()
+    session.add(model.Product(sku, batches, **kwargs))
+    session.commit()
+    session.close()
+
+
+def allocate(uow, line):
+    with uow:
+        batchref = uow.allocator.allocate(line)
+        uow.commit()
+    return batchref, list(uow.collect_new_events())
+
+
+def assert_allocates_like_the_aggregate(session_factory, seed):
+    rng = random.Random(seed)
+    sku = random_sku(str(seed))
+    today = date.today()
+    batches = [
+        model.Batch(
+            random_batchref(i),
+            sku,
+            rng.randint(0, 20),
+            eta=rng.choice([None, today + timedelta(days=rng.randint(0, 3))]),
+        )
+        for i in range(rng.randint(1, 6))
+    ]
+    expected = model.Product(
+        sku,
+        [model.Batch(b.reference, sku, b._purchased_quantity, b.eta) for b in batches],
+    )
+    add_product(session_factory, sku, batches)
+    uow = sql_uow(session_factory)
+
+    for i in range(30):
+        line = model.OrderLine(random_orderid(i), sku, rng.randint(1, 8))
+        batchref, raised = allocate(uow, line)
+
+        assert batchref is not sql_allocation.NOT_HANDLED
+        assert batchref == expected.allocate(line)
+        assert raised == expected.events
+        expected.events = []
+
+    available = {
+        b["batchref"]: b["available"] for b in views.stock(sku, uow)["batches"]
+    }
+    assert available == {b.reference: b.available_quantity for b in expected.batches}
+    with uow:
+        assert uow.products.get(sku).version_number == expected.version_number
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_allocates_like_the_aggregate(session_factory, seed):
+    assert_allocates_like_the_aggregate(session_factory, seed)
+
+
+def test_allocates_like_the_aggregate_on_postgres(postgres_session_factory):
+    clear_mappers()
+    orm.start_mappers()
+    assert_allocates_like_the_aggregate(postgres_session_factory, seed=0)
+
+
+def test_leaves_other_products_to_the_aggregate(session_factory):
+    best_fit, striped, loaded = random_sku("best"), random_sku("striped"), random_sku()
+    add_product(
+        session_factory,
+        best_fit,
+        [model.Batch("b1", best_fit, 10, eta=None)],
+        allocation_strategy="best_fit",
+    )
+    add_product(
+        session_factory, striped, [model.Batch("b2", striped, 10, eta=None)], stripes=4
+    )
+    add_product(session_factory, loaded, [model.Batch("b3", loaded, 10, eta=None)])
+    uow = sql_uow(session_factory)
+
+    for sku in (best_fit, striped, random_sku("missing")):
+        line = model.OrderLine(random_orderid(), sku, 1)
+        assert allocate(uow, line) == (sql_allocation.NOT_HANDLED, [])
+    with uow:
+        uow.products.get(loaded)
+        line = model.OrderLine(random_orderid(), loaded, 1)
+        assert uow.allocator.allocate(line) is sql_allocation.NOT_HANDLED
+        uow.commit()
+
+    with uow:
+        for sku in (best_fit, striped, loaded):
+            product = uow.products.get(sku)
+            assert product.version_number == 0
+            assert product.batches[0].available_quantity == 10
+
+
+def test_allocate_handler_does_not_load_the_product(session_factory):
+    sku = random_sku()
+    add_product(session_factory, sku, [model.Batch("b1", sku, 10, eta=None)])
+    uow = sql_uow(session_factory)
+
+    [batchref] = messagebus.handle(commands.Allocate(random_orderid(), sku, 3), uow)
+
+    assert batchref == "b1"
+    assert uow.products.seen == set()
+    assert views.stock(sku, uow)["batches"][0]["available"] == 7
+
+
+def test_one_statement_allocates_and_locks_the_batch(session_factory):
+    line = model.OrderLine("o1", "LAMP", 1)
+    sql = str(
+        sql_allocation.allocate_statement(line).compile(dialect=postgresql.dialect())
+    )
+
+    assert sql.startswith("WITH")
+    assert "FOR UPDATE OF batches" in sql
+    assert sql.count("INSERT INTO") == (
+        1 if orm.allocation_storage == orm.BATCH_ALLOCATIONS else 2
+    )
+    assert "UPDATE products" in sql
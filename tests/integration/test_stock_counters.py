@@ -0,0 +1,69 @@
+import pytest
+from sqlalchemy.orm import clear_mappers, sessionmaker
+
+from src.allocation.adapters import event_store, orm, stock_counters
+from src.allocation.domain import commands
+from src.allocation.service_layer import availability, messagebus, unit_of_work, views
+from tests.random_refs import random_orderid
+
+
+@pytest.fixture(params=[orm.JOIN_TABLE, orm.BATCH_ALLOCATIONS])
+def session_factory(request, in_memory_db):
+    orm.start_mappers(storage=request.param)
+    yield sessionmaker(bind=in_memory_db)
+    clear_mappers()
+
+
+@pytest.fixture
+def counters(in_memory_stock_counters):
+    return in_memory_stock_counters
+
+
+def stock(session_factory, sku):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    return {b["batchref"]: b["available"] for b in views.stock(sku, uow)["batches"]}
+
+
+def make_history(uow):
+    for sku in ("COUNTED-SHELF", "COUNTED-DESK"):
+        messagebus.handle(commands.CreateBatch(f"{sku}-1", sku, 10), uow)
+        messagebus.handle(commands.CreateBatch(f"{sku}-2", sku, 10), uow)
+        o1, o2 = random_orderid(1), random_orderid(2)
+        messagebus.handle(commands.Allocate(o1, sku, 6), uow)
+        messagebus.handle(commands.Allocate(o2, sku, 3), uow)
+        messagebus.handle(commands.Deallocate(o2, sku, 3), uow)
+        messagebus.handle(commands.ChangeBatchQuantity(f"{sku}-1", 4), uow)
+
+
+def test_counters_match_the_database(session_factory, counters):
+    make_history(unit_of_work.SqlAlchemyUnitOfWork(session_factory))
+
+    for sku in ("COUNTED-SHELF", "COUNTED-DESK"):
+        assert counters.get_many([sku])[sku]["batches"] == stock(session_factory, sku)
+
+
+def test_reconcile_streams_availability_from_the_database(session_factory, counters):
+    make_history(unit_of_work.SqlAlchemyUnitOfWork(session_factory))
+    expected = counters.get_many(["COUNTED-SHELF", "COUNTED-DESK"])
+    rebuilt = stock_counters.InMemoryStockCounters()
+
+    written = availability.reconcile(
+        unit_of_work.SqlAlchemyUnitOfWork(session_factory), rebuilt, chunk_size=2
+    )
+
+    assert written == 2
+    assert rebuilt.get_many(["COUNTED-SHELF", "COUNTED-DESK"]) == expected
+
+
+def test_reconcile_from_an_event_store(session_factory, counters):
+    def uow_factory():
+        return unit_of_work.SqlAlchemyUnitOfWork(
+            session_factory, repository_factory=event_store.EventSourcedRepository
+        )
+
+    make_history(uow_factory())
+    expected = counters.get_many(["COUNTED-SHELF", "COUNTED-DESK"])
+    rebuilt = stock_counters.InMemoryStockCounters()
+
+    assert availability.reconcile(uow_factory(), rebuilt) == 2
+    assert rebuilt.get_many(["COUNTED-SHELF", "COUNTED-DESK"]) == expected
@@ -0,0 +1,131 @@
+import pytest
+from sqlalchemy.orm import clear_mappers, sessionmaker
+
+from src.allocation.adapters import orm, stripes
+from src.allocation.domain import commands, model
+from src.allocation.service_layer import messagebus, rebalancing, unit_of_work, views
+from tests.random_refs import random_orderid
+
+
+@pytest.fixture(params=[orm.JOIN_TABLE, orm.BATCH_ALLOCATIONS])
+def session_factory(request, in_memory_db):
+    orm.start_mappers(storage=request.param)
+    yield sessionmaker(bind=in_memory_db)
+    clear_mappers()
+
+
+@pytest.fixture
+def uow_factory(session_factory):
+    return lambda: unit_of_work.SqlAlchemyUnitOfWork(session_factory, striping=True)
+
+
+def handle(cmd, uow_factory):
+    return messagebus.handle(cmd, uow_factory())
+
+
+def stripes_of(session_factory, batchref):
+    return [
+        available
+        for (available,) in session_factory().execute(
+            "SELECT available FROM stock_stripes WHERE batchref = :ref ORDER BY stripe",
+            dict(ref=batchref),
+        )
+    ]
+
+
+def striped_product(uow_factory, stripes=4):
+    handle(commands.CreateBatch("hot-1", "HOT-SKU", 10), uow_factory)
+    handle(commands.ChangeStripes("HOT-SKU", stripes), uow_factory)
+
+
+def test_striping_splits_each_batch(session_factory, uow_factory):
+    striped_product(uow_factory)
+    handle(commands.CreateBatch("hot-2", "HOT-SKU", 5), uow_factory)
+
+    assert stripes_of(session_factory, "hot-1") == [3, 3, 2, 2]
+    assert stripes_of(session_factory, "hot-2") == [2, 1, 1, 1]
+
+
+def test_allocations_come_from_a_stripe_and_leave_the_product_alone(
+    session_factory, uow_factory
+):
+    striped_product(uow_factory)
+    version = views.product_version("HOT-SKU", uow_factory())
+    orderid = random_orderid()
+
+    [batchref] = handle(commands.Allocate(orderid, "HOT-SKU", 2), uow_factory)
+
+    assert batchref == "hot-1"
+    assert sum(stripes_of(session_factory, "hot-1")) == 8
+    with uow_factory() as uow:
+        product = uow.products.get("HOT-SKU")
+        assert product.version_number == version
+        assert model.OrderLine(orderid, "HOT-SKU", 2) in product.batches[0]._allocations
+    # but the stock view sees the change
+    assert views.product_version("HOT-SKU", uow_factory()) == version + 1
+    assert views.stock("HOT-SKU", uow_factory())["batches"][0]["available"] == 8
+
+
+def test_lines_must_fit_a_single_stripe(uow_factory):
+    striped_product(uow_factory)
+
+    assert handle(commands.Allocate(random_orderid(), "HOT-SKU", 4), uow_factory) == [
+        None
+    ]
+    assert handle(commands.Allocate(random_orderid(), "HOT-SKU", 3), uow_factory) == [
+        "hot-1"
+    ]
+
+
+def test_a_stripe_allocated_from_concurrently_is_a_conflict(
+    session_factory, uow_factory
+):
+    striped_product(uow_factory, stripes=1)
+    with uow_factory() as uow:
+        stock = uow.stripes.get("HOT-SKU")
+        stock.allocate(model.OrderLine(random_orderid(), "HOT-SKU", 6))
+        # someone else takes 6 meanwhile
+        handle(commands.Allocate(random_orderid(), "HOT-SKU", 6), uow_factory)
+        with pytest.raises(stripes.StripeConflict) as e:
+            uow.commit()
+    assert unit_of_work.is_concurrency_conflict(e.value)
+    assert stripes_of(session_factory, "hot-1") == [4]
+
+
+def test_changes_through_the_product_resync_its_stripes(session_factory, uow_factory):
+    striped_product(uow_factory)
+    orderid = random_orderid()
+    handle(commands.Allocate(orderid, "HOT-SKU", 3), uow_factory)
+
+    handle(commands.Deallocate(orderid, "HOT-SKU", 3), uow_factory)
+    assert stripes_of(session_factory, "hot-1") == [3, 3, 2, 2]
+
+    handle(commands.ChangeBatchQuantity("hot-1", 6), uow_factory)
+    assert stripes_of(session_factory, "hot-1") == [2, 2, 1, 1]
+
+    handle(commands.ChangeStripes("HOT-SKU", 2), uow_factory)
+    assert stripes_of(session_factory, "hot-1") == [3, 3]
+
+    before = views.product_version("HOT-SKU", uow_factory())
+    handle(commands.ChangeStripes("HOT-SKU", 0), uow_factory)
+    assert stripes_of(session_factory, "hot-1") == []
+    assert views.product_version("HOT-SKU", uow_factory()) > before
+    # back to allocating through the product
+    assert handle(commands.Allocate(random_orderid(), "HOT-SKU", 6), uow_factory) == [
+        "hot-1"
+    ]
+
+
+def test_rebalancing_evens_out_stripes(session_factory, uow_factory):
+    striped_product(uow_factory, stripes=2)
+    for _ in range(2):
+        with uow_factory() as uow:
+            stock = uow.stripes.get("HOT-SKU")
+            stock.choice = lambda stripes: stripes[0]
+            stock.allocate(model.OrderLine(random_orderid(), "HOT-SKU", 2))
+            uow.commit()
+    assert stripes_of(session_factory, "hot-1") == [1, 5]
+
+    assert rebalancing.rebalance_all(uow_factory) == 2
+    assert stripes_of(session_factory, "hot-1") == [3, 3]
+    assert rebalancing.rebalance_all(uow_factory) == 0
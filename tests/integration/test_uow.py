@@ -4,10 +4,13 @@ import threading
 import traceback
 
 import pytest
+from sqlalchemy import event
+from sqlalchemy.orm.exc import StaleDataError
 
+from src.utils import metrics
 from src.utils.logger import log
-from src.allocation.domain import model
-from src.allocation.service_layer import unit_of_work
+from src.allocation.domain import commands, model
+from src.allocation.service_layer import messagebus, unit_of_work
 
 
 def random_suffix():
@@ -110,6 +113,82 @@ def try_to_allocate(orderid, sku, exceptions):
         exceptions.append(e)
 
 
+def test_units_of_work_in_a_shared_session_reuse_loaded_products(session_factory):
+    session = session_factory()
+    insert_batch(session, "batch1", "ROUND-TABLE", 100, None)
+    session.commit()
+
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    with uow.shared_session():
+        with uow:
+            first = uow.products.get(sku="ROUND-TABLE")
+            first.allocate(model.OrderLine("o1", "ROUND-TABLE", 10))
+            uow.commit()
+        with uow:
+            assert uow.products.get(sku="ROUND-TABLE") is first
+            assert uow.products.seen == {first}
+        # rolled back, so reloaded
+        with uow:
+            product = uow.products.get(sku="ROUND-TABLE")
+            assert product.batches[0].available_quantity == 90
+
+    assert get_allocated_batch_ref(session, "o1", "ROUND-TABLE") == "batch1"
+
+
+def test_products_changed_since_they_were_loaded_are_not_overwritten(
+    session_factory,
+):
+    session = session_factory()
+    insert_batch(session, "batch1", "SQUARE-TABLE", 100, None)
+    session.commit()
+
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    with uow.shared_session():
+        with uow:
+            kept = uow.products.get(sku="SQUARE-TABLE")
+            uow.commit()
+
+        with unit_of_work.SqlAlchemyUnitOfWork(session_factory) as other:
+            other.products.get(sku="SQUARE-TABLE").allocate(
+                model.OrderLine("o1", "SQUARE-TABLE", 10)
+            )
+            other.commit()
+
+        with pytest.raises(StaleDataError) as e:
+            with uow:
+                kept.allocate(model.OrderLine("o2", "SQUARE-TABLE", 10))
+                uow.commit()
+        assert unit_of_work.is_concurrency_conflict(e.value)
+
+
+def test_handle_loads_the_product_once_per_message(session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    messagebus.handle(commands.CreateBatch("b1", "LONG-TABLE", 10), uow)
+    messagebus.handle(commands.CreateBatch("b2", "LONG-TABLE", 10), uow)
+    for i in range(3):
+        messagebus.handle(commands.Allocate(f"o{i}", "LONG-TABLE", 3), uow)
+
+    loads = []
+
+    def count_product_loads(conn, cursor, statement, *args):
+        if statement.lstrip().startswith("SELECT products."):
+            loads.append(statement)
+
+    engine = session_factory.kw["bind"]
+    event.listen(engine, "before_cursor_execute", count_product_loads)
+    try:
+        # re-allocates two of the lines, each in a unit of work of its own
+        messagebus.handle(commands.ChangeBatchQuantity("b1", 3), uow)
+    finally:
+        event.remove(engine, "before_cursor_execute", count_product_loads)
+
+    # by batchref; the re-allocations get it from the session
+    assert len(loads) == 1
+    with uow:
+        [b1, b2] = uow.products.get(sku="LONG-TABLE").batches
+        assert (b1.available_quantity, b2.available_quantity) == (0, 4)
+
+
 def test_concurrent_updates_to_version_are_not_allowed(postgres_session_factory):
     sku, batch = random_sku(), random_batchref()
     session = postgres_session_factory()
@@ -146,3 +225,16 @@ def test_concurrent_updates_to_version_are_not_allowed(postgres_session_factory)
     assert len(orders) == 1
     with unit_of_work.SqlAlchemyUnitOfWork() as uow:
         uow.session.execute("select 1")
+
+
+def test_records_sql_statements_per_unit_of_work(session_factory):
+    session = session_factory()
+    insert_batch(session, "batch1", "SHINY-KETTLE", 100, None)
+    session.commit()
+    before = unit_of_work.SQL_STATEMENTS.count()
+
+    with unit_of_work.SqlAlchemyUnitOfWork(session_factory) as uow:
+        uow.products.get(sku="SHINY-KETTLE")
+
+    assert unit_of_work.SQL_STATEMENTS.count() == before + 1
+    assert "allocation_uow_sql_statements_sum" in metrics.render()
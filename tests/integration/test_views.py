@@ -0,0 +1,59 @@
+from datetime import date
+
+import pytest
+
+from src.allocation.adapters import event_store
+from src.allocation.domain import commands
+from src.allocation.service_layer import messagebus, unit_of_work, views
+from tests.random_refs import random_orderid
+
+
+def make_uow(session_factory, mode):
+    if mode == "events":
+        return unit_of_work.SqlAlchemyUnitOfWork(
+            session_factory, repository_factory=event_store.EventSourcedRepository
+        )
+    return unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+
+
+@pytest.mark.parametrize("mode", ["tables", "events"])
+def test_stock_view(session_factory, mode):
+    uow = make_uow(session_factory, mode)
+    messagebus.handle(
+        commands.CreateBatch("sku1later", "sku1", 50, date(2011, 1, 2)), uow
+    )
+    messagebus.handle(commands.CreateBatch("sku1batch", "sku1", 50, None), uow)
+    messagebus.handle(commands.CreateBatch("sku2batch", "sku2", 50, None), uow)
+    messagebus.handle(commands.Allocate(random_orderid(), "sku1", 20), uow)
+    messagebus.handle(commands.Allocate(random_orderid(), "sku2", 20), uow)
+
+    stock = views.stock("sku1", uow)
+
+    assert stock == {
+        "sku": "sku1",
+        "version": 3,
+        "batches": [
+            {"batchref": "sku1batch", "available": 30, "eta": None},
+            {"batchref": "sku1later", "available": 50, "eta": "2011-01-02"},
+        ],
+    }
+
+
+@pytest.mark.parametrize("mode", ["tables", "events"])
+def test_stock_view_for_unknown_sku(session_factory, mode):
+    uow = make_uow(session_factory, mode)
+    assert views.stock("nonexistent", uow) is None
+    assert views.product_version("nonexistent", uow) is None
+
+
+@pytest.mark.parametrize("mode", ["tables", "events"])
+def test_product_version_tracks_changes(session_factory, mode):
+    uow = make_uow(session_factory, mode)
+    messagebus.handle(commands.CreateBatch("b1", "sku1", 50, None), uow)
+    before = views.product_version("sku1", uow)
+
+    orderid = random_orderid()
+    messagebus.handle(commands.Allocate(orderid, "sku1", 20), uow)
+    messagebus.handle(commands.Deallocate(orderid, "sku1", 20), uow)
+
+    assert views.product_version("sku1", uow) == before + 2
@@ -0,0 +1,63 @@
+import pytest
+from sqlalchemy.orm import clear_mappers, sessionmaker
+
+from src.allocation.adapters import event_store, orm
+from src.allocation.domain import commands
+from src.allocation.service_layer import messagebus, unit_of_work
+from tests.random_refs import random_orderid
+
+
+@pytest.fixture(params=[orm.JOIN_TABLE, orm.BATCH_ALLOCATIONS])
+def session_factory(request, in_memory_db):
+    orm.start_mappers(storage=request.param)
+    yield sessionmaker(bind=in_memory_db)
+    clear_mappers()
+
+
+def uow_factories(session_factory):
+    return [
+        lambda: unit_of_work.SqlAlchemyUnitOfWork(session_factory),
+        lambda: unit_of_work.SqlAlchemyUnitOfWork(
+            session_factory, repository_factory=event_store.EventSourcedRepository
+        ),
+    ]
+
+
+def waiting(uow_factory, sku):
+    with uow_factory() as uow:
+        return [(line.orderid, line.qty) for line in uow.products.get(sku).waiting]
+
+
+@pytest.mark.parametrize("mode", [0, 1], ids=["tables", "events"])
+def test_waiting_lines_are_persisted_in_order_and_matched(session_factory, mode):
+    uow_factory = uow_factories(session_factory)[mode]
+    sku = f"SCARCE-STOOL-{mode}"
+    o1, o2, o3 = random_orderid(1), random_orderid(2), random_orderid(3)
+    messagebus.handle(commands.CreateBatch("b1", sku, 1), uow_factory())
+    for orderid, qty in [(o1, 4), (o2, 9), (o3, 2)]:
+        messagebus.handle(
+            commands.Allocate(orderid, sku, qty, wait=True), uow_factory()
+        )
+    messagebus.handle(commands.Deallocate(o3, sku, 2), uow_factory())
+
+    assert waiting(uow_factory, sku) == [(o1, 4), (o2, 9)]
+
+    messagebus.handle(commands.CreateBatch("b2", sku, 5), uow_factory())
+
+    assert waiting(uow_factory, sku) == [(o2, 9)]
+    with uow_factory() as uow:
+        b1, b2 = uow.products.get(sku).batches
+        assert b2.available_quantity == 1
+
+
+def test_matched_lines_leave_the_table(session_factory):
+    uow_factory = uow_factories(session_factory)[0]
+    messagebus.handle(commands.CreateBatch("b1", "SCARCE-BENCH", 0), uow_factory())
+    messagebus.handle(
+        commands.Allocate(random_orderid(), "SCARCE-BENCH", 3, wait=True),
+        uow_factory(),
+    )
+    messagebus.handle(commands.ChangeBatchQuantity("b1", 3), uow_factory())
+
+    rows = session_factory().execute("SELECT count(*) FROM waiting_lines").scalar()
+    assert rows == 0
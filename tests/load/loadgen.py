@@ -0,0 +1,314 @@
+"""
+Load generator for the allocation API.
+
+Drives a configurable mix of /allocate and /deallocate requests (after
+seeding stock through /add_batch) across a set of skus with hot-key skew,
+and reports throughput, latency percentiles, error and conflict rates, and
+DB statements per request, for one or more concurrency levels.
+
+In-process, against the Flask test client on a SQLite file:
+
+    python -m tests.load.loadgen --target inprocess --concurrency 1,2,4,8
+
+Over HTTP, against the docker-compose stack (see `make up`):
+
+    python -m tests.load.loadgen --target http --concurrency 1,4,16,32
+
+"""
+
+import os
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+from src.allocation import config
+from tests.random_refs import random_batchref, random_orderid, random_sku
+
+
+# -------
+# TARGETS
+# -------
+class InProcessTarget:
+    """
+    The Flask app, called through its test client, with the default session
+    factory re-bound to a SQLite file. Statements per request are counted
+    exactly, since the test client runs each request on the calling thread.
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        from sqlalchemy import create_engine
+        from src.allocation.adapters import orm
+        from src.allocation.service_layer import unit_of_work
+        from src.allocation.entrypoints import flask_app
+
+        if db_path is None:
+            db_path = os.path.join(tempfile.mkdtemp(), "loadgen.db")
+        engine = create_engine(
+            f"sqlite:///{db_path}",
+            connect_args={"check_same_thread": False, "timeout": 30},
+        )
+        orm.metadata.create_all(engine)
+        unit_of_work.DEFAULT_SESSION_FACTORY.configure(bind=engine)
+        self._uow = unit_of_work
+        self._local = threading.local()
+        self._app = flask_app.app
+        self._statements = 0
+        self._lock = threading.Lock()
+
+    def post(self, path: str, body: dict) -> int:
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self._app.test_client()
+        before = self._uow._statement_count()
+        status = client.post(path, json=body).status_code
+        with self._lock:
+            self._statements += self._uow._statement_count() - before
+        return status
+
+    def put(self, path: str, body: dict) -> int:
+        return self._app.test_client().put(path, json=body).status_code
+
+    def statements(self) -> Optional[float]:
+        return self._statements
+
+
+class HttpTarget:
+    """
+    A running API; statements per request are read from the difference in
+    its /metrics counters, so they include any other traffic it serves.
+    """
+
+    def __init__(self, url: Optional[str] = None):
+        self.url = url or config.get_api_url()
+        self._local = threading.local()
+
+    def post(self, path: str, body: dict) -> int:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session.post(f"{self.url}{path}", json=body).status_code
+
+    def put(self, path: str, body: dict) -> int:
+        return requests.put(f"{self.url}{path}", json=body).status_code
+
+    def statements(self) -> Optional[float]:
+        try:
+            text = requests.get(f"{self.url}/metrics").text
+        except requests.RequestException:
+            return None
+        for line in text.splitlines():
+            if line.startswith("allocation_uow_sql_statements_sum"):
+                return float(line.split()[-1])
+        return None
+
+
+# --------
+# WORKLOAD
+# --------
+class Workload:
+    """
+    `hot_fraction` of requests go to the first `hot_skus` skus, the rest are
+    spread uniformly over all of them; `mix` weights the operations.
+    """
+
+    def __init__(
+        self,
+        skus: int = 100,
+        hot_skus: int = 1,
+        hot_fraction: float = 0.5,
+        mix: Dict[str, float] = None,
+        qty: int = 1,
+    ):
+        self.skus = [random_sku(str(i)) for i in range(skus)]
+        self.hot_skus = self.skus[:hot_skus]
+        self.hot_fraction = hot_fraction
+        self.mix = mix or {"allocate": 0.8, "deallocate": 0.2}
+        self.qty = qty
+
+    def seed(self, target, stock_per_sku: int):
+        for sku in self.skus:
+            status = target.post(
+                "/add_batch",
+                {
+                    "ref": random_batchref(),
+                    "sku": sku,
+                    "qty": stock_per_sku,
+                    "eta": None,
+                },
+            )
+            assert status == 201, f"seeding failed with {status}"
+
+    def stripe(self, target, stripes: int):
+        for sku in self.hot_skus:
+            status = target.put(f"/products/{sku}/stripes", {"stripes": stripes})
+            assert status == 200, f"striping failed with {status}"
+
+    def pick_sku(self, rng: random.Random) -> str:
+        if rng.random() < self.hot_fraction:
+            return rng.choice(self.hot_skus)
+        return rng.choice(self.skus)
+
+    def pick_op(self, rng: random.Random) -> str:
+        ops, weights = zip(*self.mix.items())
+        return rng.choices(ops, weights)[0]
+
+
+# ------
+# RUNNER
+# ------
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1)
+    return sorted_values[max(index, 0)]
+
+
+def _worker(target, workload, n_requests, seed, samples):
+    rng = random.Random(seed)
+    allocated = []  # type: List[Tuple[str, str]]
+    for _ in range(n_requests):
+        op = workload.pick_op(rng)
+        if op == "deallocate" and allocated:
+            orderid, sku = allocated.pop(rng.randrange(len(allocated)))
+        else:
+            op, orderid, sku = "allocate", random_orderid(), workload.pick_sku(rng)
+        body = {"orderid": orderid, "sku": sku, "qty": workload.qty}
+
+        start = time.perf_counter()
+        try:
+            status = target.post(f"/{op}", body)
+        except Exception:
+            status = None
+        elapsed = time.perf_counter() - start
+
+        if op == "allocate" and status == 201:
+            allocated.append((orderid, sku))
+        samples.append((op, status, elapsed))
+
+
+def run_level(target, workload, concurrency: int, n_requests: int, seed: int = 0):
+    samples = []  # type: List[Tuple[str, Optional[int], float]]
+    statements_before = target.statements()
+    per_thread = max(1, n_requests // concurrency)
+    threads = [
+        threading.Thread(
+            target=_worker, args=(target, workload, per_thread, seed + i, samples)
+        )
+        for i in range(concurrency)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - start
+    statements_after = target.statements()
+
+    latencies = sorted(elapsed for _, _, elapsed in samples)
+    total = len(samples)
+    conflicts = sum(1 for _, status, _ in samples if status == 409)
+    errors = sum(
+        1
+        for _, status, _ in samples
+        if status is None or status >= 500 or status == 400
+    )
+    statements = None
+    if statements_before is not None and statements_after is not None:
+        statements = (statements_after - statements_before) / total
+    return dict(
+        concurrency=concurrency,
+        requests=total,
+        duration=duration,
+        throughput=total / duration,
+        p50_ms=percentile(latencies, 50) * 1000,
+        p95_ms=percentile(latencies, 95) * 1000,
+        p99_ms=percentile(latencies, 99) * 1000,
+        error_rate=errors / total,
+        conflict_rate=conflicts / total,
+        statements_per_request=statements,
+        by_op={
+            op: sum(1 for o, _, _ in samples if o == op)
+            for op in ("allocate", "deallocate")
+        },
+    )
+
+
+def print_table(results: List[dict]):
+    print(
+        f"{'conc':>5} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+        f" {'errors':>7} {'conflicts':>9} {'stmts/req':>9}"
+    )
+    for r in results:
+        stmts = (
+            "-"
+            if r["statements_per_request"] is None
+            else f"{r['statements_per_request']:.1f}"
+        )
+        print(
+            f"{r['concurrency']:>5} {r['throughput']:>9.1f} {r['p50_ms']:>8.2f}"
+            f" {r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f} {r['error_rate']:>7.1%}"
+            f" {r['conflict_rate']:>9.1%} {stmts:>9}"
+        )
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for part in text.split(","):
+        op, weight = part.split("=")
+        if op not in ("allocate", "deallocate"):
+            raise argparse.ArgumentTypeError(f"unknown operation {op}")
+        mix[op] = float(weight)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--target", choices=("inprocess", "http"), default="inprocess")
+    parser.add_argument("--url", help="API url for --target http")
+    parser.add_argument("--requests", type=int, default=1000, help="per level")
+    parser.add_argument(
+        "--concurrency", default="1,2,4,8", help="comma-separated levels"
+    )
+    parser.add_argument("--skus", type=int, default=100)
+    parser.add_argument("--hot-skus", type=int, default=1)
+    parser.add_argument("--hot-fraction", type=float, default=0.5)
+    parser.add_argument("--mix", type=parse_mix, default="allocate=0.8,deallocate=0.2")
+    parser.add_argument("--stock", type=int, default=1_000_000, help="per sku")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--stripes",
+        type=int,
+        default=0,
+        help="stock stripes for the hot skus (needs STOCK_STRIPING=1 for http)",
+    )
+    parser.add_argument("-o", "--output", help="write results as JSON")
+    args = parser.parse_args(argv)
+
+    if args.stripes and args.target == "inprocess":
+        os.environ["STOCK_STRIPING"] = "1"  # read when the app is imported
+    target = InProcessTarget() if args.target == "inprocess" else HttpTarget(args.url)
+    workload = Workload(args.skus, args.hot_skus, args.hot_fraction, args.mix)
+    workload.seed(target, args.stock)
+    if args.stripes:
+        workload.stripe(target, args.stripes)
+
+    results = [
+        run_level(target, workload, int(level), args.requests, args.seed)
+        for level in args.concurrency.split(",")
+    ]
+    print_table(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(dict(args=vars(args), results=results), f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
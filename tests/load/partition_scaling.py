@@ -0,0 +1,133 @@
+"""
+Throughput of the in-process API against the number of sku-partitioned
+worker processes it forwards commands to (0: handled in the API itself).
+
+For each worker count, starts the supervisor on a fresh SQLite file,
+seeds it, and runs one loadgen level against it:
+
+    python -m tests.load.partition_scaling --workers 0,1,2,4 --concurrency 8
+
+Scaling needs as many cores as workers, and a database that takes
+concurrent writers (Postgres, with --database-uri); on SQLite every
+commit still takes the file lock, so expect latency, not throughput, to
+improve.
+
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+from typing import List, Optional
+
+from tests.load import loadgen
+
+
+def start_supervisor(workers: int, socket_dir: str, database_uri: str):
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "src.allocation.entrypoints.supervisor",
+            "--workers",
+            str(workers),
+            "--socket-dir",
+            socket_dir,
+            "--database-uri",
+            database_uri,
+        ]
+    )
+    from src.allocation.service_layer import partitioning
+
+    paths = partitioning.socket_paths(socket_dir, workers)
+    deadline = time.monotonic() + 30
+    while not all(os.path.exists(path) for path in paths):
+        if time.monotonic() > deadline or process.poll() is not None:
+            process.terminate()
+            raise RuntimeError("workers never came up")
+        time.sleep(0.1)
+    return process, paths
+
+
+def run(
+    workers: int,
+    workload_args: dict,
+    concurrency: int,
+    n_requests: int,
+    database_uri: Optional[str] = None,
+) -> dict:
+    from src.allocation.entrypoints import flask_app
+    from src.allocation.service_layer import partitioning
+
+    tmp = tempfile.mkdtemp()
+    db_path = os.path.join(tmp, "scaling.db")
+    target = loadgen.InProcessTarget(db_path)
+    supervisor = None
+    if workers:
+        supervisor, paths = start_supervisor(
+            workers,
+            os.path.join(tmp, "sockets"),
+            database_uri or f"sqlite:///{db_path}",
+        )
+        flask_app.partition_router = partitioning.PartitionRouter(paths)
+    else:
+        flask_app.partition_router = None
+    try:
+        workload = loadgen.Workload(**workload_args)
+        workload.seed(target, 1_000_000)
+        result = loadgen.run_level(target, workload, concurrency, n_requests)
+    finally:
+        if supervisor is not None:
+            supervisor.terminate()
+            supervisor.wait()
+    result["workers"] = workers
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--workers", default="0,1,2,4", help="comma-separated counts")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=1000, help="per count")
+    parser.add_argument("--skus", type=int, default=100)
+    parser.add_argument("--hot-skus", type=int, default=1)
+    parser.add_argument("--hot-fraction", type=float, default=0.0)
+    parser.add_argument(
+        "--database-uri", help="for the workers, instead of the SQLite file"
+    )
+    parser.add_argument("-o", "--output", help="write results as JSON")
+    args = parser.parse_args(argv)
+
+    workload_args = dict(
+        skus=args.skus, hot_skus=args.hot_skus, hot_fraction=args.hot_fraction
+    )
+    results = []  # type: List[dict]
+    for workers in args.workers.split(","):
+        results.append(
+            run(
+                int(workers),
+                workload_args,
+                args.concurrency,
+                args.requests,
+                args.database_uri,
+            )
+        )
+
+    print(f"{'workers':>7} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for r in results:
+        print(
+            f"{r['workers']:>7} {r['throughput']:>9.1f} {r['p50_ms']:>8.2f}"
+            f" {r['p99_ms']:>8.2f} {r['error_rate']:>7.1%}"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(dict(args=vars(args), results=results), f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+from datetime import date
+
+import pytest
+
+from src.allocation.domain import commands
+from src.allocation.service_layer import availability, handlers, messagebus
+from src.allocation.service_layer.unit_of_work import FakeUnitOfWork
+
+
+@pytest.fixture
+def counters(in_memory_stock_counters):
+    return in_memory_stock_counters
+
+
+def batches_of(counters, sku):
+    return counters.get_many([sku])[sku]
+
+
+def test_counters_follow_allocations_and_deallocations(counters):
+    uow = FakeUnitOfWork()
+    messagebus.handle(commands.CreateBatch("b1", "COUNTED-LAMP", 10), uow)
+    messagebus.handle(commands.CreateBatch("b2", "COUNTED-LAMP", 5), uow)
+    messagebus.handle(commands.Allocate("o1", "COUNTED-LAMP", 3), uow)
+    messagebus.handle(commands.Allocate("o2", "COUNTED-LAMP", 4), uow)
+    messagebus.handle(commands.Deallocate("o1", "COUNTED-LAMP", 3), uow)
+
+    assert batches_of(counters, "COUNTED-LAMP") == {
+        "available": 11,
+        "batches": {"b1": 6, "b2": 5},
+    }
+
+
+def test_counters_follow_quantity_changes_and_the_reallocations_they_cause(
+    counters,
+):
+    uow = FakeUnitOfWork()
+    messagebus.handle(commands.CreateBatch("b1", "COUNTED-TABLE", 10), uow)
+    messagebus.handle(commands.CreateBatch("b2", "COUNTED-TABLE", 10), uow)
+    messagebus.handle(commands.Allocate("o1", "COUNTED-TABLE", 6), uow)
+    messagebus.handle(commands.Allocate("o2", "COUNTED-TABLE", 4), uow)
+
+    messagebus.handle(commands.ChangeBatchQuantity("b1", 5), uow)
+
+    product = uow.products.get("COUNTED-TABLE")
+    assert batches_of(counters, "COUNTED-TABLE")["batches"] == {
+        b.reference: b.available_quantity for b in product.batches
+    }
+    assert batches_of(counters, "COUNTED-TABLE")["available"] == 5
+
+
+def test_archived_batches_are_dropped(counters):
+    uow = FakeUnitOfWork()
+    messagebus.handle(commands.CreateBatch("b1", "COUNTED-RUG", 2), uow)
+    messagebus.handle(commands.CreateBatch("b2", "COUNTED-RUG", 5), uow)
+    messagebus.handle(commands.Allocate("o1", "COUNTED-RUG", 2), uow)
+
+    messagebus.handle(commands.ArchiveBatches("COUNTED-RUG", date.today()), uow)
+
+    assert batches_of(counters, "COUNTED-RUG") == {
+        "available": 5,
+        "batches": {"b2": 5},
+    }
+
+
+def test_unknown_skus_read_as_empty(counters):
+    assert batches_of(counters, "NONEXISTENT-SKU") == {"available": 0, "batches": {}}
+
+
+def test_counters_are_not_maintained_when_disabled():
+    # STOCK_COUNTERS is off by default
+    assert availability.counters is None
+    for handlers_of_event in messagebus.EVENT_HANDLERS.values():
+        assert handlers.update_stock_counters not in handlers_of_event
+
+
+def test_reconcile_rebuilds_counters_that_drifted(counters):
+    uow = FakeUnitOfWork()
+    for sku in ("DRIFTING-A", "DRIFTING-B", "DRIFTING-C"):
+        messagebus.handle(commands.CreateBatch(f"{sku}-b1", sku, 10), uow)
+        messagebus.handle(commands.CreateBatch(f"{sku}-b2", sku, 10), uow)
+        messagebus.handle(commands.Allocate(f"{sku}-o1", sku, 7), uow)
+    counters.adjust("DRIFTING-B", "DRIFTING-B-b1", 100)  # e.g. a lost update
+    counters.drop_batch("DRIFTING-C", "DRIFTING-C-b2")
+
+    written = availability.reconcile(uow, counters, chunk_size=3)
+
+    assert written == 3
+    for sku in ("DRIFTING-A", "DRIFTING-B", "DRIFTING-C"):
+        assert batches_of(counters, sku) == {
+            "available": 13,
+            "batches": {f"{sku}-b1": 3, f"{sku}-b2": 10},
+        }
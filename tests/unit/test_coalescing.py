@@ -0,0 +1,138 @@
+import threading
+
+import pytest
+
+from src.utils import profiling, tracing
+from src.allocation.domain import commands
+from src.allocation.service_layer import coalescing, handlers, messagebus
+from src.allocation.service_layer.unit_of_work import FakeUnitOfWork
+
+
+class CountingUnitOfWork(FakeUnitOfWork):
+    def __init__(self):
+        super().__init__()
+        self.commits = 0
+
+    def _commit(self):
+        super()._commit()
+        self.commits += 1
+
+
+def allocate_concurrently(coalescer, cmds):
+    results, errors = {}, []
+
+    def allocate(cmd):
+        try:
+            results[cmd.orderid] = coalescer.allocate(cmd)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=allocate, args=(cmd,)) for cmd in cmds]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def make_coalescer(window=0.05, max_batch=50, profiler=None):
+    uow = CountingUnitOfWork()
+    messagebus.handle(commands.CreateBatch("b1", "POPULAR-MUG", 100, None), uow)
+    uow.commits = 0
+    coalescer = coalescing.AllocationCoalescer(
+        lambda: uow, window=window, max_batch=max_batch, profiler=profiler
+    )
+    return coalescer, uow
+
+
+def test_concurrent_allocations_share_one_commit():
+    coalescer, uow = make_coalescer()
+    cmds = [commands.Allocate(f"o{i}", "POPULAR-MUG", 1) for i in range(10)]
+
+    results, errors = allocate_concurrently(coalescer, cmds)
+
+    assert errors == []
+    assert results == {f"o{i}": "b1" for i in range(10)}
+    assert uow.commits == 1
+    [batch] = uow.products.get("POPULAR-MUG").batches
+    assert batch.available_quantity == 90
+
+
+def test_batches_are_capped_at_max_batch():
+    coalescer, uow = make_coalescer(max_batch=3)
+    cmds = [commands.Allocate(f"o{i}", "POPULAR-MUG", 1) for i in range(9)]
+
+    results, errors = allocate_concurrently(coalescer, cmds)
+
+    assert errors == []
+    assert len(results) == 9
+    assert uow.commits >= 3
+
+
+def test_each_caller_gets_its_own_result():
+    coalescer, uow = make_coalescer()
+    cmds = [
+        commands.Allocate("small", "POPULAR-MUG", 60),
+        commands.Allocate("too-big", "POPULAR-MUG", 60),
+    ]
+
+    results, errors = allocate_concurrently(coalescer, cmds)
+
+    assert set(results.values()) == {"b1", None}
+
+
+def test_retries_within_a_batch_are_allocated_once():
+    coalescer, uow = make_coalescer()
+    product = uow.products.get("POPULAR-MUG")
+    version = product.version_number
+    cmds = [commands.Allocate("o1", "POPULAR-MUG", 10) for _ in range(5)]
+
+    results, errors = allocate_concurrently(coalescer, cmds)
+
+    assert errors == []
+    assert results == {"o1": "b1"}
+    # the batch's set of lines would hide a repeat; the version would not
+    assert product.version_number == version + 1
+
+
+def test_invalid_sku_is_raised_to_every_caller():
+    coalescer, uow = make_coalescer()
+    cmds = [commands.Allocate(f"o{i}", "NONEXISTENT-SKU", 1) for i in range(3)]
+
+    results, errors = allocate_concurrently(coalescer, cmds)
+
+    assert results == {}
+    assert len(errors) == 3
+    assert all(isinstance(e, handlers.InvalidSku) for e in errors)
+
+
+def test_batches_are_instrumented_like_handlers():
+    labels = dict(kind="command", message="Allocate", handler="allocate_many")
+    timed = messagebus.HANDLER_LATENCY.count(**labels)
+    failed = messagebus.HANDLER_ERRORS.value(**labels)
+    exporter = tracing.InMemoryExporter()
+    tracing.configure(exporter, sample_rate=1.0)
+    try:
+        coalescer, uow = make_coalescer(window=0)
+        coalescer.allocate(commands.Allocate("o1", "POPULAR-MUG", 1))
+        with pytest.raises(handlers.InvalidSku):
+            coalescer.allocate(commands.Allocate("o1", "NONEXISTENT-SKU", 1))
+    finally:
+        tracing.configure(tracing.NullExporter(), sample_rate=0.0)
+
+    assert messagebus.HANDLER_LATENCY.count(**labels) == timed + 2
+    assert messagebus.HANDLER_ERRORS.value(**labels) == failed + 1
+    [apply, _] = [s for s in exporter.spans if s.name == "coalescer.apply"]
+    [allocate_many, _] = [s for s in exporter.spans if s.name == "allocate_many"]
+    assert apply.attributes == {"sku": "POPULAR-MUG", "size": 1}
+    assert allocate_many.parent_id == apply.span_id
+
+
+def test_sampled_batches_are_profiled(tmp_path):
+    profiler = profiling.Profiler(str(tmp_path), sample_rate=1.0)
+    coalescer, uow = make_coalescer(window=0, profiler=profiler)
+
+    coalescer.allocate(commands.Allocate("o1", "POPULAR-MUG", 1))
+
+    [path] = profiler.files()
+    assert path.endswith("Allocate-POPULAR-MUG.prof")
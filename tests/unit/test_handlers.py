@@ -4,7 +4,7 @@ import pytest
 
 from src.allocation.domain import model, events, commands
 from src.allocation.adapters.repository import FakeRepository
-from src.allocation.service_layer import handlers, messagebus
+from src.allocation.service_layer import archival, handlers, messagebus
 from src.allocation.service_layer.unit_of_work import FakeUnitOfWork
 
 
@@ -160,3 +160,153 @@ class TestChangeBatchQuantity:
         assert batch1.available_quantity == 5
         # and 20 will be re-allocated to the next batch
         assert batch2.available_quantity == 30
+
+    @staticmethod
+    def test_errors_for_unknown_or_archived_batches():
+        uow = FakeUnitOfWork()
+        messagebus.handle(commands.CreateBatch("b1", "GONE-LAMP", 10), uow)
+        messagebus.handle(commands.Allocate("o1", "GONE-LAMP", 10), uow)
+        archival.archive_all(lambda: uow)
+
+        for ref in ("b1", "NONEXISTENT-BATCH"):
+            with pytest.raises(handlers.UnknownBatch, match=ref):
+                messagebus.handle(commands.ChangeBatchQuantity(ref, 20), uow)
+
+
+class TestIdempotency:
+    @staticmethod
+    def test_retried_allocation_is_answered_without_touching_the_aggregate():
+        uow = FakeUnitOfWork()
+        messagebus.handle(commands.CreateBatch("b1", "RUSTIC-BENCH", 100, None), uow)
+        messagebus.handle(commands.Allocate("o1", "RUSTIC-BENCH", 10), uow)
+        uow.committed = False
+
+        results = messagebus.handle(commands.Allocate("o1", "RUSTIC-BENCH", 10), uow)
+
+        assert results == ["b1"]
+        assert uow.committed is False
+        [batch] = uow.products.get("RUSTIC-BENCH").batches
+        assert batch.available_quantity == 90
+
+    @staticmethod
+    def test_explicit_idempotency_keys_take_precedence():
+        uow = FakeUnitOfWork()
+        messagebus.handle(commands.CreateBatch("b1", "RUSTIC-BENCH", 100, None), uow)
+        messagebus.handle(commands.Allocate("o1", "RUSTIC-BENCH", 10, "key-1"), uow)
+        product = uow.products.get("RUSTIC-BENCH")
+        version = product.version_number
+
+        # a retry with the same key is answered from the store...
+        messagebus.handle(commands.Allocate("o1", "RUSTIC-BENCH", 10, "key-1"), uow)
+        assert product.version_number == version
+        # ...while another key reaches the aggregate, even for the same line
+        messagebus.handle(commands.Allocate("o1", "RUSTIC-BENCH", 10, "key-2"), uow)
+        assert product.version_number == version + 1
+
+    @staticmethod
+    def test_deallocation_invalidates_explicitly_keyed_allocations():
+        uow = FakeUnitOfWork()
+        messagebus.handle(commands.CreateBatch("b1", "RUSTIC-BENCH", 100, None), uow)
+        messagebus.handle(commands.Allocate("o1", "RUSTIC-BENCH", 10, "key-1"), uow)
+        messagebus.handle(commands.Deallocate("o1", "RUSTIC-BENCH", 10, "key-2"), uow)
+
+        [result] = messagebus.handle(
+            commands.Allocate("o1", "RUSTIC-BENCH", 10, "key-1"), uow
+        )
+
+        assert result == "b1"
+        [batch] = uow.products.get("RUSTIC-BENCH").batches
+        assert batch.available_quantity == 90
+        assert uow.results.get("Deallocate:key-2") is None
+
+    @staticmethod
+    def test_failed_allocations_are_not_cached():
+        uow = FakeUnitOfWork()
+        messagebus.handle(commands.CreateBatch("b1", "RUSTIC-BENCH", 10, None), uow)
+        [result] = messagebus.handle(commands.Allocate("o1", "RUSTIC-BENCH", 20), uow)
+        assert result is None
+
+        messagebus.handle(commands.ChangeBatchQuantity("b1", 50), uow)
+        [result] = messagebus.handle(commands.Allocate("o1", "RUSTIC-BENCH", 20), uow)
+        assert result == "b1"
+
+    @staticmethod
+    def test_deallocation_invalidates_cached_allocation():
+        uow = FakeUnitOfWork()
+        messagebus.handle(commands.CreateBatch("b1", "RUSTIC-BENCH", 100, None), uow)
+        messagebus.handle(commands.Allocate("o1", "RUSTIC-BENCH", 10), uow)
+        messagebus.handle(commands.Deallocate("o1", "RUSTIC-BENCH", 10), uow)
+
+        messagebus.handle(commands.Allocate("o1", "RUSTIC-BENCH", 10), uow)
+
+        [batch] = uow.products.get("RUSTIC-BENCH").batches
+        assert batch.available_quantity == 90
+
+    @staticmethod
+    def test_result_store_is_bounded():
+        uow = FakeUnitOfWork()
+        uow.results.max_size = 2
+        messagebus.handle(commands.CreateBatch("b1", "RUSTIC-BENCH", 100, None), uow)
+        for orderid in ("o1", "o2", "o3"):
+            messagebus.handle(commands.Allocate(orderid, "RUSTIC-BENCH", 10), uow)
+
+        assert len(uow.results) == 2
+        assert uow.results.get("Allocate:o1:RUSTIC-BENCH") is None
+
+
+class TestChangeAllocationStrategy:
+    @staticmethod
+    def test_strategy_is_used_for_later_allocations():
+        uow = FakeUnitOfWork()
+        messagebus.handle(commands.CreateBatch("big", "SNUG-CUSHION", 100), uow)
+        messagebus.handle(commands.CreateBatch("small", "SNUG-CUSHION", 10), uow)
+        messagebus.handle(
+            commands.ChangeAllocationStrategy("SNUG-CUSHION", "best_fit"), uow
+        )
+
+        [batchref] = messagebus.handle(commands.Allocate("o1", "SNUG-CUSHION", 5), uow)
+        assert batchref == "small"
+        assert uow.products.get("SNUG-CUSHION").allocation_strategy == "best_fit"
+
+    @staticmethod
+    def test_errors_for_invalid_sku():
+        uow = FakeUnitOfWork()
+        with pytest.raises(handlers.InvalidSku):
+            messagebus.handle(
+                commands.ChangeAllocationStrategy("NONEXISTENT-SKU", "best_fit"), uow
+            )
+
+
+class TestArchiveBatches:
+    @staticmethod
+    def test_archives_exhausted_batches_of_every_product():
+        uow = FakeUnitOfWork()
+        for sku in ("OLD-CHAIR", "OLD-TABLE", "OLD-RUG"):
+            messagebus.handle(commands.CreateBatch(f"{sku}-1", sku, 10), uow)
+            messagebus.handle(commands.CreateBatch(f"{sku}-2", sku, 10), uow)
+            messagebus.handle(commands.Allocate("o1", sku, 10), uow)
+
+        archived = archival.archive_all(lambda: uow, chunk_size=2)
+
+        assert archived == 3
+        assert sorted(b.reference for b in uow.products.archived) == [
+            "OLD-CHAIR-1",
+            "OLD-RUG-1",
+            "OLD-TABLE-1",
+        ]
+        [batch] = uow.products.get("OLD-RUG").batches
+        assert batch.reference == "OLD-RUG-2"
+
+    @staticmethod
+    def test_keeps_batches_just_run_out_for_the_grace_period():
+        uow = FakeUnitOfWork()
+        messagebus.handle(commands.CreateBatch("b1", "BUSY-LAMP", 10), uow)
+        messagebus.handle(commands.Allocate("o1", "BUSY-LAMP", 10), uow)
+
+        assert archival.archive_all(lambda: uow, grace_days=30) == 0
+
+        # its lines are still live
+        messagebus.handle(commands.Deallocate("o1", "BUSY-LAMP", 10), uow)
+        messagebus.handle(commands.ChangeBatchQuantity("b1", 20), uow)
+        [batch] = uow.products.get("BUSY-LAMP").batches
+        assert batch.available_quantity == 20
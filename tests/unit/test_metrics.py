@@ -0,0 +1,65 @@
+import pytest
+
+from src.utils import metrics
+from src.allocation.domain import commands
+from src.allocation.service_layer import handlers, messagebus
+from src.allocation.service_layer.unit_of_work import FakeUnitOfWork
+
+
+def test_counter_renders_per_label_set():
+    registry = metrics.Registry()
+    requests = registry.counter("test_requests_total", "Requests.")
+    requests.inc(route="/allocate")
+    requests.inc(2, route="/allocate")
+    requests.inc(route="/deallocate")
+
+    assert registry.render().splitlines() == [
+        "# HELP test_requests_total Requests.",
+        "# TYPE test_requests_total counter",
+        'test_requests_total{route="/allocate"} 3',
+        'test_requests_total{route="/deallocate"} 1',
+    ]
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = metrics.Registry()
+    latency = registry.histogram("test_seconds", "Latency.", buckets=(0.1, 1))
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(5)
+
+    lines = registry.render().splitlines()
+    assert lines[2:] == [
+        'test_seconds_bucket{le="0.1"} 1',
+        'test_seconds_bucket{le="1"} 2',
+        'test_seconds_bucket{le="+Inf"} 3',
+        "test_seconds_sum 5.55",
+        "test_seconds_count 3",
+    ]
+
+
+def test_collectors_are_rendered_at_scrape_time():
+    registry = metrics.Registry()
+    registry.register_collector(lambda: ["test_gauge 42"])
+    assert "test_gauge 42" in registry.render()
+
+
+def test_messagebus_records_handler_latency():
+    labels = dict(kind="command", message="CreateBatch", handler="add_batch")
+    before = messagebus.HANDLER_LATENCY.count(**labels)
+
+    messagebus.handle(
+        commands.CreateBatch("b1", "QUIET-CLOCK", 100, None), FakeUnitOfWork()
+    )
+
+    assert messagebus.HANDLER_LATENCY.count(**labels) == before + 1
+
+
+def test_messagebus_counts_handler_errors():
+    labels = dict(kind="command", message="Allocate", handler="allocate")
+    before = messagebus.HANDLER_ERRORS.value(**labels)
+
+    with pytest.raises(handlers.InvalidSku):
+        messagebus.handle(commands.Allocate("o1", "NONEXISTENT", 1), FakeUnitOfWork())
+
+    assert messagebus.HANDLER_ERRORS.value(**labels) == before + 1
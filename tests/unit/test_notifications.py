@@ -0,0 +1,80 @@
+from src.allocation.domain import commands
+from src.allocation.adapters.email import FakeEmailSender
+from src.allocation.service_layer import messagebus, notifications
+from src.allocation.service_layer.unit_of_work import FakeUnitOfWork
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_digest(window=60.0):
+    sender, clock = FakeEmailSender(), FakeClock()
+    digest = notifications.OutOfStockDigest(
+        sender, window=window, clock=clock, auto_flush=False
+    )
+    return digest, sender, clock
+
+
+def test_events_within_a_window_produce_one_digest():
+    digest, sender, _ = make_digest()
+    for _ in range(1000):
+        digest.record("HOT-SKU")
+    assert sender.sent == []
+
+    digest.flush()
+
+    [(to, subject, body)] = sender.sent
+    assert subject == "Out of stock for HOT-SKU"
+    assert "999 suppressed" in body
+    assert digest.suppressed == 999
+
+
+def test_digest_lists_each_sku_once():
+    digest, sender, _ = make_digest()
+    digest.record("SKU-B")
+    digest.record("SKU-A")
+    digest.record("SKU-B")
+    digest.flush()
+
+    [(_, subject, body)] = sender.sent
+    assert subject == "Out of stock for SKU-A, SKU-B"
+    assert body.splitlines() == [
+        "SKU-A: 1 out-of-stock events (0 suppressed)",
+        "SKU-B: 2 out-of-stock events (1 suppressed)",
+    ]
+
+
+def test_expired_window_is_flushed_by_the_next_event():
+    digest, sender, clock = make_digest(window=10)
+    digest.record("HOT-SKU")
+    clock.now = 11
+    digest.record("HOT-SKU")
+
+    assert len(sender.sent) == 1
+    digest.flush()
+    assert len(sender.sent) == 2
+
+
+def test_flushing_an_empty_window_sends_nothing():
+    digest, sender, _ = make_digest()
+    digest.flush()
+    assert sender.sent == []
+
+
+def test_out_of_stock_handler_feeds_the_digest(monkeypatch):
+    digest, sender, _ = make_digest()
+    monkeypatch.setattr(notifications, "out_of_stock", digest)
+    uow = FakeUnitOfWork()
+    messagebus.handle(commands.CreateBatch("b1", "HOT-SKU", 10, None), uow)
+    for i in range(5):
+        messagebus.handle(commands.Allocate(f"o{i}", "HOT-SKU", 20), uow)
+    assert sender.sent == []
+
+    digest.flush()
+    [(_, _, body)] = sender.sent
+    assert body == "HOT-SKU: 5 out-of-stock events (4 suppressed)"
@@ -0,0 +1,44 @@
+import pytest
+
+from src.allocation.service_layer import partitioning
+
+NODES = [f"/tmp/workers/worker-{i}.sock" for i in range(4)]
+SKUS = [f"SKU-{i}" for i in range(1000)]
+
+
+def test_keys_have_one_owner_whatever_the_ring_was_built_from():
+    ring = partitioning.HashRing(NODES)
+    reversed_ring = partitioning.HashRing(reversed(NODES))
+    assert all(ring.node_for(sku) == reversed_ring.node_for(sku) for sku in SKUS)
+
+
+def test_keys_are_spread_over_all_nodes():
+    ring = partitioning.HashRing(NODES)
+    owned = [sum(ring.node_for(sku) == node for sku in SKUS) for node in NODES]
+    assert min(owned) > len(SKUS) / len(NODES) / 2
+
+
+def test_removing_a_node_only_moves_its_own_keys():
+    ring = partitioning.HashRing(NODES)
+    before = {sku: ring.node_for(sku) for sku in SKUS}
+    ring.remove(NODES[1])
+    after = {sku: ring.node_for(sku) for sku in SKUS}
+
+    moved = {sku for sku in SKUS if before[sku] != after[sku]}
+    assert moved == {sku for sku in SKUS if before[sku] == NODES[1]}
+    assert NODES[1] not in after.values()
+
+
+def test_adding_a_node_back_restores_its_keys():
+    ring = partitioning.HashRing(NODES)
+    before = {sku: ring.node_for(sku) for sku in SKUS}
+    ring.remove(NODES[2])
+    ring.add(NODES[2])
+    assert {sku: ring.node_for(sku) for sku in SKUS} == before
+
+
+def test_empty_ring_has_no_owner():
+    ring = partitioning.HashRing(NODES[:1])
+    ring.remove(NODES[0])
+    with pytest.raises(partitioning.NoLiveWorkers):
+        ring.node_for("SKU-1")
@@ -5,7 +5,6 @@ import pytest
 from src.allocation.domain import events
 from src.allocation.domain.model import Product, OrderLine, Batch
 
-
 today = date.today()
 tomorrow = today + timedelta(days=1)
 later = tomorrow + timedelta(days=10)
@@ -75,3 +74,72 @@ def test_outputs_allocated_event():
         orderid="oref", sku="RETRO-LAMPSHADE", qty=10, batchref=batch.reference
     )
     assert product.events[-1] == expected
+
+
+def test_every_change_increments_version_number():
+    line = OrderLine("oref", "SCANDI-PEN", 10)
+    product = Product(sku="SCANDI-PEN", batches=[])
+
+    product.add_batch(Batch("b1", "SCANDI-PEN", 100, eta=None))
+    product.allocate(line)
+    product.deallocate(line)
+    product.change_batch_quantity("b1", 50)
+
+    assert product.version_number == 4
+
+
+def test_only_exhausted_batches_past_their_grace_period_are_retirable():
+    exhausted_shipment = Batch("ship", "OLD-LAMP", 5, eta=today - timedelta(days=10))
+    exhausted_shipment.allocate(OrderLine("o1", "OLD-LAMP", 5))
+    exhausted_in_stock = Batch("stock", "OLD-LAMP", 0, eta=None)
+    exhausted_in_stock.exhausted_on = today - timedelta(days=10)
+    unmarked_in_stock = Batch("unmarked", "OLD-LAMP", 0, eta=None)
+    with_stock = Batch("open", "OLD-LAMP", 5, eta=None)
+
+    assert exhausted_shipment.is_retirable(today, timedelta(days=7))
+    assert not exhausted_shipment.is_retirable(today, timedelta(days=30))
+    assert exhausted_in_stock.is_retirable(today, timedelta(days=7))
+    assert not exhausted_in_stock.is_retirable(today, timedelta(days=30))
+    assert not unmarked_in_stock.is_retirable(today)
+    assert not with_stock.is_retirable(today)
+
+
+def test_retired_batches_leave_the_aggregate():
+    exhausted = Batch("done", "OLD-LAMP", 0, eta=None)
+    live = Batch("live", "OLD-LAMP", 10, eta=None)
+    product = Product(sku="OLD-LAMP", batches=[exhausted, live], version_number=3)
+
+    assert product.retire_batches(today) == [exhausted]
+    assert product.batches == [live]
+    assert product.version_number == 4
+    assert product.events == [
+        events.BatchExhausted("OLD-LAMP", "done", today),
+        events.BatchArchived("OLD-LAMP", "done"),
+    ]
+    assert product.retire_batches(today) == []
+
+
+def test_in_stock_batches_are_kept_for_the_grace_period_after_running_out():
+    batch = Batch("b1", "OLD-LAMP", 10, eta=None)
+    product = Product(sku="OLD-LAMP", batches=[batch], version_number=1)
+    product.allocate(OrderLine("o1", "OLD-LAMP", 10))
+    grace = timedelta(days=30)
+
+    assert product.retire_batches(today, grace) == []
+    assert batch.exhausted_on == today
+    assert product.events[-1] == events.BatchExhausted("OLD-LAMP", "b1", today)
+    assert product.retire_batches(today + timedelta(days=29), grace) == []
+    assert product.retire_batches(today + timedelta(days=30), grace) == [batch]
+
+
+def test_stock_coming_back_restarts_the_grace_period():
+    batch = Batch("b1", "OLD-LAMP", 10, eta=None)
+    product = Product(sku="OLD-LAMP", batches=[batch])
+    product.allocate(OrderLine("o1", "OLD-LAMP", 10))
+    product.retire_batches(today, timedelta(days=30))
+
+    product.deallocate(OrderLine("o1", "OLD-LAMP", 10))
+    assert batch.exhausted_on is None
+    product.allocate(OrderLine("o2", "OLD-LAMP", 10))
+    assert product.retire_batches(later, timedelta(days=30)) == []
+    assert batch.exhausted_on == later
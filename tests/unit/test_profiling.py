@@ -0,0 +1,53 @@
+import os
+
+from src.utils import profiling
+from src.allocation.domain import commands
+from src.allocation.service_layer import messagebus
+from src.allocation.service_layer.unit_of_work import FakeUnitOfWork
+
+
+def handle_some_messages():
+    uow = FakeUnitOfWork()
+    messagebus.handle(commands.CreateBatch("b1", "SLOW-SOFA", 100, None), uow)
+    return uow
+
+
+def test_forced_profiles_are_saved_tagged_with_command_and_sku(tmp_path):
+    profiler = profiling.Profiler(str(tmp_path))
+    cmd = commands.Allocate("o1", "SLOW-SOFA", 10)
+
+    with profiling.maybe_profile(profiler, cmd, forced=True):
+        handle_some_messages()
+
+    [path] = profiler.files()
+    assert os.path.basename(path).endswith("-Allocate-SLOW-SOFA.prof")
+
+
+def test_unsampled_messages_are_not_profiled(tmp_path):
+    profiler = profiling.Profiler(str(tmp_path), sample_rate=0)
+    with profiling.maybe_profile(profiler, commands.Allocate("o1", "SLOW-SOFA", 10)):
+        handle_some_messages()
+    assert profiler.files() == []
+
+
+def test_profile_directory_is_rotated(tmp_path):
+    profiler = profiling.Profiler(str(tmp_path), max_files=3)
+    for i in range(5):
+        with profiler.profile(f"tag-{i}"):
+            pass
+
+    files = profiler.files()
+    assert len(files) == 3
+    assert files[-1].endswith("tag-4.prof")
+
+
+def test_report_aggregates_hot_functions(tmp_path):
+    profiler = profiling.Profiler(str(tmp_path))
+    for _ in range(2):
+        with profiler.profile("CreateBatch-SLOW-SOFA"):
+            handle_some_messages()
+
+    report = profiler.report(top=50, match="SLOW-SOFA")
+
+    assert report.startswith("2 profiles aggregated")
+    assert "add_batch" in report
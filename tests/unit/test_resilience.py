@@ -0,0 +1,179 @@
+import pytest
+from tenacity import RetryError
+
+from src.allocation.domain import commands
+from src.allocation.service_layer import handlers, messagebus, resilience
+from src.allocation.service_layer.unit_of_work import FakeUnitOfWork
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def failing(*args, **kwargs):
+    raise ConnectionError("redis is down")
+
+
+def make_policy(threshold=2, attempts=1):
+    clock = FakeClock()
+    # kept out of the registry, so test breakers don't show up on /metrics
+    breaker = resilience.CircuitBreaker(
+        "test",
+        failure_threshold=threshold,
+        reset_timeout=10,
+        clock=clock,
+        registry=None,
+    )
+    policy = resilience.Policy(
+        attempts=attempts,
+        wait_multiplier=0,
+        breaker=breaker,
+        fallback=resilience.FallbackQueue("test"),
+    )
+    return policy, breaker, clock
+
+
+def test_breaker_opens_after_threshold_and_fails_fast():
+    policy, breaker, _ = make_policy(threshold=2)
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        failing()
+
+    for _ in range(2):
+        with pytest.raises(RetryError):
+            policy.call(flaky)
+    assert breaker.state == breaker.OPEN
+
+    with pytest.raises(resilience.CircuitOpen):
+        policy.call(flaky)
+    assert len(calls) == 2
+    assert breaker.metrics()["rejected"] == 1
+
+
+def test_retries_stop_once_the_breaker_opens():
+    policy, breaker, _ = make_policy(threshold=2, attempts=5)
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        failing()
+
+    with pytest.raises(RetryError):
+        policy.call(flaky)
+    assert len(calls) == 2
+
+
+def test_half_open_breaker_closes_after_successful_probe():
+    policy, breaker, clock = make_policy(threshold=1)
+    with pytest.raises(RetryError):
+        policy.call(failing)
+    clock.now = 11
+    assert breaker.state == breaker.HALF_OPEN
+
+    assert policy.call(lambda: "ok") == "ok"
+    assert breaker.state == breaker.CLOSED
+
+
+def test_failed_probe_reopens_breaker():
+    policy, breaker, clock = make_policy(threshold=1)
+    with pytest.raises(RetryError):
+        policy.call(failing)
+    clock.now = 11
+
+    with pytest.raises(RetryError):
+        policy.call(failing)
+    assert breaker.state == breaker.OPEN
+    assert breaker.metrics()["times_opened"] == 2
+
+
+def test_messagebus_diverts_events_while_circuit_is_open(monkeypatch):
+    policy, breaker, _ = make_policy(threshold=1)
+    monkeypatch.setitem(
+        messagebus.HANDLER_POLICIES, handlers.publish_allocation_event, policy
+    )
+    monkeypatch.setattr(handlers.redis_eventpublisher, "publish", failing)
+    uow = FakeUnitOfWork()
+    messagebus.handle(commands.CreateBatch("b1", "FRAGILE-VASE", 100, None), uow)
+
+    for orderid in ("o1", "o2", "o3"):
+        [batchref] = messagebus.handle(
+            commands.Allocate(orderid, "FRAGILE-VASE", 1), uow
+        )
+        assert batchref == "b1"
+
+    assert breaker.state == breaker.OPEN
+    assert [e.orderid for _, e in policy.fallback.drain()] == ["o1", "o2", "o3"]
+
+
+def test_test_breakers_are_not_exported():
+    _, breaker, _ = make_policy()
+    assert breaker not in resilience.BREAKERS
+
+
+def test_diverted_events_are_replayed_once_the_circuit_closes(monkeypatch):
+    policy, breaker, clock = make_policy(threshold=1)
+    monkeypatch.setitem(
+        messagebus.HANDLER_POLICIES, handlers.publish_allocation_event, policy
+    )
+    monkeypatch.setattr(handlers.redis_eventpublisher, "publish", failing)
+    uow = FakeUnitOfWork()
+    messagebus.handle(commands.CreateBatch("b1", "FRAGILE-VASE", 100, None), uow)
+    for orderid in ("o1", "o2"):
+        messagebus.handle(commands.Allocate(orderid, "FRAGILE-VASE", 1), uow)
+    assert len(policy.fallback) == 2
+
+    published = []
+    monkeypatch.setattr(
+        handlers.redis_eventpublisher,
+        "publish",
+        lambda channel, event: published.append(event.orderid),
+    )
+    clock.now = 11
+    messagebus.handle(commands.Allocate("o3", "FRAGILE-VASE", 1), uow)
+
+    assert breaker.state == breaker.CLOSED
+    assert published == ["o3", "o1", "o2"]
+    assert len(policy.fallback) == 0
+
+
+def test_replays_are_bounded_per_successful_call(monkeypatch):
+    monkeypatch.setattr(messagebus, "REPLAY_BATCH_SIZE", 2)
+    policy, _, _ = make_policy()
+    replayed = []
+
+    def publish(orderid, uow):
+        replayed.append(orderid)
+
+    for orderid in ("o1", "o2", "o3"):
+        policy.divert(publish, orderid)
+
+    messagebus.replay_diverted(policy, [], FakeUnitOfWork())
+    assert replayed == ["o1", "o2"]
+    messagebus.replay_diverted(policy, [], FakeUnitOfWork())
+    assert replayed == ["o1", "o2", "o3"]
+
+
+def test_failed_replays_go_back_to_the_front_without_retries(monkeypatch):
+    monkeypatch.setattr(messagebus, "REPLAY_BATCH_SIZE", 2)
+    policy, breaker, _ = make_policy(threshold=1, attempts=3)
+    attempts = []
+
+    def flaky(orderid, uow):
+        attempts.append(orderid)
+        if orderid == "o1":
+            failing()
+
+    for orderid in ("o1", "o2", "o3"):
+        policy.divert(flaky, orderid)
+
+    messagebus.replay_diverted(policy, [], FakeUnitOfWork())
+
+    assert attempts == ["o1"]
+    assert breaker.state == breaker.OPEN
+    assert policy.fallback.drain() == [(flaky, "o1"), (flaky, "o2"), (flaky, "o3")]
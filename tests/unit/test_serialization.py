@@ -0,0 +1,73 @@
+from datetime import date
+
+import pytest
+
+from src.allocation.domain import commands, events
+from src.allocation.adapters import serialization
+
+
+def test_events_round_trip_through_json():
+    event = events.Allocated(orderid="o1", sku="RED-CHAIR", qty=10, batchref="b1")
+    data = serialization.dumps(event, codec="json")
+    assert serialization.decode(data) == event
+
+
+def test_payload_is_flat_and_versioned():
+    event = events.Allocated(orderid="o1", sku="RED-CHAIR", qty=10, batchref="b1")
+    payload = serialization.loads(serialization.dumps(event, codec="json"))
+    assert payload["orderid"] == "o1"
+    assert payload["batchref"] == "b1"
+    assert payload["_type"] == "Allocated"
+    assert payload["_v"] == serialization.SCHEMA_VERSION
+
+
+def test_dates_are_encoded_as_iso_strings():
+    cmd = commands.CreateBatch("b1", "RED-CHAIR", 100, eta=date(2011, 1, 2))
+    payload = serialization.to_dict(cmd)
+    assert payload["eta"] == "2011-01-02"
+    assert serialization.from_dict(payload) == cmd
+
+
+def test_optional_fields_may_be_omitted():
+    decoded = serialization.from_dict(
+        {"ref": "b1", "sku": "RED-CHAIR", "qty": 100}, commands.CreateBatch
+    )
+    assert decoded == commands.CreateBatch("b1", "RED-CHAIR", 100, None)
+
+
+def test_omitted_fields_decode_to_their_declared_defaults():
+    decoded = serialization.from_dict(
+        {"orderid": "o1", "sku": "RED-CHAIR", "qty": 10}, commands.Allocate
+    )
+    assert decoded.wait is False
+    assert decoded.idempotency_key is None
+
+    decoded = serialization.from_dict(
+        {"sku": "RED-CHAIR", "as_of": "2026-01-01"}, commands.ArchiveBatches
+    )
+    assert decoded == commands.ArchiveBatches("RED-CHAIR", date(2026, 1, 1))
+    assert decoded.grace_days == 0
+
+
+def test_required_fields_may_not_be_omitted():
+    with pytest.raises(serialization.SerializationError, match="'qty'"):
+        serialization.from_dict({"ref": "b1", "sku": "RED-CHAIR"}, commands.CreateBatch)
+
+
+def test_unversioned_legacy_payloads_are_accepted():
+    payload = serialization.loads(b'{"batchref": "b1", "qty": 5}')
+    assert payload == {"batchref": "b1", "qty": 5}
+
+
+def test_newer_schema_versions_are_rejected():
+    with pytest.raises(serialization.IncompatibleSchema):
+        serialization.loads(b'{"batchref": "b1", "qty": 5, "_v": 999}')
+
+
+def test_events_round_trip_through_msgpack():
+    if "msgpack" not in serialization.CODECS:
+        pytest.skip("msgpack not installed")
+    event = events.OutOfStock(sku="RED-CHAIR")
+    data = serialization.dumps(event, codec="msgpack")
+    assert not data.startswith(b"{")
+    assert serialization.decode(data) == event
@@ -0,0 +1,156 @@
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from src.allocation.domain import strategies
+from src.allocation.domain.model import Batch, OrderLine, Product
+
+today = date.today()
+tomorrow = today + timedelta(days=1)
+later = today + timedelta(days=10)
+
+
+def make_product(strategy, *batches):
+    return Product("WOBBLY-DESK", list(batches), allocation_strategy=strategy)
+
+
+def test_earliest_eta_is_the_default():
+    product = Product(
+        "WOBBLY-DESK",
+        [
+            Batch("late", "WOBBLY-DESK", 100, later),
+            Batch("now", "WOBBLY-DESK", 5, None),
+        ],
+    )
+    assert product.allocate(OrderLine("o1", "WOBBLY-DESK", 10)) == "late"
+    assert product.allocate(OrderLine("o2", "WOBBLY-DESK", 5)) == "now"
+
+
+def test_best_fit_picks_the_smallest_batch_that_fits():
+    product = make_product(
+        "best_fit",
+        Batch("big", "WOBBLY-DESK", 100, None),
+        Batch("snug", "WOBBLY-DESK", 12, later),
+        Batch("small", "WOBBLY-DESK", 5, None),
+    )
+    assert product.allocate(OrderLine("o1", "WOBBLY-DESK", 10)) == "snug"
+    # only 2 left in "snug" now
+    assert product.allocate(OrderLine("o2", "WOBBLY-DESK", 3)) == "small"
+
+
+def test_in_stock_largest_prefers_in_stock_batches_then_the_largest():
+    product = make_product(
+        "in_stock_largest",
+        Batch("shipment", "WOBBLY-DESK", 1000, tomorrow),
+        Batch("small", "WOBBLY-DESK", 20, None),
+        Batch("large", "WOBBLY-DESK", 30, None),
+    )
+    assert product.allocate(OrderLine("o1", "WOBBLY-DESK", 15)) == "large"
+    assert product.allocate(OrderLine("o2", "WOBBLY-DESK", 15)) == "small"
+    assert product.allocate(OrderLine("o3", "WOBBLY-DESK", 25)) == "shipment"
+
+
+def test_index_follows_deallocation_and_quantity_changes():
+    product = make_product(
+        "best_fit",
+        Batch("b1", "WOBBLY-DESK", 10, None),
+        Batch("b2", "WOBBLY-DESK", 50, None),
+    )
+    line = OrderLine("o1", "WOBBLY-DESK", 10)
+    assert product.allocate(line) == "b1"
+    product.deallocate(line)
+    assert product.allocate(OrderLine("o2", "WOBBLY-DESK", 10)) == "b1"
+
+    product.change_batch_quantity("b2", 15)
+    assert product.allocate(OrderLine("o3", "WOBBLY-DESK", 12)) == "b2"
+
+
+def test_index_is_rebuilt_when_batches_are_added():
+    product = make_product("best_fit", Batch("b1", "WOBBLY-DESK", 100, None))
+    product.allocate(OrderLine("o1", "WOBBLY-DESK", 1))
+    product.add_batch(Batch("b2", "WOBBLY-DESK", 5, None))
+    assert product.allocate(OrderLine("o2", "WOBBLY-DESK", 5)) == "b2"
+
+
+def test_strategy_can_be_changed():
+    product = make_product(
+        "earliest_eta",
+        Batch("big", "WOBBLY-DESK", 100, None),
+        Batch("small", "WOBBLY-DESK", 10, None),
+    )
+    assert product.allocate(OrderLine("o1", "WOBBLY-DESK", 5)) == "big"
+    product.change_allocation_strategy("best_fit")
+    assert product.allocate(OrderLine("o2", "WOBBLY-DESK", 5)) == "small"
+
+
+def test_unknown_strategies_are_rejected():
+    product = make_product("earliest_eta")
+    with pytest.raises(strategies.UnknownStrategy):
+        product.change_allocation_strategy("cheapest")
+    assert product.allocation_strategy == "earliest_eta"
+
+
+# reference implementations: a full scan of the batches
+def scan_earliest_eta(batches, qty):
+    fits = [b for b in batches if b.available_quantity >= qty]
+    return min(fits, key=strategies.eta_key, default=None)
+
+
+def scan_best_fit(batches, qty):
+    fits = [b for b in batches if b.available_quantity >= qty]
+    return min(
+        fits,
+        key=lambda b: (b.available_quantity, strategies.eta_key(b), batches.index(b)),
+        default=None,
+    )
+
+
+def scan_in_stock_largest(batches, qty):
+    for group in (
+        [b for b in batches if b.eta is None],
+        [b for b in batches if b.eta is not None],
+    ):
+        fits = [b for b in group if b.available_quantity >= qty]
+        if fits:
+            return min(
+                fits,
+                key=lambda b: (
+                    -b.available_quantity,
+                    strategies.eta_key(b),
+                    batches.index(b),
+                ),
+            )
+    return None
+
+
+@pytest.mark.parametrize(
+    "name, scan",
+    [
+        ("earliest_eta", scan_earliest_eta),
+        ("best_fit", scan_best_fit),
+        ("in_stock_largest", scan_in_stock_largest),
+    ],
+)
+def test_indexed_choice_matches_a_full_scan(name, scan):
+    rng = random.Random(name)
+    batches = [
+        Batch(
+            f"b{i}",
+            "WOBBLY-DESK",
+            rng.randint(1, 50),
+            rng.choice([None, today + timedelta(days=rng.randint(0, 5))]),
+        )
+        for i in range(40)
+    ]
+    product = make_product(name, *batches)
+    allocated = []
+    for i in range(300):
+        if allocated and rng.random() < 0.3:
+            product.deallocate(allocated.pop(rng.randrange(len(allocated))))
+            continue
+        line = OrderLine(f"o{i}", "WOBBLY-DESK", rng.randint(1, 20))
+        expected = scan(batches, line.qty)
+        assert product.allocate(line) == (expected and expected.reference)
+        if expected is not None:
+            allocated.append(line)
@@ -0,0 +1,82 @@
+from datetime import date, timedelta
+
+import pytest
+
+from src.allocation.domain import events
+from src.allocation.domain.model import OrderLine, Product
+from src.allocation.domain.striping import Stripe, StripedStock, rebalance, split
+
+later = date.today() + timedelta(days=10)
+
+
+def first(stripes):
+    return stripes[0]
+
+
+def last(stripes):
+    return stripes[-1]
+
+
+def test_split_spreads_the_remainder_over_the_first_stripes():
+    assert split(10, 4) == [3, 3, 2, 2]
+    assert split(2, 4) == [1, 1, 0, 0]
+    assert sum(split(1001, 7)) == 1001
+
+
+def test_allocates_from_the_earliest_batch_with_a_stripe_that_fits():
+    stock = StripedStock(
+        "HOT-SKU",
+        [
+            Stripe(1, 10, "shipment", 0, later, 50),
+            Stripe(2, 20, "in-stock", 0, None, 3),
+            Stripe(3, 20, "in-stock", 1, None, 4),
+        ],
+        choice=first,
+    )
+
+    assert stock.allocate(OrderLine("o1", "HOT-SKU", 4)) == "in-stock"
+    # 3 left in each in-stock stripe: 5 only fits the shipment
+    assert stock.allocate(OrderLine("o2", "HOT-SKU", 5)) == "shipment"
+    assert [(s.id, l.orderid) for s, l in stock.allocations] == [(3, "o1"), (1, "o2")]
+    assert [s.available for s in stock.stripes] == [45, 3, 0]
+
+
+def test_spreads_allocations_over_the_batchs_stripes():
+    stripes = [Stripe(i, 10, "b1", i, None, 10) for i in range(4)]
+    stock = StripedStock("HOT-SKU", stripes, choice=last)
+
+    stock.allocate(OrderLine("o1", "HOT-SKU", 1))
+    stock.allocate(OrderLine("o2", "HOT-SKU", 10))
+
+    assert [s.available for s in stripes] == [10, 10, 0, 9]
+
+
+def test_raises_events_like_a_product():
+    stock = StripedStock("HOT-SKU", [Stripe(1, 10, "b1", 0, None, 2)])
+
+    assert stock.allocate(OrderLine("o1", "HOT-SKU", 2)) == "b1"
+    assert stock.allocate(OrderLine("o2", "HOT-SKU", 1)) is None
+    assert stock.events == [
+        events.Allocated("o1", "HOT-SKU", 2, "b1"),
+        events.OutOfStock("HOT-SKU"),
+    ]
+
+
+def test_rebalance_evens_out_each_batch_keeping_its_total():
+    stripes = [
+        Stripe(1, 10, "b1", 0, None, 0),
+        Stripe(2, 10, "b1", 1, None, 9),
+        Stripe(3, 20, "b2", 0, None, 1),
+    ]
+    assert rebalance(stripes) == {1: 5, 2: 4, 3: 1}
+
+
+def test_changing_stripes_raises_an_event():
+    product = Product("HOT-SKU", [], version_number=3)
+    product.change_stripes(8)
+
+    assert product.stripes == 8
+    assert product.version_number == 4
+    assert product.events == [events.StripesChanged("HOT-SKU", 8)]
+    with pytest.raises(ValueError):
+        product.change_stripes(-1)
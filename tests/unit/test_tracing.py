@@ -0,0 +1,149 @@
+import pytest
+
+from src.utils import tracing
+from src.allocation.domain import commands
+from src.allocation.adapters import redis_eventpublisher, serialization
+from src.allocation.service_layer import messagebus
+from src.allocation.service_layer.unit_of_work import FakeUnitOfWork
+
+
+@pytest.fixture
+def exporter():
+    exporter = tracing.InMemoryExporter()
+    tracing.configure(exporter, sample_rate=1.0)
+    yield exporter
+    tracing.configure(tracing.NullExporter(), sample_rate=0.0)
+
+
+@pytest.fixture
+def published(monkeypatch):
+    messages = []
+    monkeypatch.setattr(
+        redis_eventpublisher.r, "publish", lambda ch, data: messages.append(data)
+    )
+    return messages
+
+
+def allocate_with_fake_uow():
+    uow = FakeUnitOfWork()
+    messagebus.handle(commands.CreateBatch("b1", "TRACED-LAMP", 100, None), uow)
+    messagebus.handle(commands.Allocate("o1", "TRACED-LAMP", 10), uow)
+
+
+def test_allocation_spans_share_a_trace_and_nest(exporter, published):
+    allocate_with_fake_uow()
+
+    spans = {s.name: s for s in exporter.spans}
+    allocate = [s for s in exporter.spans if s.name == "allocate"]
+    assert len(allocate) == 1
+    trace_id = allocate[0].trace_id
+    for name in (
+        "handle_command",
+        "repository.get",
+        "handle_event",
+        "publish_allocation_event",
+        "redis.publish",
+    ):
+        assert spans[name].trace_id == trace_id, name
+
+    by_id = {s.span_id: s for s in exporter.spans}
+    assert by_id[spans["repository.get"].parent_id].name == "allocate"
+    assert by_id[spans["redis.publish"].parent_id].name == "publish_allocation_event"
+
+
+def test_published_events_carry_the_trace_id(exporter, published):
+    allocate_with_fake_uow()
+
+    [data] = published
+    payload = serialization.loads(data)
+    [publish_span] = [s for s in exporter.spans if s.name == "redis.publish"]
+    assert payload[serialization.TRACE_KEY] == (
+        f"00-{publish_span.trace_id}-{publish_span.span_id}-01"
+    )
+    # the extra key doesn't get in the way of decoding
+    assert serialization.from_dict(payload).orderid == "o1"
+
+
+def test_consumer_continues_the_publishers_trace(exporter):
+    with tracing.span("producer") as producer:
+        header = tracing.traceparent()
+
+    with tracing.continue_trace(header, "redis.consume") as consumer:
+        pass
+
+    assert consumer.trace_id == producer.trace_id
+    assert consumer.parent_id == producer.span_id
+
+
+def test_malformed_traceparent_starts_a_new_trace(exporter):
+    with tracing.continue_trace("garbage", "redis.consume") as span:
+        pass
+    assert span.parent_id is None
+    assert span.sampled
+
+
+def test_unsampled_traces_cost_nothing_and_are_not_exported(published):
+    exporter = tracing.InMemoryExporter()
+    tracing.configure(exporter, sample_rate=0.0)
+    allocate_with_fake_uow()
+
+    assert exporter.spans == []
+    with tracing.span("unsampled") as span:
+        assert span is tracing.NOOP_SPAN
+        assert tracing.current_span() is None
+    [data] = published
+    assert serialization.TRACE_KEY not in serialization.loads(data)
+
+
+def test_children_of_unsampled_spans_are_not_sampled(monkeypatch):
+    exporter = tracing.InMemoryExporter()
+    tracing.configure(exporter, sample_rate=0.5)
+    rolls = iter([0.9, 0.0, 0.0])
+    monkeypatch.setattr(tracing.random, "random", lambda: next(rolls))
+    try:
+        with tracing.span("unsampled"):
+            with tracing.span("child"):
+                with tracing.span("grandchild"):
+                    assert tracing.traceparent() is None
+        with tracing.span("sampled"):
+            pass
+    finally:
+        tracing.configure(tracing.NullExporter(), sample_rate=0.0)
+
+    assert [s.name for s in exporter.spans] == ["sampled"]
+
+
+def test_unsampled_remote_parents_are_honoured(exporter):
+    header = "00-" + "a" * 32 + "-" + "b" * 16 + "-00"
+    with tracing.continue_trace(header, "redis.consume"):
+        with tracing.span("child"):
+            pass
+    assert exporter.spans == []
+
+
+def test_errors_are_recorded_on_the_span(exporter):
+    with pytest.raises(ValueError):
+        with tracing.span("failing"):
+            raise ValueError("boom")
+    [span] = exporter.spans
+    assert "boom" in span.error
+
+
+def test_file_exporter_writes_json_lines(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    exporter = tracing.FileExporter(str(path))
+    tracing.configure(exporter, sample_rate=1.0)
+    try:
+        with tracing.span("outer", sku="RED-CHAIR"):
+            with tracing.span("inner"):
+                pass
+    finally:
+        # closes the exporter's file
+        tracing.configure(tracing.NullExporter(), sample_rate=0.0)
+
+    assert exporter._file.closed
+
+    lines = path.read_text().splitlines()
+    assert len(lines) == 2
+    assert '"name": "inner"' in lines[0]
+    assert '"sku": "RED-CHAIR"' in lines[1]
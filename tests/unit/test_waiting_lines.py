@@ -0,0 +1,103 @@
+from src.allocation.domain import commands, events
+from src.allocation.domain.model import Batch, OrderLine, Product, WaitingLine
+from src.allocation.service_layer import messagebus
+from src.allocation.service_layer.unit_of_work import FakeUnitOfWork
+
+
+def waiting_orderids(product):
+    return [line.orderid for line in product.waiting]
+
+
+def test_lines_that_dont_fit_are_only_queued_when_asked_to():
+    product = Product("SCARCE-LAMP", [Batch("b1", "SCARCE-LAMP", 5, eta=None)])
+
+    assert product.allocate(OrderLine("o1", "SCARCE-LAMP", 10)) is None
+    assert product.allocate(OrderLine("o2", "SCARCE-LAMP", 10), wait=True) is None
+
+    assert product.waiting == [WaitingLine("o2", "SCARCE-LAMP", 10)]
+    assert product.events[-1] == events.LineQueued("o2", "SCARCE-LAMP", 10)
+
+
+def test_new_stock_is_given_to_waiting_lines_in_order_of_arrival():
+    product = Product("SCARCE-TABLE", [])
+    for orderid, qty in [("o1", 3), ("o2", 8), ("o3", 2), ("o4", 6)]:
+        product.allocate(OrderLine(orderid, "SCARCE-TABLE", qty), wait=True)
+
+    product.add_batch(Batch("b1", "SCARCE-TABLE", 10, eta=None))
+
+    # o2 doesn't fit once o1 is in, but keeps its place ahead of o4
+    assert waiting_orderids(product) == ["o2", "o4"]
+    assert [
+        (e.orderid, e.batchref)
+        for e in product.events
+        if isinstance(e, events.Allocated)
+    ] == [("o1", "b1"), ("o3", "b1")]
+    assert product.batches[0].available_quantity == 5
+
+    product.change_batch_quantity("b1", 13)
+
+    assert waiting_orderids(product) == ["o4"]
+    assert product.batches[0].available_quantity == 0
+
+
+def test_matching_stops_when_stock_runs_out():
+    product = Product("SCARCE-CHAIR", [])
+    for i in range(100):
+        product.allocate(OrderLine(f"o{i}", "SCARCE-CHAIR", 1), wait=True)
+
+    product.add_batch(Batch("b1", "SCARCE-CHAIR", 10, eta=None))
+
+    assert waiting_orderids(product) == [f"o{i}" for i in range(10, 100)]
+
+
+def test_retried_lines_are_not_queued_twice():
+    product = Product("SCARCE-RUG", [])
+    line = OrderLine("o1", "SCARCE-RUG", 2)
+    product.allocate(line, wait=True)
+    product.allocate(line, wait=True)
+    assert waiting_orderids(product) == ["o1"]
+
+    product.add_batch(Batch("b1", "SCARCE-RUG", 10, eta=None))
+
+    assert product.allocate(line, wait=True) == "b1"
+    assert product.batches[0].available_quantity == 8
+
+
+def test_deallocating_a_waiting_line_takes_it_out_of_the_queue():
+    product = Product("SCARCE-SOFA", [])
+    product.allocate(OrderLine("o1", "SCARCE-SOFA", 2), wait=True)
+
+    assert product.deallocate(OrderLine("o1", "SCARCE-SOFA", 2)) is None
+
+    assert product.waiting == []
+    assert product.events[-1] == events.LineUnqueued("o1", "SCARCE-SOFA", 2)
+
+
+def test_replay_rebuilds_the_queue():
+    product = Product("SCARCE-DESK", [])
+    for orderid in ("o1", "o2", "o3"):
+        product.allocate(OrderLine(orderid, "SCARCE-DESK", 4), wait=True)
+    product.deallocate(OrderLine("o3", "SCARCE-DESK", 4))
+    product.add_batch(Batch("b1", "SCARCE-DESK", 5, eta=None))
+
+    rebuilt = Product("SCARCE-DESK", [])
+    rebuilt.replay(product.events)
+
+    assert rebuilt.waiting == product.waiting == [WaitingLine("o2", "SCARCE-DESK", 4)]
+
+
+def test_waiting_lines_are_allocated_in_the_same_unit_of_work_as_the_new_batch():
+    uow = FakeUnitOfWork()
+    messagebus.handle(commands.CreateBatch("b1", "SCARCE-MIRROR", 1), uow)
+    [result] = messagebus.handle(
+        commands.Allocate("o1", "SCARCE-MIRROR", 5, wait=True), uow
+    )
+    assert result is None
+    uow.committed = False
+
+    messagebus.handle(commands.CreateBatch("b2", "SCARCE-MIRROR", 10), uow)
+
+    product = uow.products.get("SCARCE-MIRROR")
+    assert product.waiting == []
+    assert product.batches[1].available_quantity == 5
+    assert uow.committed